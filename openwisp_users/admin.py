@@ -7,17 +7,21 @@ from django import forms
 from django.apps import apps
 from django.conf import settings
 from django.contrib import admin, messages
+from django.contrib.admin import helpers
 from django.contrib.admin.actions import delete_selected
 from django.contrib.admin.sites import NotRegistered
 from django.contrib.admin.utils import model_ngettext
+from django.contrib.admin.widgets import AutocompleteSelect
 from django.contrib.auth import get_user_model
 from django.contrib.auth.admin import GroupAdmin as BaseGroupAdmin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from django.contrib.auth.forms import UserChangeForm as BaseUserChangeForm
 from django.contrib.auth.forms import UserCreationForm as BaseUserCreationForm
-from django.core.exceptions import ValidationError
+from django.core.exceptions import PermissionDenied, ValidationError
+from django.db import models
+from django.db.models import Count, Exists, OuterRef, Q
 from django.forms.models import BaseInlineFormSet
-from django.http import HttpResponseRedirect
+from django.http import HttpResponseRedirect, StreamingHttpResponse
 from django.template.response import TemplateResponse
 from django.urls import reverse
 from django.utils.translation import ngettext
@@ -33,6 +37,8 @@ from phonenumber_field.formfields import PhoneNumberField
 from swapper import load_model
 
 from . import settings as app_settings
+from .export import EXPORT_FORMATS, export_users, get_export_rows
+from .jobs import pop_user_jobs, start_job
 from .multitenancy import MultitenantAdminMixin
 from .utils import BaseAdmin
 
@@ -42,6 +48,8 @@ OrganizationOwner = load_model('openwisp_users', 'OrganizationOwner')
 OrganizationUser = load_model('openwisp_users', 'OrganizationUser')
 User = get_user_model()
 logger = logging.getLogger(__name__)
+# RESTRICT is available since django 3.1
+PROTECTED_ON_DELETE = (models.PROTECT, getattr(models, 'RESTRICT', models.PROTECT))
 
 
 class EmailAddressInline(admin.StackedInline):
@@ -111,7 +119,7 @@ class OrganizationUserInline(admin.StackedInline):
             formset.form.base_fields[
                 'organization'
             ].queryset = Organization.objects.filter(
-                pk__in=request.user.organizations_managed
+                pk__in=request.user.get_organizations_lookup('organizations_managed')
             )
         return formset
 
@@ -206,8 +214,15 @@ class UserAdmin(MultitenantAdminMixin, BaseUserAdmin, BaseAdmin):
     ]
     inlines = [EmailAddressInline, OrganizationUserInline]
     save_on_top = True
-    actions = ['delete_selected_overridden', 'make_inactive', 'make_active']
+    actions = [
+        'delete_selected_overridden',
+        'make_inactive',
+        'make_active',
+        'export_csv',
+        'export_ndjson',
+    ]
     fieldsets = list(BaseUserAdmin.fieldsets)
+    approximate_count = app_settings.ADMIN_APPROXIMATE_COUNT
 
     # To ensure extended apps use this template.
     change_form_template = 'admin/openwisp_users/user/change_form.html'
@@ -222,16 +237,8 @@ class UserAdmin(MultitenantAdminMixin, BaseUserAdmin, BaseAdmin):
         """
 
         def wrapper(modeladmin, request, queryset):
-            opts = modeladmin.model._meta
             if request.POST.get('confirmation') is None:
-                request.current_app = modeladmin.admin_site.name
-                context = {
-                    **modeladmin.admin_site.each_context(request),
-                    'title': _('Are you sure?'),
-                    'action': request.POST['action'],
-                    'queryset': queryset,
-                    'opts': opts,
-                }
+                context = modeladmin.get_action_confirmation_context(request, queryset)
                 return TemplateResponse(
                     request, 'admin/action_confirmation.html', context
                 )
@@ -240,8 +247,98 @@ class UserAdmin(MultitenantAdminMixin, BaseUserAdmin, BaseAdmin):
         wrapper.__name__ = func.__name__
         return wrapper
 
+    # maximum amount of users listed in the confirmation page of the actions
+    action_confirmation_preview_size = 100
+    # shown when the jobs started by the bulk actions are completed
+    job_messages = {
+        'make_active': _('Successfully made {count} {items} active.'),
+        'make_inactive': _('Successfully made {count} {items} inactive.'),
+        'delete': _('Successfully deleted {count} {items}.'),
+    }
+
+    def get_action_confirmation_context(self, request, queryset, count=None):
+        opts = self.model._meta
+        request.current_app = self.admin_site.name
+        if count is None:
+            count = queryset.count()
+        # only a limited amount of users is shown
+        preview = list(
+            queryset.values_list(opts.model.USERNAME_FIELD, flat=True)[
+                : self.action_confirmation_preview_size
+            ]
+        )
+        return {
+            **self.admin_site.each_context(request),
+            'title': _('Are you sure?'),
+            'action': request.POST['action'],
+            'count': count,
+            'preview': preview,
+            'remaining': count - len(preview),
+            # the selection is passed on as it was received,
+            # "select all" is not expanded to the list of all pks
+            'select_across': request.POST.get('select_across') == '1',
+            'selected': request.POST.getlist(helpers.ACTION_CHECKBOX_NAME),
+            'opts': opts,
+        }
+
+    def start_job(self, request, queryset, action):
+        """
+        performs the bulk action in background if the selection
+        exceeds ``OPENWISP_USERS_BULK_ACTION_BATCH_SIZE``,
+        returns ``True`` if a job has been started
+        """
+        count = queryset.count()
+        if count <= app_settings.BULK_ACTION_BATCH_SIZE:
+            return False
+        start_job(action, queryset, request.user, self.admin_site.name)
+        self.message_user(
+            request,
+            _(
+                'The action is being performed on {count} {items} in background, '
+                'its progress is shown in this page.'
+            ).format(count=count, items=model_ngettext(self.opts, count)),
+            messages.INFO,
+        )
+        return True
+
+    def report_jobs(self, request):
+        """
+        shows the progress or the result of the jobs started by the user
+        """
+        for job in pop_user_jobs(request.user):
+            if job['status'] == 'completed':
+                count = job['affected']
+                message = self.job_messages[job['action']].format(
+                    count=count, items=model_ngettext(self.opts, count)
+                )
+                level = messages.SUCCESS
+            elif job['status'] == 'failed':
+                message = _(
+                    'The action failed after processing {processed} of {total} '
+                    '{items}: {error}'
+                )
+                level = messages.ERROR
+            else:
+                message = _(
+                    'The action is in progress: {processed} of {total} {items} '
+                    'processed.'
+                )
+                level = messages.INFO
+            if level != messages.SUCCESS:
+                message = message.format(
+                    items=model_ngettext(self.opts, job['total']), **job
+                )
+            self.message_user(request, message, level)
+
+    def changelist_view(self, request, extra_context=None):
+        if request.method == 'GET':
+            self.report_jobs(request)
+        return super().changelist_view(request, extra_context)
+
     @require_confirmation
     def make_inactive(self, request, queryset):
+        if self.start_job(request, queryset, 'make_inactive'):
+            return
         queryset.update(is_active=False)
         count = queryset.count()
         if count:
@@ -258,6 +355,8 @@ class UserAdmin(MultitenantAdminMixin, BaseUserAdmin, BaseAdmin):
 
     @require_confirmation
     def make_active(self, request, queryset):
+        if self.start_job(request, queryset, 'make_active'):
+            return
         queryset.update(is_active=True)
         count = queryset.count()
         if count:
@@ -272,6 +371,51 @@ class UserAdmin(MultitenantAdminMixin, BaseUserAdmin, BaseAdmin):
 
     make_active.short_description = _('Flag selected users as active')
 
+    def export_response(self, request, queryset, export_format):
+        """
+        streams the selected users along with their organization roles,
+        operators only get the organizations they manage
+        """
+        organizations = None
+        if not request.user.is_superuser:
+            organizations = request.user.get_organizations_lookup(
+                'organizations_managed'
+            )
+        rows = get_export_rows(queryset, organizations)
+        response = StreamingHttpResponse(
+            export_users(rows, export_format),
+            content_type=EXPORT_FORMATS[export_format],
+        )
+        response['Content-Disposition'] = 'attachment; filename="users.{}"'.format(
+            export_format
+        )
+        return response
+
+    def export_csv(self, request, queryset):
+        return self.export_response(request, queryset, 'csv')
+
+    export_csv.short_description = _('Export selected users (CSV)')
+
+    def export_ndjson(self, request, queryset):
+        return self.export_response(request, queryset, 'ndjson')
+
+    export_ndjson.short_description = _('Export selected users (NDJSON)')
+
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        if request.user.is_superuser:
+            return queryset
+        # takes the place of the cached property of the same name,
+        # used by user_not_allowed_to_change_owner for each object
+        return queryset.annotate(
+            is_owner_of_any_organization=Exists(
+                OrganizationOwner.objects.filter(
+                    organization_user__user=OuterRef('pk'),
+                    organization__is_active=True,
+                )
+            )
+        )
+
     def get_list_display(self, request):
         """
         Hide `is_superuser` from column from operators
@@ -284,6 +428,15 @@ class UserAdmin(MultitenantAdminMixin, BaseUserAdmin, BaseAdmin):
             return operators_list_display
         return default_list_display
 
+    @property
+    def media(self):
+        media = super().media
+        # adds the static files needed by the list filters (if any)
+        for list_filter in self.list_filter:
+            if hasattr(list_filter, 'get_media'):
+                media += list_filter.get_media(self.admin_site)
+        return media
+
     def get_list_filter(self, request):
         filters = super().get_list_filter(request)
         if not request.user.is_superuser and 'is_superuser' in filters:
@@ -375,10 +528,67 @@ class UserAdmin(MultitenantAdminMixin, BaseUserAdmin, BaseAdmin):
             # otherwise proceed but remove owners from the delete queryset
             else:
                 queryset = excluded_owners_qs
-        return delete_selected(self, request, queryset)
+        count = queryset.count()
+        if count <= app_settings.BULK_ACTION_BATCH_SIZE:
+            return delete_selected(self, request, queryset)
+        # the objects of large selections are not collected in memory
+        perms_needed, protected = self.get_bulk_deletion_problems(request, queryset)
+        if request.POST.get('post') and not protected:
+            if perms_needed:
+                raise PermissionDenied
+            self.start_job(request, queryset, 'delete')
+            return None
+        context = self.get_action_confirmation_context(request, queryset, count)
+        context.update({'perms_needed': perms_needed, 'protected': protected})
+        if perms_needed or protected:
+            context['title'] = _('Cannot delete %(name)s') % {
+                'name': self.opts.verbose_name_plural
+            }
+        return TemplateResponse(request, 'admin/action_confirmation.html', context)
 
     delete_selected_overridden.short_description = delete_selected.short_description
 
+    def get_bulk_deletion_problems(self, request, queryset):
+        """
+        set based counterpart of ``get_deleted_objects`` used for large
+        selections: the relations are followed with subqueries instead
+        of collecting the related objects, returns the names of the models
+        which the user is not allowed to delete and the amount of the
+        protected objects of each model
+        """
+        perms_needed = set()
+        protected = []
+        if not self.has_delete_permission(request):
+            perms_needed.add(self.opts.verbose_name)
+        pending = [queryset]
+        visited = set()
+        while pending:
+            parent_queryset = pending.pop()
+            for relation in parent_queryset.model._meta.related_objects:
+                if relation.many_to_many or relation in visited:
+                    continue
+                visited.add(relation)
+                related_model = relation.related_model
+                related_queryset = related_model._base_manager.filter(
+                    **{f'{relation.field.name}__in': parent_queryset}
+                )
+                if relation.on_delete in PROTECTED_ON_DELETE:
+                    count = related_queryset.count()
+                    if count:
+                        protected.append(
+                            f'{count} {model_ngettext(related_model._meta, count)}'
+                        )
+                    continue
+                if relation.on_delete is not models.CASCADE:
+                    continue
+                if not related_queryset.exists():
+                    continue
+                model_admin = self.admin_site._registry.get(related_model)
+                if model_admin and not model_admin.has_delete_permission(request):
+                    perms_needed.add(related_model._meta.verbose_name)
+                pending.append(related_queryset)
+        return sorted(perms_needed), protected
+
     def get_inline_instances(self, request, obj=None):
         """
         1. Avoid displaying inline objects when adding a new user
@@ -470,7 +680,7 @@ class OrganizationUserFilter(admin.SimpleListFilter):
         organizations = Organization.objects.all()
         if not request.user.is_superuser:
             organizations = organizations.filter(
-                pk__in=request.user.organizations_managed
+                pk__in=request.user.get_organizations_lookup('organizations_managed')
             )
         lookups = []
         for org in organizations:
@@ -482,12 +692,83 @@ class OrganizationUserFilter(admin.SimpleListFilter):
 
     def queryset(self, request, queryset):
         if self.value():
+            # the related query name depends on the app of OrganizationUser
+            related_name = OrganizationUser._meta.get_field('user').related_query_name()
             queryset = queryset.filter(
-                openwisp_users_organizationuser__organization=self.value()
+                **{f'{related_name}__organization': self.value()}
             )
         return queryset
 
 
+class OrganizationUserAutocompleteFilter(OrganizationUserFilter):
+    """
+    Same as ``OrganizationUserFilter``, but the organization is chosen
+    with a search-as-you-type widget which loads the organizations
+    from the autocomplete view of the organization admin (which shows
+    only the organizations managed by the user) one page at a time
+    """
+
+    template = 'admin/openwisp_users/autocomplete_filter.html'
+
+    def lookups(self, request, model_admin):
+        user = request.user
+        self.admin_site = model_admin.admin_site
+        self.organizations = Organization.objects.all()
+        if not user.is_superuser:
+            self.organizations = self.organizations.filter(
+                pk__in=user.get_organizations_lookup('organizations_managed')
+            )
+        # show filter only if multiple orgs are accessible
+        self.show = user.is_superuser or len(user.organizations_managed) > 1
+        # the options are loaded by the widget
+        return tuple()
+
+    def has_output(self):
+        return self.show
+
+    @classmethod
+    def get_widget(cls, admin_site, attrs=None):
+        rel = OrganizationUser._meta.get_field('organization').remote_field
+        return AutocompleteSelect(rel, admin_site, attrs=attrs)
+
+    @classmethod
+    def get_media(cls, admin_site):
+        media = cls.get_widget(admin_site).media
+        return media + forms.Media(js=['openwisp-users/js/autocomplete-filter.js'])
+
+    def choices(self, changelist):
+        widget = self.get_widget(
+            self.admin_site,
+            attrs={
+                'id': f'id_filter_{self.parameter_name}',
+                'class': 'ow-autocomplete-filter',
+                'data-parameter': self.parameter_name,
+                'data-query-string': changelist.get_query_string(
+                    remove=[self.parameter_name]
+                ),
+            }
+        )
+        # only the selected organization is loaded from the database
+        field = forms.ModelChoiceField(
+            queryset=self.organizations, widget=widget, required=False
+        )
+        try:
+            selected = field.clean(self.value())
+        except ValidationError:
+            selected = None
+        yield {
+            'selected': selected is not None,
+            'display': str(selected) if selected else _('All'),
+            'widget': field.widget.render(self.parameter_name, self.value()),
+        }
+
+
+if app_settings.ORGANIZATION_AUTOCOMPLETE_FILTER:
+    organization_user_filter = OrganizationUserAutocompleteFilter
+else:
+    organization_user_filter = OrganizationUserFilter
+
+
 base_fields = list(UserAdmin.fieldsets[1][1]['fields'])
 additional_fields = ['bio', 'url', 'company', 'location', 'phone_number', 'birth_date']
 UserAdmin.fieldsets[1][1]['fields'] = base_fields + additional_fields
@@ -499,7 +780,7 @@ UserAdmin.add_fieldsets[0][1]['fields'] = (
     'password2',
 )
 UserAdmin.search_fields += ('phone_number',)
-UserAdmin.list_filter = (OrganizationUserFilter,) + UserAdmin.list_filter
+UserAdmin.list_filter = (organization_user_filter,) + UserAdmin.list_filter
 
 
 class GroupAdmin(BaseGroupAdmin, BaseAdmin):
@@ -516,6 +797,7 @@ class OrganizationAdmin(
     inlines = [OrganizationOwnerInline]
     readonly_fields = ['uuid', 'created', 'modified']
     ordering = ['name']
+    approximate_count = app_settings.ADMIN_APPROXIMATE_COUNT
 
     def get_inline_instances(self, request, obj=None):
         """
@@ -546,6 +828,7 @@ class OrganizationUserAdmin(
 ):
     view_on_site = False
     actions = ['delete_selected_overridden']
+    approximate_count = app_settings.ADMIN_APPROXIMATE_COUNT
 
     def get_readonly_fields(self, request, obj=None):
         # retrieve readonly fields
@@ -592,14 +875,15 @@ class OrganizationUserAdmin(
         return actions
 
     def delete_selected_overridden(self, request, queryset):
-        count = 0
-        pks = []
-        for obj in queryset:
-            if obj.user.is_owner(obj.organization_id):
-                pks.append(obj.pk)
-                count += 1
+        # org users which belong to owners are counted with a join,
+        # as in ``is_owner`` the owners of disabled organizations are ignored
+        is_owner = Q(organizationowner__isnull=False, organization__is_active=True)
+        counts = queryset.aggregate(
+            total=Count('pk'), owners=Count('organizationowner', filter=is_owner)
+        )
+        count = counts['owners']
         # if trying to delete only org users which belong to owners, stop here
-        if count and count == queryset.count():
+        if count and count == counts['total']:
             self.message_user(
                 request,
                 _("Can't delete organization users which belong to owners."),
@@ -610,8 +894,8 @@ class OrganizationUserAdmin(
             )
             return HttpResponseRedirect(redirect_url)
         # if some org owners' org users were selected
-        if count and count != queryset.count():
-            queryset = queryset.exclude(pk__in=pks)
+        if count:
+            queryset = queryset.exclude(is_owner)
             single_msg = (
                 f"Can't delete {count} organization user because it "
                 'belongs to an organization owner.'
@@ -675,6 +959,10 @@ if 'rest_framework.authtoken' in settings.INSTALLED_APPS:  # pragma: no cover
 
 
 def user_not_allowed_to_change_owner(user, obj):
+    """
+    ``obj.is_owner_of_any_organization`` is annotated by
+    ``UserAdmin.get_queryset``, otherwise it's looked up in the cache
+    """
     return (
         obj
         and not user.is_superuser
@@ -33,9 +33,8 @@ class FilterByOrganization(OrgLookup):
         return self.get_organization_queryset(qs)
 
     def get_organization_queryset(self, qs):
-        return qs.filter(
-            **{self.organization_lookup: getattr(self.request.user, self._user_attr)}
-        )
+        organizations = self.request.user.get_organizations_lookup(self._user_attr)
+        return qs.filter(**{self.organization_lookup: organizations})
 
 
 class FilterByOrganizationMembership(FilterByOrganization):
@@ -88,8 +87,8 @@ class FilterByParent(OrgLookup):
             raise NotFound()
 
     def get_organization_queryset(self, qs):
-        lookup = {self.organization_lookup: getattr(self.request.user, self._user_attr)}
-        return qs.filter(**lookup)
+        organizations = self.request.user.get_organizations_lookup(self._user_attr)
+        return qs.filter(**{self.organization_lookup: organizations})
 
     def get_parent_queryset(self):
         raise NotImplementedError()
@@ -136,7 +135,7 @@ class FilterSerializerByOrganization(OrgLookup):
         if user.is_superuser:
             return
         # non superusers can see only items of organizations they're related to
-        organization_filter = getattr(user, self._user_attr)
+        organization_filter = user.get_organizations_lookup(self._user_attr)
         for field in self.fields:
             if field == 'organization' and not self.fields[field].read_only:
                 # queryset attribute will not be present if set to read_only
@@ -10,9 +10,11 @@ def get_api_urls(api_views=None):
     if api_views is None:
         api_views = views
     if app_settings.USERS_AUTH_API:
-        urlpatterns += [
-            url(r'^user/token/', views.obtain_auth_token, name='user_auth_token')
-        ]
+        if app_settings.AUTH_API_ASYNC:
+            obtain_auth_token = views.async_obtain_auth_token
+        else:
+            obtain_auth_token = views.obtain_auth_token
+        urlpatterns += [url(r'^user/token/', obtain_auth_token, name='user_auth_token')]
     return urlpatterns
 
 
@@ -1,7 +1,14 @@
+import json
+
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse
+from django.utils.translation import gettext as _
 from drf_yasg.utils import swagger_auto_schema
+from rest_framework.authtoken.models import Token
 from rest_framework.authtoken.views import ObtainAuthToken
 from rest_framework.settings import api_settings
 
+from ..backends import aauthenticate
 from .swagger import ObtainTokenRequest, ObtainTokenResponse
 from .throttling import AuthRateThrottle
 
@@ -21,3 +28,53 @@ class ObtainAuthTokenView(ObtainAuthToken):
 
 
 obtain_auth_token = ObtainAuthTokenView.as_view()
+
+
+async def async_obtain_auth_token(request):
+    """
+    asynchronous version of ``ObtainAuthTokenView``, meant to be used with
+    ASGI: the password is verified in a pool of threads by ``aauthenticate``
+    instead of blocking the thread which runs the synchronous views
+    """
+    if request.method != 'POST':
+        return JsonResponse(
+            {'detail': _('Method "{}" not allowed.').format(request.method)},
+            status=405,
+        )
+    throttle = AuthRateThrottle()
+    if not await sync_to_async(throttle.allow_request)(request, None):
+        return JsonResponse({'detail': _('Request was throttled.')}, status=429)
+    if request.content_type == 'application/json':
+        try:
+            data = json.loads(request.body)
+        except ValueError:
+            data = None
+        if not isinstance(data, dict):
+            return JsonResponse({'detail': _('JSON parse error.')}, status=400)
+    else:
+        data = request.POST
+    errors = {
+        field: [_('This field is required.')]
+        for field in ['username', 'password']
+        if not data.get(field)
+    }
+    if errors:
+        return JsonResponse(errors, status=400)
+    user = await aauthenticate(
+        request, username=data['username'], password=data['password']
+    )
+    if user is None:
+        return JsonResponse(
+            {'non_field_errors': [_('Unable to log in with provided credentials.')]},
+            status=400,
+        )
+    token, _created = await sync_to_async(Token.objects.get_or_create)(user=user)
+    return JsonResponse({'token': token.key})
+
+
+# the view is not wrapped by csrf_exempt, which would hide that it's asynchronous
+async_obtain_auth_token.csrf_exempt = True
+# the API documentation (drf_yasg) is generated from the synchronous view,
+# which shares the same request and response schema
+async_obtain_auth_token.cls = ObtainAuthTokenView
+async_obtain_auth_token.initkwargs = {}
@@ -2,16 +2,26 @@ import logging
 
 from django.apps import AppConfig
 from django.conf import settings
-from django.core.cache import cache
+from django.contrib.auth import get_user_model
 from django.core.exceptions import ValidationError
+from django.core.signals import request_finished, request_started
 from django.db import IntegrityError, transaction
-from django.db.models.signals import post_delete, post_save
+from django.db.models.signals import post_delete, post_save, pre_delete
 from django.utils.translation import ugettext_lazy as _
 from openwisp_utils import settings as utils_settings
 from openwisp_utils.admin_theme.menu import register_menu_group
 from swapper import get_model_name, load_model
 
 from . import settings as app_settings
+from .cache import (
+    IDENTIFIER_FIELDS,
+    clear_request_memo,
+    get_bulk_membership_changes,
+    invalidate_organization_users,
+    invalidate_organizations_dict,
+    invalidate_unknown_identifiers,
+    start_request_memo,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -87,6 +97,9 @@ class OpenwispUsersConfig(AppConfig):
             setattr(settings, 'SWAGGER_SETTINGS', SWAGGER_SETTINGS)
 
     def connect_receivers(self):
+        from .multitenancy import connect_filter_choices_invalidation
+
+        Organization = load_model('openwisp_users', 'Organization')
         OrganizationUser = load_model('openwisp_users', 'OrganizationUser')
         OrganizationOwner = load_model('openwisp_users', 'OrganizationOwner')
         signal_tuples = [(post_save, 'post_save'), (post_delete, 'post_delete')]
@@ -105,28 +118,113 @@ class OpenwispUsersConfig(AppConfig):
             sender=OrganizationUser,
             dispatch_uid='make_first_org_user_org_owner',
         )
+        post_save.connect(
+            self.invalidate_members_on_is_active_change,
+            sender=Organization,
+            dispatch_uid='invalidate_members_on_is_active_change',
+        )
+        pre_delete.connect(
+            self.invalidate_members_on_delete,
+            sender=Organization,
+            dispatch_uid='invalidate_members_on_delete',
+        )
+        # organizations are listed by the filters of most admin classes,
+        # their renames must invalidate the cached choices in any case
+        connect_filter_choices_invalidation(Organization)
+        post_save.connect(
+            self.discard_unknown_identifiers,
+            sender=get_user_model(),
+            dispatch_uid='invalidate_unknown_identifiers',
+        )
+        request_started.connect(
+            start_request_memo, dispatch_uid='openwisp_users_start_request_memo'
+        )
+        request_finished.connect(
+            clear_request_memo, dispatch_uid='openwisp_users_clear_request_memo'
+        )
 
     def update_organizations_dict(cls, instance, **kwargs):
-        if hasattr(instance, 'user'):
-            user = instance.user
+        bulk_changes = get_bulk_membership_changes()
+        if bulk_changes is not None:
+            if hasattr(instance, 'user_id'):
+                bulk_changes['users'].add(instance.user_id)
+            else:
+                bulk_changes['organization_users'].add(instance.organization_user_id)
+            bulk_changes['member_organizations'].add(instance.organization_id)
+            return
+        if hasattr(instance, 'user_id'):
+            org_user = instance
         else:
-            user = instance.organization_user.user
-        cache_key = 'user_{}_organizations'.format(user.pk)
-        cache.delete(cache_key)
-        # forces caching
-        user.organizations_dict
-        try:
-            del user.organizations_managed
-        except AttributeError:
-            pass
-        try:
-            del user.organizations_owned
-        except AttributeError:
-            pass
+            org_user = instance.organization_user
+        invalidate_organizations_dict(org_user.user_id, using=kwargs.get('using'))
+        invalidate_organization_users(
+            instance.organization_id, using=kwargs.get('using')
+        )
+        # avoids a query per object when memberships are deleted in cascade
+        if not org_user._meta.get_field('user').is_cached(org_user):
+            return
+        user = org_user.user
+        for attr in [
+            '_prefetched_organizations',
+            'organizations_managed',
+            'organizations_owned',
+        ]:
+            try:
+                delattr(user, attr)
+            except AttributeError:
+                pass
+
+    def discard_unknown_identifiers(cls, instance, created, **kwargs):
+        """
+        discards the identifiers cached as not matching any user
+        when the fields used to log in may have been changed
+        """
+        update_fields = kwargs.get('update_fields')
+        if update_fields and not set(update_fields) & set(IDENTIFIER_FIELDS):
+            return
+        invalidate_unknown_identifiers(using=kwargs.get('using'))
+
+    def invalidate_members_on_is_active_change(cls, instance, created, **kwargs):
+        """
+        invalidates the cached organizations of the members
+        of organizations which are deactivated or reactivated
+        """
+        initial_is_active = getattr(instance, '_initial_is_active', None)
+        instance._initial_is_active = instance.is_active
+        if created or initial_is_active == instance.is_active:
+            return
+        cls._invalidate_members(instance, kwargs.get('using'))
+
+    def invalidate_members_on_delete(cls, instance, **kwargs):
+        """
+        invalidates the cached organizations of the
+        members of organizations which are deleted
+        """
+        cls._invalidate_members(instance, kwargs.get('using'))
+
+    def _invalidate_members(cls, organization, using):
+        OrganizationUser = load_model('openwisp_users', 'OrganizationUser')
+        user_pks = list(
+            OrganizationUser.objects.using(using)
+            .filter(organization=organization)
+            .values_list('user_id', flat=True)
+        )
+        if not user_pks:
+            return 0
+        invalidate_organizations_dict(*user_pks, using=using)
+        logger.info(
+            f'Invalidated the cached organizations of {len(user_pks)} '
+            f'members of organization {organization.pk}'
+        )
+        return len(user_pks)
 
     def create_organization_owner(cls, instance, created, **kwargs):
         if not created or not instance.is_admin:
             return
+        bulk_changes = get_bulk_membership_changes()
+        if bulk_changes is not None:
+            bulk_changes['organizations'].add(instance.organization_id)
+            return
         OrganizationOwner = load_model('openwisp_users', 'OrganizationOwner')
         org_owner_exist = OrganizationOwner.objects.filter(
             organization=instance.organization
@@ -1,42 +1,228 @@
+import asyncio
+import inspect
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, reduce
+from operator import or_
+from threading import Lock
+
 import phonenumbers
-from django.contrib.auth import get_user_model
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model, load_backend
 from django.contrib.auth.backends import ModelBackend
-from django.db.models import Q
+from django.contrib.auth.hashers import check_password, make_password
+from django.contrib.auth.signals import user_login_failed
+from django.core.exceptions import PermissionDenied
+from django.db.models import IntegerField, Q, Value
 from phonenumbers.phonenumberutil import NumberParseException
 
 from . import settings as app_settings
+from .cache import get_unknown_identifier, set_unknown_identifier
 
 User = get_user_model()
+# characters other than digits which may appear in the phone numbers typed by users
+PHONE_NUMBER_PUNCTUATION = frozenset('+-. ()/')
+_hash_executor = None
+_hash_executor_lock = Lock()
+
+
+def may_be_phone_number(identifier):
+    """
+    fast check which rejects the identifiers which cannot be phone numbers
+    (eg: usernames and emails) without parsing them
+    """
+    has_digits = False
+    for char in identifier:
+        if char.isdigit():
+            has_digits = True
+        elif char not in PHONE_NUMBER_PUNCTUATION:
+            return False
+    return has_digits
+
+
+@lru_cache(maxsize=app_settings.AUTH_BACKEND_PHONE_NUMBER_CACHE_SIZE)
+def parse_phone_number(identifier, prefixes=tuple()):
+    """
+    returns the first combination of ``identifier`` and ``prefixes``
+    which is parsed as a phone number, ``False`` otherwise;
+    results are cached because parsing failures are expensive
+    """
+    for prefix in ('',) + prefixes:
+        value = f'{prefix}{identifier}'
+        try:
+            phonenumbers.parse(value)
+            return value
+        except NumberParseException:
+            pass
+    return False
+
+
+def get_hash_executor():
+    """
+    returns the pool of threads which hash passwords for ``aauthenticate``;
+    the hashers shipped with django (hashlib, argon2-cffi, bcrypt) release
+    the GIL while hashing, hence the threads use all the available CPUs
+    """
+    global _hash_executor
+    with _hash_executor_lock:
+        if _hash_executor is None:
+            _hash_executor = ThreadPoolExecutor(
+                max_workers=app_settings.AUTH_BACKEND_HASH_WORKERS,
+                thread_name_prefix='openwisp_users_hash',
+            )
+    return _hash_executor
+
+
+def verify_password(password, encoded):
+    """
+    returns whether ``password`` matches the ``encoded`` hash
+    and whether the hash must be updated to the preferred hasher
+    """
+    must_update = []
+    valid = check_password(password, encoded, setter=must_update.append)
+    return valid, bool(must_update)
+
+
+async def aauthenticate(request=None, **credentials):
+    """
+    asynchronous counterpart of ``django.contrib.auth.authenticate``,
+    the backends which do not define ``aauthenticate`` are executed
+    with ``sync_to_async``
+    """
+    for backend_path in settings.AUTHENTICATION_BACKENDS:
+        backend = load_backend(backend_path)
+        try:
+            inspect.signature(backend.authenticate).bind(request, **credentials)
+        except TypeError:
+            continue
+        authenticate = getattr(backend, 'aauthenticate', None)
+        if authenticate is None:
+            authenticate = sync_to_async(backend.authenticate)
+        try:
+            user = await authenticate(request, **credentials)
+        except PermissionDenied:
+            break
+        if user is None:
+            continue
+        user.backend = backend_path
+        return user
+    credentials = {
+        key: value if key != 'password' else '********'
+        for key, value in credentials.items()
+    }
+    await sync_to_async(user_login_failed.send)(
+        sender=__name__, credentials=credentials, request=request
+    )
 
 
 class UsersAuthenticationBackend(ModelBackend):
     def authenticate(self, request, username=None, password=None, **kwargs):
-        queryset = self.get_users(username)
-        try:
-            # can not use queryset.first() because it orders the queryset
-            # by pk before returning the first object which is not what we want
-            user = queryset[0]
-        except IndexError:
+        if username is None or password is None:
+            return None
+        user = self._find_user(username)
+        if user is None:
+            # the password is hashed anyway, so that the time taken does
+            # not reveal whether the identifier exists (as in ModelBackend)
+            User().set_password(password)
             return None
         if user.check_password(password) and self.user_can_authenticate(user):
             return user
         return None
 
+    async def aauthenticate(self, request, username=None, password=None, **kwargs):
+        """
+        asynchronous version of ``authenticate``: the user is looked up
+        with ``sync_to_async`` and the password is hashed in the pool of
+        threads returned by ``get_hash_executor``, so that the event loop
+        is not blocked and concurrent logins are verified in parallel
+        """
+        if username is None or password is None:
+            return None
+        user = await sync_to_async(self._find_user)(username)
+        loop = asyncio.get_running_loop()
+        executor = get_hash_executor()
+        if user is None:
+            await loop.run_in_executor(executor, make_password, password)
+            return None
+        valid, must_update = await loop.run_in_executor(
+            executor, verify_password, password, user.password
+        )
+        if not valid or not self.user_can_authenticate(user):
+            return None
+        if must_update:
+            await sync_to_async(self._update_password)(user, password)
+        return user
+
+    def _update_password(self, user, password):
+        user.set_password(password)
+        user.save(update_fields=['password'])
+
+    def _find_user(self, identifier):
+        """
+        returns the result of ``lookup_user`` using the cache
+        of the identifiers which do not match any user
+        """
+        timeout = app_settings.AUTH_BACKEND_UNKNOWN_IDENTIFIER_CACHE_TIMEOUT
+        if not timeout:
+            return self.lookup_user(identifier)
+        unknown, version = get_unknown_identifier(identifier)
+        if unknown:
+            return None
+        user = self.lookup_user(identifier)
+        if user is None:
+            set_unknown_identifier(identifier, version)
+        return user
+
+    def lookup_user(self, identifier):
+        """
+        returns the user whose phone number matches ``identifier``,
+        otherwise the user whose email matches and lastly the user
+        whose username matches, ``None`` if no user matches
+        """
+        # at most one user for each condition, the fields are unique
+        users = list(self.get_users(identifier)[:3])
+        if len(users) < 2:
+            return users[0] if users else None
+        phone_number = self._get_phone_number(identifier)
+
+        def get_precedence(user):
+            if phone_number and user.phone_number == phone_number:
+                return 0
+            if user.email == identifier:
+                return 1
+            return 2
+
+        return min(users, key=get_precedence)
+
     def get_users(self, identifier):
-        conditions = Q(email=identifier) | Q(username=identifier)
+        """
+        returns the users matching ``identifier`` by phone number, email or
+        username, with ``OPENWISP_USERS_AUTH_BACKEND_LOOKUP`` set to ``union``
+        they are sorted according to this precedence
+        """
+        conditions = [Q(email=identifier), Q(username=identifier)]
         # if the identifier is a phone number, use the phone number as primary condition
         phone_number = self._get_phone_number(identifier)
         if phone_number:
-            conditions = Q(phone_number=phone_number) | conditions
-        return User.objects.filter(conditions)
+            conditions.insert(0, Q(phone_number=phone_number))
+        if app_settings.AUTH_BACKEND_LOOKUP == 'or':
+            return User.objects.filter(reduce(or_, conditions))
+        # one query for each condition, so that each one can use its unique
+        # index even on the databases which do not optimize OR conditions
+        querysets = [
+            User.objects.filter(condition)
+            .annotate(lookup_precedence=Value(precedence, IntegerField()))
+            .order_by()
+            for precedence, condition in enumerate(conditions)
+        ]
+        return (
+            querysets[0].union(*querysets[1:], all=True).order_by('lookup_precedence')
+        )
 
     def _get_phone_number(self, identifier):
-        prefixes = [''] + list(app_settings.AUTH_BACKEND_AUTO_PREFIXES)
-        for prefix in prefixes:
-            value = f'{prefix}{identifier}'
-            try:
-                phonenumbers.parse(value)
-                return value
-            except NumberParseException:
-                pass
-        return False
+        identifier = str(identifier or '')
+        if not may_be_phone_number(identifier):
+            return False
+        return parse_phone_number(
+            identifier, tuple(app_settings.AUTH_BACKEND_AUTO_PREFIXES)
+        )
@@ -8,11 +8,27 @@ from django.contrib.auth.models import UserManager as BaseUserManager
 from django.core.cache import cache
 from django.core.exceptions import ValidationError
 from django.db import models
+from django.db.models import Subquery
 from django.utils.functional import cached_property
 from django.utils.translation import ugettext_lazy as _
 from phonenumber_field.modelfields import PhoneNumberField
 from swapper import load_model
 
+from .. import settings as app_settings
+from ..cache import (
+    OrganizationsMap,
+    get_cache_key,
+    get_generation,
+    get_organization_users,
+    get_organizations_many,
+    get_request_memo,
+    is_invalidation_pending,
+    load_organizations,
+    local_cache,
+    rebuild_organizations,
+    set_request_memo,
+)
+
 logger = logging.getLogger(__name__)
 
 
@@ -40,6 +56,17 @@ class UserManager(BaseUserManager):
             if set_primary:
                 email.set_as_primary()
 
+    def prefetch_organizations(self, users):
+        """
+        Read:
+        https://github.com/openwisp/openwisp-users/blob/master/README.rst#prefetch_organizations
+        """
+        users = list(users)
+        organizations = get_organizations_many([user.pk for user in users])
+        for user in users:
+            user._prefetched_organizations = organizations[str(user.pk)]
+        return users
+
 
 class AbstractUser(BaseUser):
     """
@@ -102,35 +129,48 @@ class AbstractUser(BaseUser):
         """
         Returns a dictionary which represents the organizations which
         the user is member of, or which the user manages or owns.
+
+        The result is memoized for the duration of the current request,
+        so that the shared cache is hit at most once per request; if
+        enabled, the local in-process cache is looked up before it.
         """
-        cache_key = 'user_{}_organizations'.format(self.pk)
-        organizations = cache.get(cache_key)
+        organizations = getattr(self, '_prefetched_organizations', None)
+        if organizations is not None:
+            return organizations
+        organizations = get_request_memo(self.pk)
         if organizations is not None:
             return organizations
 
-        manager = load_model('openwisp_users', 'OrganizationUser').objects
-        org_users = manager.filter(
-            user=self, organization__is_active=True
-        ).select_related('organization', 'organizationowner')
-
-        organizations = {}
-        for org_user in org_users:
-            org = org_user.organization
-            org_id = str(org.pk)
-            organizations[org_id] = {
-                'is_admin': org_user.is_admin,
-                'is_owner': hasattr(org_user, 'organizationowner'),
-            }
-
-        cache.set(cache_key, organizations, 86400 * 2)  # Cache for two days
+        # changes made in the current transaction are not visible to other
+        # connections yet, the shared cache is bypassed until committed
+        pending = is_invalidation_pending(self.pk)
+        use_local_cache = not pending and local_cache.enabled
+        if use_local_cache:
+            generation = get_generation()
+            organizations = local_cache.get(str(self.pk), generation)
+            if organizations is not None:
+                set_request_memo(self.pk, organizations)
+                return organizations
+        if pending:
+            organizations = load_organizations([self.pk])[str(self.pk)]
+        else:
+            organizations = cache.get(get_cache_key(self.pk))
+            if organizations is None:
+                organizations = rebuild_organizations(self.pk)
+        if use_local_cache:
+            local_cache.set(str(self.pk), organizations, generation)
+        set_request_memo(self.pk, organizations)
         return organizations
 
     def __get_orgs(self, attribute):
-        org_list = []
-        for org_pk, options in self.organizations_dict.items():
-            if options[attribute]:
-                org_list.append(org_pk)
-        return org_list
+        organizations = self.organizations_dict
+        # computed once for each value loaded from the cache
+        if isinstance(organizations, OrganizationsMap):
+            return organizations.get_pks(attribute)
+        # entries cached in the format used by previous versions
+        return frozenset(
+            org_pk for org_pk, options in organizations.items() if options[attribute]
+        )
 
     @cached_property
     def organizations_managed(self):
@@ -140,6 +180,50 @@ class AbstractUser(BaseUser):
     def organizations_owned(self):
         return self.__get_orgs('is_owner')
 
+    def __get_orgs_subquery(self, **kwargs):
+        OrganizationUser = load_model('openwisp_users', 'OrganizationUser')
+        return Subquery(
+            OrganizationUser.objects.filter(
+                user_id=self.pk, organization__is_active=True, **kwargs
+            ).values('organization_id')
+        )
+
+    @property
+    def organizations_subquery(self):
+        """
+        subquery equivalent to ``organizations_dict``,
+        meant to be used in ``__in`` lookups
+        """
+        return self.__get_orgs_subquery()
+
+    @property
+    def organizations_managed_subquery(self):
+        """
+        subquery equivalent to ``organizations_managed``,
+        meant to be used in ``__in`` lookups
+        """
+        return self.__get_orgs_subquery(is_admin=True)
+
+    @property
+    def organizations_owned_subquery(self):
+        """
+        subquery equivalent to ``organizations_owned``,
+        meant to be used in ``__in`` lookups
+        """
+        return self.__get_orgs_subquery(organizationowner__isnull=False)
+
+    def get_organizations_lookup(self, attribute='organizations_managed'):
+        """
+        Read:
+        https://github.com/openwisp/openwisp-users/blob/master/README.rst#get_organizations_lookup
+        """
+        organizations = getattr(self, attribute)
+        if len(organizations) <= app_settings.ORGANIZATIONS_SUBQUERY_THRESHOLD:
+            return organizations
+        if attribute == 'organizations_dict':
+            return self.organizations_subquery
+        return getattr(self, '{0}_subquery'.format(attribute))
+
     def clean(self):
         if self.email == '':
             self.email = None
@@ -186,6 +270,32 @@ class BaseOrganization(models.Model):
     email = models.EmailField(_('email'), blank=True)
     url = models.URLField(_('URL'), blank=True)
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # used to detect changes to is_active,
+        # which affect the membership of users
+        instance._initial_is_active = instance.__dict__.get('is_active')
+        return instance
+
+    def get_member_pks(self):
+        """
+        returns the primary keys of the members of the organization
+        """
+        return get_organization_users(self.pk)['members']
+
+    def get_manager_pks(self):
+        """
+        returns the primary keys of the managers of the organization
+        """
+        return get_organization_users(self.pk)['managers']
+
+    def get_owner_pks(self):
+        """
+        returns the primary keys of the owners of the organization
+        """
+        return get_organization_users(self.pk)['owners']
+
     def __str__(self):
         value = self.name
         if not self.is_active:
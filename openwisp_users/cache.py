@@ -0,0 +1,707 @@
+"""
+helpers used to cache the organization membership data
+returned by ``AbstractUser.organizations_dict``
+"""
+import struct
+import uuid
+from collections import OrderedDict
+from collections.abc import Mapping
+from contextvars import ContextVar
+from functools import partial
+from itertools import compress
+from threading import Lock, local
+from time import monotonic, sleep
+
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.utils.crypto import salted_hmac
+from swapper import load_model
+
+from . import settings as app_settings
+
+CACHE_TIMEOUT = 86400 * 2  # two days
+# maximum amount of keys deleted with one cache operation
+INVALIDATION_CHUNK_SIZE = 1000
+# incremented by every node at each invalidation, used to
+# expire the entries of the local cache of all the nodes
+GENERATION_CACHE_KEY = 'openwisp_users_organizations_generation'
+# interval between the checks made while waiting for
+# another process to rebuild the cache entry of a user
+LOCK_POLL_INTERVAL = 0.05
+_request_memo = ContextVar('openwisp_users_request_memo', default=None)
+_request_generation = ContextVar('openwisp_users_request_generation', default=None)
+# user pks waiting for the transaction to be committed and the flush
+# registered with on_commit, by database alias
+_pending = local()
+# changes collected by ``openwisp_users.utils.bulk_membership_changes``
+_bulk_changes = ContextVar('openwisp_users_bulk_changes', default=None)
+
+
+def start_request_memo(**kwargs):
+    """
+    enables the request scoped memoization of ``organizations_dict``,
+    connected to the ``request_started`` signal
+    """
+    _request_memo.set({})
+    _request_generation.set(None)
+
+
+def clear_request_memo(**kwargs):
+    """
+    disables the request scoped memoization of ``organizations_dict``,
+    connected to the ``request_finished`` signal
+    """
+    _request_memo.set(None)
+    _request_generation.set(None)
+
+
+def get_request_memo(user_pk):
+    """
+    returns the organizations of the user memoized during the
+    current request or ``None`` if not available
+    """
+    memo = _request_memo.get()
+    if memo is None:
+        return None
+    return memo.get(str(user_pk))
+
+
+def set_request_memo(user_pk, organizations):
+    memo = _request_memo.get()
+    if memo is not None:
+        memo[str(user_pk)] = organizations
+
+
+def forget_request_memo(*user_pks):
+    memo = _request_memo.get()
+    if memo is None:
+        return
+    for user_pk in user_pks:
+        memo.pop(str(user_pk), None)
+
+
+class LocalCache(object):
+    """
+    in-process LRU cache with expiration used in front of the shared
+    cache, its entries expire also when the generation counter stored
+    in the shared cache is incremented by any node
+    """
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self):
+        return app_settings.ORGANIZATIONS_LOCAL_CACHE_SIZE > 0
+
+    def get(self, key, generation):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires, entry_generation = entry
+                if expires > monotonic() and entry_generation == generation:
+                    self._entries.move_to_end(key)
+                    self._count('hits')
+                    return value
+                del self._entries[key]
+            self._count('misses')
+            return None
+
+    def set(self, key, value, generation):
+        expires = monotonic() + app_settings.ORGANIZATIONS_LOCAL_CACHE_TTL
+        with self._lock:
+            self._entries[key] = (value, expires, generation)
+            self._entries.move_to_end(key)
+            while len(self._entries) > app_settings.ORGANIZATIONS_LOCAL_CACHE_SIZE:
+                self._entries.popitem(last=False)
+
+    def delete_many(self, keys):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def _count(self, attr):
+        if app_settings.ORGANIZATIONS_LOCAL_CACHE_STATS:
+            setattr(self, attr, getattr(self, attr) + 1)
+
+
+local_cache = LocalCache()
+
+
+def get_generation():
+    """
+    returns the value of the generation counter,
+    which is retrieved at most once per request
+    """
+    generation = _request_generation.get()
+    if generation is None:
+        generation = cache.get(GENERATION_CACHE_KEY, 0)
+        if _request_memo.get() is not None:
+            _request_generation.set(generation)
+    return generation
+
+
+def _increment_generation():
+    try:
+        cache.incr(GENERATION_CACHE_KEY)
+    except ValueError:
+        cache.add(GENERATION_CACHE_KEY, 1, None)
+
+
+class OrganizationsMap(Mapping):
+    """
+    read-only mapping with the same interface of the dictionary
+    returned by ``organizations_dict`` which is stored in a compact
+    binary format: a 4 bytes counter, the sorted 16 bytes UUIDs of
+    the organizations and a bitfield with 2 bits for each organization
+    (``is_admin`` and ``is_owner``); single lookups use a binary search
+    on the encoded data, while iterations and ``get_pks`` decode it once
+    for each instance (which is shared by the request memo and by the
+    local cache)
+    """
+
+    __slots__ = ('_data', '_count', '_keys', '_pks', '_decoded')
+    _header = struct.Struct('!I')
+    _role_bits = {'is_admin': 0, 'is_owner': 1}
+    # maps each byte of the bitfield to the flags of ``is_admin``
+    # and ``is_owner`` of the 4 organizations it encodes
+    _role_flags = tuple(
+        tuple(
+            bytes((byte >> (index * 2 + bit)) & 1 for index in range(4))
+            for byte in range(256)
+        )
+        for bit in range(2)
+    )
+
+    def __init__(self, data=None):
+        self._data = data or self._header.pack(0)
+        self._count = self._header.unpack_from(self._data)[0]
+        self._keys = None
+        self._pks = None
+        self._decoded = None
+
+    @classmethod
+    def from_dict(cls, organizations):
+        """
+        encodes a dictionary in the format returned by ``organizations_dict``
+        """
+        items = sorted(
+            (uuid.UUID(str(org_pk)).bytes, roles)
+            for org_pk, roles in organizations.items()
+        )
+        roles = bytearray((len(items) + 3) // 4)
+        for index, (org_bytes, options) in enumerate(items):
+            bits = int(bool(options['is_admin'])) | int(bool(options['is_owner'])) << 1
+            roles[index // 4] |= bits << (index % 4 * 2)
+        data = b''.join([cls._header.pack(len(items))] + [item[0] for item in items])
+        return cls(data + bytes(roles))
+
+    def _get_uuid(self, index):
+        offset = self._header.size + index * 16
+        return self._data[offset : offset + 16]
+
+    def _get_roles(self, index):
+        offset = self._header.size + self._count * 16 + index // 4
+        bits = self._data[offset] >> (index % 4 * 2)
+        return {'is_admin': bool(bits & 1), 'is_owner': bool(bits & 2)}
+
+    def _find(self, key):
+        try:
+            key = uuid.UUID(str(key)).bytes
+        except ValueError:
+            raise KeyError(key)
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            if self._get_uuid(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self._count and self._get_uuid(low) == key:
+            return low
+        raise KeyError(key)
+
+    def _format_keys(self, indexes):
+        digits = self._data[
+            self._header.size : self._header.size + self._count * 16
+        ].hex()
+        # formatting the hex digits is much faster than creating UUID instances
+        return [
+            f'{digits[i:i + 8]}-{digits[i + 8:i + 12]}-{digits[i + 12:i + 16]}-'
+            f'{digits[i + 16:i + 20]}-{digits[i + 20:i + 32]}'
+            for i in (index * 32 for index in indexes)
+        ]
+
+    def _get_flags(self, bit):
+        """
+        returns one byte (0 or 1) for each organization,
+        set if the role of ``bit`` (0 is admin, 1 is owner) is set
+        """
+        roles = self._data[self._header.size + self._count * 16 :]
+        return b''.join(map(self._role_flags[bit].__getitem__, roles))
+
+    def _decode_keys(self):
+        if self._keys is None:
+            self._keys = self._format_keys(range(self._count))
+        return self._keys
+
+    def _decode(self):
+        """
+        decodes the dictionaries of the roles, only when needed
+        """
+        if self._decoded is not None:
+            return self._decoded
+        keys = self._decode_keys()
+        managed, owned = self.get_pks('is_admin'), self.get_pks('is_owner')
+        self._decoded = {
+            key: {'is_admin': key in managed, 'is_owner': key in owned} for key in keys
+        }
+        return self._decoded
+
+    def get_pks(self, attribute):
+        """
+        returns the frozenset of the organizations in which the
+        ``attribute`` role (``is_admin`` or ``is_owner``) is set,
+        it's computed once for each instance
+        """
+        if self._pks is None:
+            self._pks = {}
+        pks = self._pks.get(attribute)
+        if pks is not None:
+            return pks
+        flags = self._get_flags(self._role_bits[attribute])
+        if self._keys is not None:
+            pks = frozenset(compress(self._keys, flags))
+        else:
+            # only the keys of the organizations with the role are formatted
+            pks = frozenset(self._format_keys(compress(range(self._count), flags)))
+        self._pks[attribute] = pks
+        return pks
+
+    def __getitem__(self, key):
+        if self._decoded is not None:
+            try:
+                return self._decoded[key]
+            except (KeyError, TypeError):
+                # not normalized keys (eg: UUID instances) are searched below
+                pass
+        return self._get_roles(self._find(key))
+
+    def __iter__(self):
+        return iter(self._decode_keys())
+
+    def __len__(self):
+        return self._count
+
+    def items(self):
+        return self._decode().items()
+
+    def values(self):
+        return self._decode().values()
+
+    def __reduce__(self):
+        # pickled as the class reference plus the encoded bytes
+        return (self.__class__, (self._data,))
+
+    def __repr__(self):
+        return '{0}({1})'.format(self.__class__.__name__, dict(self.items()))
+
+
+def get_bulk_membership_changes():
+    """
+    returns the changes collected by ``bulk_membership_changes``
+    or ``None`` if not used, meant for internal usage only
+    """
+    return _bulk_changes.get()
+
+
+def get_cache_key(user_pk):
+    return 'user_{}_organizations'.format(user_pk)
+
+
+def get_lock_key(user_pk):
+    return 'user_{}_organizations_lock'.format(user_pk)
+
+
+def rebuild_organizations(user_pk):
+    """
+    loads the organizations of a user missing from the shared cache and
+    stores them; a short lived lock ensures that only one process at a
+    time rebuilds the cache entry of each user (eg: after the cache is
+    flushed), the others wait for the entry for at most
+    ``ORGANIZATIONS_CACHE_LOCK_WAIT`` seconds, after which they load
+    the organizations from the database without storing them
+    """
+    cache_key = get_cache_key(user_pk)
+    lock_key = get_lock_key(user_pk)
+    lock_timeout = app_settings.ORGANIZATIONS_CACHE_LOCK_TIMEOUT
+    if not lock_timeout or cache.add(lock_key, True, lock_timeout):
+        try:
+            organizations = load_organizations([user_pk])[str(user_pk)]
+            cache.set(cache_key, organizations, CACHE_TIMEOUT)
+        finally:
+            if lock_timeout:
+                cache.delete(lock_key)
+        return organizations
+    deadline = monotonic() + app_settings.ORGANIZATIONS_CACHE_LOCK_WAIT
+    while monotonic() < deadline:
+        sleep(LOCK_POLL_INTERVAL)
+        organizations = cache.get(cache_key)
+        if organizations is not None:
+            return organizations
+    return load_organizations([user_pk])[str(user_pk)]
+
+
+def load_organizations(user_pks):
+    """
+    loads the organizations of the users passed from the database
+    with a single query, returns a dictionary keyed by user pk
+    whose values are ``OrganizationsMap`` instances
+    """
+    OrganizationUser = load_model('openwisp_users', 'OrganizationUser')
+    results = {str(user_pk): {} for user_pk in user_pks}
+    org_users = OrganizationUser.objects.filter(
+        user__in=user_pks, organization__is_active=True
+    ).values_list('user_id', 'organization_id', 'is_admin', 'organizationowner')
+    for user_id, org_id, is_admin, owner_id in org_users.iterator():
+        results[str(user_id)][str(org_id)] = {
+            'is_admin': is_admin,
+            'is_owner': owner_id is not None,
+        }
+    return {
+        user_pk: OrganizationsMap.from_dict(organizations)
+        for user_pk, organizations in results.items()
+    }
+
+
+def get_organizations_many(user_pks):
+    """
+    returns the organizations of many users (dictionary keyed by user pk)
+    using at most one cache lookup, one query and one cache update
+    """
+    user_pks = [str(user_pk) for user_pk in user_pks]
+    pending = [pk for pk in user_pks if is_invalidation_pending(pk)]
+    cacheable = [pk for pk in user_pks if pk not in pending]
+    cache_keys = {get_cache_key(pk): pk for pk in cacheable}
+    results = {
+        cache_keys[key]: value for key, value in cache.get_many(cache_keys).items()
+    }
+    missing = [pk for pk in user_pks if pk not in results]
+    if not missing:
+        return results
+    loaded = load_organizations(missing)
+    results.update(loaded)
+    cache.set_many(
+        {get_cache_key(pk): loaded[pk] for pk in missing if pk not in pending},
+        CACHE_TIMEOUT,
+    )
+    return results
+
+
+def _get_pending(using, kind='users'):
+    """
+    returns the pks of the users (or organizations) whose
+    cache invalidation is waiting for the transaction
+    """
+    invalidations = getattr(_pending, kind, None)
+    if invalidations is None:
+        invalidations = {}
+        setattr(_pending, kind, invalidations)
+    return invalidations.setdefault(using, set())
+
+
+def _is_pending(pk, using, kind):
+    using = using or DEFAULT_DB_ALIAS
+    _discard_rolled_back(using)
+    return str(pk) in _get_pending(using, kind)
+
+
+def is_invalidation_pending(user_pk, using=None):
+    """
+    returns ``True`` if the membership of the user has been changed
+    in the current transaction, which has not been committed yet:
+    the shared cache shall not be used for this user until then
+    """
+    return _is_pending(user_pk, using, 'users')
+
+
+def _get_scheduled_flush(using):
+    """
+    returns the flush registered with ``on_commit`` in the current
+    transaction, ``None`` if it has been discarded by a rollback
+    (or if it has never been registered)
+    """
+    flushes = getattr(_pending, 'flushes', None)
+    scheduled = flushes.get(using) if flushes else None
+    connection = transaction.get_connection(using)
+    if scheduled is None or not connection.in_atomic_block:
+        return None
+    index, flush = scheduled
+    callbacks = connection.run_on_commit
+    if index < len(callbacks) and callbacks[index][1] is flush:
+        return flush
+    # the position changes when the callbacks of a savepoint are discarded
+    for index, callback in enumerate(callbacks):
+        if callback[1] is flush:
+            flushes[using] = (index, flush)
+            return flush
+    return None
+
+
+def _schedule_flush(using):
+    """
+    registers ``_flush_invalidations`` with ``on_commit`` once per
+    transaction, the flush is executed right away in autocommit mode
+    """
+    if _get_scheduled_flush(using) is not None:
+        return
+    connection = transaction.get_connection(using)
+    flush = partial(_flush_invalidations, using)
+    transaction.on_commit(flush, using=using)
+    if connection.in_atomic_block:
+        if getattr(_pending, 'flushes', None) is None:
+            _pending.flushes = {}
+        _pending.flushes[using] = (len(connection.run_on_commit) - 1, flush)
+
+
+def _discard_rolled_back(using):
+    """
+    the invalidations are pending only until the flush registered
+    with ``on_commit`` is executed, if the flush is not registered
+    anymore the transaction (or savepoint) has been rolled back
+    """
+    users = _get_pending(using, 'users')
+    organizations = _get_pending(using, 'organizations')
+    if not users and not organizations:
+        return
+    if _get_scheduled_flush(using) is None:
+        users.clear()
+        organizations.clear()
+
+
+def invalidate_organizations_dict(*user_pks, using=None):
+    """
+    invalidates the cached organizations of the users passed,
+    the shared cache is flushed once the current transaction
+    is committed (or immediately in autocommit mode)
+    """
+    using = using or DEFAULT_DB_ALIAS
+    forget_request_memo(*user_pks)
+    _discard_rolled_back(using)
+    _get_pending(using).update(str(user_pk) for user_pk in user_pks)
+    _schedule_flush(using)
+
+
+def _pop_pending(using, kind):
+    pending = _get_pending(using, kind)
+    pks = list(pending)
+    pending.clear()
+    return pks
+
+
+def _flush_invalidations(using):
+    flushes = getattr(_pending, 'flushes', None)
+    if flushes:
+        flushes.pop(using, None)
+    user_pks = _pop_pending(using, 'users')
+    org_pks = _pop_pending(using, 'organizations')
+    if user_pks:
+        forget_request_memo(*user_pks)
+        local_cache.delete_many(user_pks)
+    # the keys of users and organizations are deleted together
+    cache_keys = [get_cache_key(pk) for pk in user_pks]
+    cache_keys += [get_organization_cache_key(pk) for pk in org_pks]
+    for i in range(0, len(cache_keys), INVALIDATION_CHUNK_SIZE):
+        cache.delete_many(cache_keys[i : i + INVALIDATION_CHUNK_SIZE])
+    # incremented only after the shared entries are deleted, otherwise
+    # the other nodes could store the old entries in their local cache
+    # along with the new generation, and keep them until they expire
+    if user_pks:
+        _increment_generation()
+    if not app_settings.ORGANIZATIONS_CACHE_REWARM:
+        return
+    for i in range(0, len(user_pks), INVALIDATION_CHUNK_SIZE):
+        organizations = load_organizations(user_pks[i : i + INVALIDATION_CHUNK_SIZE])
+        cache.set_many(
+            {get_cache_key(pk): value for pk, value in organizations.items()},
+            CACHE_TIMEOUT,
+        )
+
+
+def get_organization_cache_key(org_pk):
+    return 'organization_{}_users'.format(org_pk)
+
+
+def load_organization_users(org_pks):
+    """
+    loads the members, managers and owners of the organizations passed
+    from the database with a single query, returns a dictionary keyed by
+    organization pk whose values are dictionaries of frozensets of user pks
+    """
+    OrganizationUser = load_model('openwisp_users', 'OrganizationUser')
+    results = {
+        str(org_pk): {'members': set(), 'managers': set(), 'owners': set()}
+        for org_pk in org_pks
+    }
+    org_users = OrganizationUser.objects.filter(organization__in=org_pks).values_list(
+        'organization_id', 'user_id', 'is_admin', 'organizationowner'
+    )
+    for org_id, user_id, is_admin, owner_id in org_users.iterator():
+        users = results[str(org_id)]
+        users['members'].add(str(user_id))
+        if is_admin:
+            users['managers'].add(str(user_id))
+        if owner_id is not None:
+            users['owners'].add(str(user_id))
+    return {
+        org_pk: {role: frozenset(user_pks) for role, user_pks in users.items()}
+        for org_pk, users in results.items()
+    }
+
+
+def get_organization_users(org_pk):
+    """
+    returns the pks of the members, managers and owners of an organization,
+    the reverse of ``organizations_dict``, which is cached and invalidated
+    by the same signals
+    """
+    if _is_pending(org_pk, None, 'organizations'):
+        return load_organization_users([org_pk])[str(org_pk)]
+    cache_key = get_organization_cache_key(org_pk)
+    users = cache.get(cache_key)
+    if users is None:
+        users = load_organization_users([org_pk])[str(org_pk)]
+        cache.set(cache_key, users, CACHE_TIMEOUT)
+    return users
+
+
+def invalidate_organization_users(*org_pks, using=None):
+    """
+    invalidates the cached members of the organizations passed,
+    with the same deferral of ``invalidate_organizations_dict``
+    """
+    using = using or DEFAULT_DB_ALIAS
+    _discard_rolled_back(using)
+    _get_pending(using, 'organizations').update(str(org_pk) for org_pk in org_pks)
+    _schedule_flush(using)
+
+
+def get_filter_choices_cache_key(user_pk, model, field_path):
+    return 'user_{}_{}_{}_filter_choices'.format(
+        user_pk, model._meta.label_lower, field_path
+    )
+
+
+def get_filter_choices_version_key(model):
+    return 'openwisp_users_filter_choices_{}_version'.format(model._meta.label_lower)
+
+
+def get_filter_choices(user, model, field_path, related_model, load):
+    """
+    returns the choices of the multitenant admin filters, which are
+    cached per user and per model; the entries are discarded when the
+    organizations managed by the user change (which happens when
+    ``organizations_dict`` is invalidated) or when any instance of
+    ``related_model`` is saved or deleted
+    """
+    timeout = app_settings.FILTER_CHOICES_CACHE_TIMEOUT
+    if not timeout:
+        return load()
+    cache_key = get_filter_choices_cache_key(user.pk, model, field_path)
+    version_key = get_filter_choices_version_key(related_model)
+    values = cache.get_many([cache_key, version_key])
+    version = values.get(version_key, 0)
+    organizations = None if user.is_superuser else user.organizations_managed
+    entry = values.get(cache_key)
+    if entry is not None and entry[:2] == (version, organizations):
+        return entry[2]
+    choices = list(load())
+    cache.set(cache_key, (version, organizations, choices), timeout)
+    return choices
+
+
+def _increment_filter_choices_version(model):
+    key = get_filter_choices_version_key(model)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, 1, None)
+
+
+def invalidate_filter_choices(sender, using=None, **kwargs):
+    """
+    invalidates the cached filter choices of all the users which list
+    instances of ``sender``, can be connected to ``post_save`` and
+    ``post_delete``; it's done also after the transaction is committed,
+    so that the choices cached in the meantime from other connections
+    (which could not see the changes) are discarded as well
+    """
+    _increment_filter_choices_version(sender)
+    transaction.on_commit(
+        partial(_increment_filter_choices_version, sender), using=using
+    )
+
+
+UNKNOWN_IDENTIFIERS_VERSION_KEY = 'openwisp_users_unknown_identifiers_version'
+# fields which identify users when they log in
+IDENTIFIER_FIELDS = ('username', 'email', 'phone_number')
+
+
+def get_unknown_identifier_cache_key(identifier):
+    # identifiers are hashed with a key derived from SECRET_KEY,
+    # so that they can not be read or guessed from the cache
+    digest = salted_hmac(
+        'openwisp_users.unknown_identifier', str(identifier), algorithm='sha256'
+    ).hexdigest()
+    return 'openwisp_users_unknown_identifier_{}'.format(digest)
+
+
+def get_unknown_identifier(identifier):
+    """
+    returns whether ``identifier`` is cached as not matching any user and
+    the version of these entries, meant to be passed to ``set_unknown_identifier``
+    """
+    cache_key = get_unknown_identifier_cache_key(identifier)
+    values = cache.get_many([cache_key, UNKNOWN_IDENTIFIERS_VERSION_KEY])
+    version = values.get(UNKNOWN_IDENTIFIERS_VERSION_KEY, 0)
+    return values.get(cache_key) == version, version
+
+
+def set_unknown_identifier(identifier, version):
+    """
+    caches ``identifier`` as not matching any user, ``version`` shall be
+    read before looking up the users, so that the entry is discarded if
+    a user has been changed in the meantime
+    """
+    cache.set(
+        get_unknown_identifier_cache_key(identifier),
+        version,
+        app_settings.AUTH_BACKEND_UNKNOWN_IDENTIFIER_CACHE_TIMEOUT,
+    )
+
+
+def _increment_unknown_identifiers_version():
+    try:
+        cache.incr(UNKNOWN_IDENTIFIERS_VERSION_KEY)
+    except ValueError:
+        cache.add(UNKNOWN_IDENTIFIERS_VERSION_KEY, 1, None)
+
+
+def invalidate_unknown_identifiers(using=None):
+    """
+    discards all the unknown identifiers cached, it's done also after
+    the transaction is committed, so that the identifiers cached in the
+    meantime from other connections (which could not see the changes)
+    are discarded as well
+    """
+    _increment_unknown_identifiers_version()
+    transaction.on_commit(_increment_unknown_identifiers_version, using=using)
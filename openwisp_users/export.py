@@ -0,0 +1,116 @@
+"""
+helpers used to export the users along with their organization roles,
+the rows are streamed from the database with a server-side cursor
+(where supported) so that memory usage does not depend on their amount
+"""
+import csv
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import FilteredRelation, Q
+from swapper import load_model
+
+EXPORT_CHUNK_SIZE = 2000
+# columns of the export, one row is generated for each organization user
+# and one (with empty organization columns) for each user without any
+EXPORT_FIELDS = (
+    ('user_id', 'pk'),
+    ('username', 'username'),
+    ('email', 'email'),
+    ('first_name', 'first_name'),
+    ('last_name', 'last_name'),
+    ('is_active', 'is_active'),
+    ('organization_id', '{membership}__organization'),
+    ('organization', '{membership}__organization__name'),
+    ('is_admin', '{membership}__is_admin'),
+    ('is_owner', '{membership}__organizationowner'),
+)
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+# values starting with these characters are interpreted
+# as formulas when the CSV file is opened by spreadsheets
+CSV_FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+
+def get_export_rows(users, organizations=None, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    yields a dictionary for each organization user of ``users`` (a queryset)
+    and for each user which is not member of any organization; if
+    ``organizations`` (anything accepted by an ``__in`` lookup) is passed,
+    only the members of those organizations and their memberships are exported
+    """
+    OrganizationUser = load_model('openwisp_users', 'OrganizationUser')
+    membership = OrganizationUser._meta.get_field('user').related_query_name()
+    # a new queryset, so that the joins of the filters applied to
+    # ``users`` (eg: by the admin changelist) are not reused below
+    queryset = users.model.objects.filter(pk__in=users.order_by().values('pk'))
+    if organizations is not None:
+        queryset = queryset.filter(
+            pk__in=OrganizationUser.objects.filter(
+                organization__in=organizations
+            ).values('user_id')
+        ).annotate(
+            # LEFT JOIN limited to the memberships of the organizations
+            export_membership=FilteredRelation(
+                membership,
+                condition=Q(**{f'{membership}__organization__in': organizations}),
+            )
+        )
+        membership = 'export_membership'
+    columns = [column for column, _ in EXPORT_FIELDS]
+    # the memberships are joined with a LEFT JOIN, hence the users
+    # which are not member of any organization are exported as well
+    values = queryset.order_by('pk').values_list(
+        *[lookup.format(membership=membership) for _, lookup in EXPORT_FIELDS]
+    )
+    for row in values.iterator(chunk_size=chunk_size):
+        row = dict(zip(columns, row))
+        if row['organization_id'] is not None:
+            row['is_owner'] = row['is_owner'] is not None
+        yield row
+
+
+class Echo(object):
+    """
+    file-like object which returns what is written,
+    used to stream the output of ``csv.writer``
+    """
+
+    def write(self, value):
+        return value
+
+
+def escape_csv_value(value):
+    """
+    prevents CSV injection by prefixing
+    the values which could be formulas with ``'``
+    """
+    if isinstance(value, str) and value.startswith(CSV_FORMULA_PREFIXES):
+        return f"'{value}"
+    return value
+
+
+def export_csv(rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow([column for column, _ in EXPORT_FIELDS])
+    for row in rows:
+        yield writer.writerow([escape_csv_value(value) for value in row.values()])
+
+
+def export_ndjson(rows):
+    for row in rows:
+        yield json.dumps(row, cls=DjangoJSONEncoder) + '\n'
+
+
+def export_users(rows, export_format='csv'):
+    """
+    yields the lines of the export of ``rows``
+    (see ``get_export_rows``) in the format specified
+    """
+    if export_format == 'csv':
+        return export_csv(rows)
+    if export_format == 'ndjson':
+        return export_ndjson(rows)
+    raise ValueError('unsupported export format: {}'.format(export_format))
@@ -0,0 +1,264 @@
+"""
+helpers used to import many users at once: the rows are validated in
+bulk against the usernames, emails and phone numbers already taken,
+users, email addresses and organization users are created with
+``bulk_create`` in batches and passwords are hashed in a process pool
+(started only for batches holding many passwords)
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from time import monotonic
+
+import django
+from allauth.account.models import EmailAddress
+from django.apps import apps
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+from django.db.models.functions import Lower
+from phonenumber_field.phonenumber import to_python
+from swapper import load_model
+
+from .cache import get_bulk_membership_changes, invalidate_unknown_identifiers
+from .utils import bulk_membership_changes
+
+IMPORT_BATCH_SIZE = 1000
+# columns recognized in the rows imported, only username is required
+IMPORT_FIELDS = (
+    'username',
+    'email',
+    'password',
+    'first_name',
+    'last_name',
+    'phone_number',
+    'organization',
+    'is_admin',
+)
+TRUE_VALUES = ('1', 'true', 'yes')
+# the process pool is started only when a batch holds more passwords
+# than this amount, below which hashing them in the current process
+# takes less than starting the worker processes
+HASH_POOL_THRESHOLD = 50
+
+
+def _init_hasher_process():  # pragma: no cover
+    # needed when processes are spawned instead of forked
+    if not apps.ready:
+        django.setup()
+
+
+def _hash_passwords(passwords, executor, workers):
+    if executor is None:
+        return [make_password(password) for password in passwords]
+    # a few chunks per worker keep the processes busy until the end
+    chunksize = max(len(passwords) // (workers * 4), 1)
+    return list(executor.map(make_password, passwords, chunksize=chunksize))
+
+
+def _clean_value(value):
+    # rows may hold typed values (eg: when not read from CSV files)
+    if value is None:
+        return ''
+    return str(value).strip()
+
+
+def _get_taken_values():
+    """
+    returns the sets of usernames, (lowercase) emails, including
+    the ones of ``EmailAddress``, and phone numbers already taken
+    """
+    User = get_user_model()
+    queryset = User.objects.order_by()
+    usernames = set(queryset.values_list('username', flat=True).iterator())
+    emails = set(
+        queryset.filter(email__isnull=False)
+        .values_list(Lower('email'), flat=True)
+        .iterator()
+    )
+    # the addresses of EmailAddress are unique as well (ACCOUNT_UNIQUE_EMAIL),
+    # including the secondary addresses of the users
+    emails.update(
+        EmailAddress.objects.order_by()
+        .values_list(Lower('email'), flat=True)
+        .iterator()
+    )
+    phone_numbers = {
+        str(phone_number)
+        for phone_number in queryset.filter(phone_number__isnull=False)
+        .values_list('phone_number', flat=True)
+        .iterator()
+    }
+    return usernames, emails, phone_numbers
+
+
+class RowValidator(object):
+    """
+    validates the rows being imported and keeps track of the values
+    taken, so that duplicates within the import are detected as well
+    """
+
+    def __init__(self, organization=None, is_admin=False):
+        Organization = load_model('openwisp_users', 'Organization')
+        self.organizations = dict(Organization.objects.values_list('slug', 'pk'))
+        self.organization = organization
+        self.is_admin = is_admin
+        self.usernames, self.emails, self.phone_numbers = _get_taken_values()
+        self.username_validator = get_user_model().username_validator
+
+    def __call__(self, row):
+        """
+        returns the cleaned row or raises ``ValidationError``
+        """
+        errors = {}
+        cleaned = {
+            field: _clean_value(row.get(field))
+            for field in IMPORT_FIELDS
+            if field != 'password'
+        }
+        password = row.get('password')
+        cleaned['password'] = str(password) if password not in (None, '') else None
+        username = cleaned['username']
+        if not username:
+            errors['username'] = 'this field is required'
+        elif username in self.usernames:
+            errors['username'] = 'already taken'
+        else:
+            try:
+                self.username_validator(username)
+            except ValidationError as e:
+                errors['username'] = ' '.join(e.messages)
+        email = get_user_model().objects.normalize_email(cleaned['email']) or None
+        if email:
+            try:
+                validate_email(email)
+            except ValidationError as e:
+                errors['email'] = ' '.join(e.messages)
+            else:
+                if email.lower() in self.emails:
+                    errors['email'] = 'already taken'
+        cleaned['email'] = email
+        phone_number = None
+        if cleaned['phone_number']:
+            phone_number = to_python(cleaned['phone_number'])
+            if not phone_number or not phone_number.is_valid():
+                errors['phone_number'] = 'invalid phone number'
+            elif str(phone_number) in self.phone_numbers:
+                errors['phone_number'] = 'already taken'
+        cleaned['phone_number'] = phone_number
+        organization = cleaned['organization'] or self.organization
+        cleaned['organization'] = None
+        if organization:
+            cleaned['organization'] = self.organizations.get(organization)
+            if cleaned['organization'] is None:
+                errors['organization'] = f'organization "{organization}" not found'
+        if isinstance(row.get('is_admin'), bool):
+            cleaned['is_admin'] = row['is_admin']
+        elif cleaned['is_admin']:
+            cleaned['is_admin'] = cleaned['is_admin'].lower() in TRUE_VALUES
+        else:
+            cleaned['is_admin'] = self.is_admin
+        if errors:
+            raise ValidationError(errors)
+        self.usernames.add(username)
+        if email:
+            self.emails.add(email.lower())
+        if phone_number:
+            self.phone_numbers.add(str(phone_number))
+        return cleaned
+
+
+def _create_batch(rows, executor, workers):
+    User = get_user_model()
+    OrganizationUser = load_model('openwisp_users', 'OrganizationUser')
+    passwords = _hash_passwords([row['password'] for row in rows], executor, workers)
+    users = []
+    email_addresses = []
+    org_users = []
+    for row, password in zip(rows, passwords):
+        user = User(
+            username=row['username'],
+            email=row['email'],
+            password=password,
+            first_name=row['first_name'],
+            last_name=row['last_name'],
+            phone_number=row['phone_number'],
+        )
+        users.append(user)
+        if user.email:
+            email_addresses.append(
+                EmailAddress(user=user, email=user.email, verified=True, primary=True)
+            )
+        if row['organization']:
+            org_users.append(
+                OrganizationUser(
+                    user=user,
+                    organization_id=row['organization'],
+                    is_admin=row['is_admin'],
+                )
+            )
+    with bulk_membership_changes():
+        User.objects.bulk_create(users)
+        EmailAddress.objects.bulk_create(email_addresses)
+        OrganizationUser.objects.bulk_create(org_users)
+        # signals are not sent by bulk_create, the changes are recorded
+        # here so that owners are created and caches invalidated at once
+        changes = get_bulk_membership_changes()
+        for org_user in org_users:
+            changes['users'].add(org_user.user_id)
+            changes['member_organizations'].add(org_user.organization_id)
+            if org_user.is_admin:
+                changes['organizations'].add(org_user.organization_id)
+        invalidate_unknown_identifiers()
+    return len(users)
+
+
+def import_users(
+    rows,
+    organization=None,
+    is_admin=False,
+    batch_size=IMPORT_BATCH_SIZE,
+    hash_workers=None,
+    callback=None,
+):
+    """
+    Read:
+    https://github.com/openwisp/openwisp-users/blob/master/README.rst#importing-users
+    """
+    validator = RowValidator(organization, is_admin)
+    result = {'created': 0, 'errors': [], 'elapsed': 0.0}
+    start = monotonic()
+    executor = None
+    workers = hash_workers or os.cpu_count() or 1
+    rows = enumerate(rows, 1)
+    try:
+        while True:
+            batch = list(islice(rows, batch_size))
+            if not batch:
+                break
+            valid_rows = []
+            for number, row in batch:
+                try:
+                    valid_rows.append(validator(row))
+                except ValidationError as e:
+                    result['errors'].append((number, e.message_dict))
+            passwords = sum(1 for row in valid_rows if row['password'])
+            if (
+                executor is None
+                and hash_workers != 0
+                and passwords > HASH_POOL_THRESHOLD
+            ):
+                executor = ProcessPoolExecutor(
+                    max_workers=workers, initializer=_init_hasher_process
+                )
+            if valid_rows:
+                result['created'] += _create_batch(valid_rows, executor, workers)
+            result['elapsed'] = monotonic() - start
+            if callback:
+                callback(result)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    result['elapsed'] = monotonic() - start
+    return result
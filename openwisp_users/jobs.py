@@ -0,0 +1,219 @@
+"""
+helpers used to run the bulk actions of the admin in background:
+the primary keys of the selected objects are stored in the cache in
+batches, which are then processed one by one by the job; the progress
+of the job is stored in the cache as well and shown in the admin
+"""
+import logging
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
+from django.apps import apps
+from django.contrib.admin.models import DELETION, LogEntry
+from django.contrib.admin.sites import all_sites
+from django.contrib.auth import get_user_model
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.db import connections, transaction
+from django.http import HttpRequest
+from django.utils.module_loading import import_string
+
+from . import settings as app_settings
+from .utils import bulk_membership_changes
+
+logger = logging.getLogger(__name__)
+
+JOB_CACHE_TIMEOUT = 86400  # one day
+_executor = None
+_executor_lock = Lock()
+
+
+def get_job_cache_key(job_id):
+    return 'openwisp_users_job_{}'.format(job_id)
+
+
+def get_batch_cache_key(job_id, index):
+    return 'openwisp_users_job_{}_batch_{}'.format(job_id, index)
+
+
+def get_user_jobs_cache_key(user_pk):
+    return 'user_{}_jobs'.format(user_pk)
+
+
+def get_model_admin(model, job):
+    """
+    returns the model admin of ``model`` registered in the
+    admin site which started the job, if any
+    """
+    for site in all_sites:
+        if site.name == job.get('admin_site'):
+            return site._registry.get(model)
+    return None
+
+
+def _make_active(model, pks, job):
+    return model.objects.filter(pk__in=pks).update(is_active=True)
+
+
+def _make_inactive(model, pks, job):
+    return model.objects.filter(pk__in=pks).update(is_active=False)
+
+
+def _delete(model, pks, job):
+    queryset = model.objects.filter(pk__in=pks)
+    content_type_id = ContentType.objects.get_for_model(model).pk
+    log_entries = [
+        LogEntry(
+            user_id=job['user'],
+            content_type_id=content_type_id,
+            object_id=str(obj.pk),
+            object_repr=str(obj)[:200],
+            action_flag=DELETION,
+        )
+        for obj in queryset
+    ]
+    LogEntry.objects.bulk_create(log_entries)
+    model_admin = get_model_admin(model, job)
+    # the cache of the members of the organizations is invalidated once
+    with bulk_membership_changes():
+        if model_admin is None:
+            queryset.delete()
+        else:
+            # goes through the same hook used by the admin
+            request = HttpRequest()
+            request.user = get_user_model().objects.get(pk=job['user'])
+            model_admin.delete_queryset(request, queryset)
+    return len(log_entries)
+
+
+# functions which process one batch of primary keys and return
+# the amount of objects affected, keyed by the name of the action
+JOB_ACTIONS = {
+    'make_active': _make_active,
+    'make_inactive': _make_inactive,
+    'delete': _delete,
+}
+
+
+def start_job(action, queryset, user, admin_site=None):
+    """
+    stores the primary keys of ``queryset`` in batches of
+    ``OPENWISP_USERS_BULK_ACTION_BATCH_SIZE`` and passes the job
+    to the runner configured in ``OPENWISP_USERS_BULK_ACTION_RUNNER``;
+    ``admin_site`` is the name of the admin site whose model
+    admin hooks are used by the action (eg: ``delete_queryset``)
+    """
+    job_id = str(uuid.uuid4())
+    batch_size = app_settings.BULK_ACTION_BATCH_SIZE
+    pks = [str(pk) for pk in queryset.order_by().values_list('pk', flat=True)]
+    batches = {
+        get_batch_cache_key(job_id, index): pks[offset : offset + batch_size]
+        for index, offset in enumerate(range(0, len(pks), batch_size))
+    }
+    cache.set_many(batches, JOB_CACHE_TIMEOUT)
+    job = {
+        'id': job_id,
+        'action': action,
+        'model': queryset.model._meta.label,
+        'user': str(user.pk),
+        'admin_site': admin_site,
+        'batches': len(batches),
+        'total': len(pks),
+        'processed': 0,
+        'affected': 0,
+        'status': 'pending',
+    }
+    cache.set(get_job_cache_key(job_id), job, JOB_CACHE_TIMEOUT)
+    user_jobs_key = get_user_jobs_cache_key(user.pk)
+    user_jobs = cache.get(user_jobs_key, [])
+    cache.set(user_jobs_key, user_jobs + [job_id], JOB_CACHE_TIMEOUT)
+    import_string(app_settings.BULK_ACTION_RUNNER)(job_id)
+    return job
+
+
+def get_job(job_id):
+    return cache.get(get_job_cache_key(job_id))
+
+
+def run_job(job_id):
+    """
+    processes the batches of the job, each one in its own transaction,
+    updating the progress stored in the cache after each of them
+    """
+    job = get_job(job_id)
+    if job is None:
+        return
+    job_key = get_job_cache_key(job_id)
+    model = apps.get_model(job['model'])
+    action = JOB_ACTIONS[job['action']]
+    job['status'] = 'running'
+    cache.set(job_key, job, JOB_CACHE_TIMEOUT)
+    try:
+        for index in range(job['batches']):
+            batch_key = get_batch_cache_key(job_id, index)
+            pks = cache.get(batch_key, [])
+            with transaction.atomic():
+                job['affected'] += action(model, pks, job)
+            job['processed'] += len(pks)
+            cache.set(job_key, job, JOB_CACHE_TIMEOUT)
+            cache.delete(batch_key)
+        job['status'] = 'completed'
+    except Exception as e:
+        logger.exception(f'Bulk action job {job_id} failed')
+        job['status'] = 'failed'
+        job['error'] = str(e)
+    cache.set(job_key, job, JOB_CACHE_TIMEOUT)
+    return job
+
+
+def _run_in_thread(job_id):
+    try:
+        return run_job(job_id)
+    finally:
+        # the connections opened by the worker thread are not reused
+        connections.close_all()
+
+
+def thread_pool_runner(job_id):
+    """
+    default runner, executes the job in a pool of threads of the
+    current process (see ``OPENWISP_USERS_BULK_ACTION_WORKERS``)
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=app_settings.BULK_ACTION_WORKERS,
+                thread_name_prefix='openwisp_users_job',
+            )
+    return _executor.submit(_run_in_thread, job_id)
+
+
+def sync_runner(job_id):
+    """
+    executes the job in the current thread,
+    meant for testing and debugging
+    """
+    return run_job(job_id)
+
+
+def pop_user_jobs(user):
+    """
+    returns the jobs started by ``user``, the jobs which are
+    completed or failed are forgotten after being returned
+    """
+    user_jobs_key = get_user_jobs_cache_key(user.pk)
+    job_ids = cache.get(user_jobs_key)
+    if not job_ids:
+        return []
+    jobs = cache.get_many([get_job_cache_key(job_id) for job_id in job_ids])
+    jobs = [
+        jobs[get_job_cache_key(job_id)]
+        for job_id in job_ids
+        if get_job_cache_key(job_id) in jobs
+    ]
+    running = [job['id'] for job in jobs if job['status'] in ['pending', 'running']]
+    if running != job_ids:
+        cache.set(user_jobs_key, running, JOB_CACHE_TIMEOUT)
+    return jobs
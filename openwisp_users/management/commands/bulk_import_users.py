@@ -0,0 +1,90 @@
+import csv
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ...importer import IMPORT_BATCH_SIZE, IMPORT_FIELDS, import_users
+
+
+class Command(BaseCommand):
+    help = 'Imports the users listed in a CSV file'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'file',
+            help=(
+                'path of the CSV file to import ("-" for standard input), '
+                'the columns recognized are: {}'.format(', '.join(IMPORT_FIELDS))
+            ),
+        )
+        parser.add_argument(
+            '--organization',
+            help='slug of the organization of the users which do not specify one',
+        )
+        parser.add_argument(
+            '--admin',
+            action='store_true',
+            help='flag the users which do not specify is_admin as managers',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=IMPORT_BATCH_SIZE,
+            help='amount of users created at once',
+        )
+        parser.add_argument(
+            '--hash-workers',
+            type=int,
+            default=None,
+            help=(
+                'amount of processes which hash the passwords, defaults to '
+                'the amount of CPUs, 0 hashes them in the current process'
+            ),
+        )
+
+    def handle(self, *args, **options):
+        if options['file'] == '-':
+            return self._import(sys.stdin, options)
+        try:
+            with open(options['file'], newline='') as csv_file:
+                return self._import(csv_file, options)
+        except OSError as e:
+            raise CommandError(e)
+
+    def _import(self, csv_file, options):
+        reader = csv.DictReader(csv_file)
+        if not reader.fieldnames or 'username' not in reader.fieldnames:
+            raise CommandError('The CSV file must contain the "username" column')
+        result = import_users(
+            reader,
+            organization=options['organization'],
+            is_admin=options['admin'],
+            batch_size=options['batch_size'],
+            hash_workers=options['hash_workers'],
+            callback=self._report_progress if options['verbosity'] > 1 else None,
+        )
+        for number, errors in result['errors']:
+            for field, messages in errors.items():
+                self.stderr.write(
+                    'Row {}: {}: {}'.format(number, field, ' '.join(messages))
+                )
+        self.stdout.write(
+            'Imported {} users in {:.2f} seconds ({}), {} rows skipped'.format(
+                result['created'],
+                result['elapsed'],
+                self._get_throughput(result),
+                len(result['errors']),
+            )
+        )
+
+    def _get_throughput(self, result):
+        if not result['elapsed']:
+            return 'n/a'
+        return '{:.1f} users/s'.format(result['created'] / result['elapsed'])
+
+    def _report_progress(self, result):
+        self.stdout.write(
+            'Imported {} users ({})'.format(
+                result['created'], self._get_throughput(result)
+            )
+        )
@@ -0,0 +1,56 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from swapper import load_model
+
+from ...export import EXPORT_CHUNK_SIZE, EXPORT_FORMATS, export_users, get_export_rows
+
+Organization = load_model('openwisp_users', 'Organization')
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Exports the users along with their organization roles'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--format',
+            dest='export_format',
+            choices=list(EXPORT_FORMATS.keys()),
+            default='csv',
+            help='format of the export (default: csv)',
+        )
+        parser.add_argument(
+            '--organization',
+            action='append',
+            dest='organizations',
+            help='slug of the organization to export, can be repeated',
+        )
+        parser.add_argument(
+            '--output', help='path of the file to write (default: standard output)'
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=EXPORT_CHUNK_SIZE,
+            help='amount of rows fetched from the database at once',
+        )
+
+    def handle(self, *args, **options):
+        organizations = None
+        if options['organizations']:
+            slugs = set(options['organizations'])
+            organizations = list(
+                Organization.objects.filter(slug__in=slugs).values_list('pk', flat=True)
+            )
+            if len(organizations) != len(slugs):
+                raise CommandError('One or more organizations were not found')
+        rows = get_export_rows(
+            User.objects.all(), organizations, chunk_size=options['chunk_size']
+        )
+        lines = export_users(rows, options['export_format'])
+        if options['output']:
+            with open(options['output'], 'w', newline='') as output:
+                output.writelines(lines)
+            return
+        for line in lines:
+            self.stdout.write(line, ending='')
@@ -1,13 +1,164 @@
+import hashlib
+from functools import partial
+
 from django.contrib import admin
+from django.contrib.admin.utils import get_fields_from_path
+from django.contrib.admin.views.main import ChangeList
 from django.contrib.auth import get_user_model
-from django.db.models import Q
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet, FieldDoesNotExist
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Exists, OuterRef, Q
+from django.db.models.signals import post_delete, post_save
+from django.utils.functional import cached_property
 from django.utils.translation import ugettext_lazy as _
 from swapper import load_model
 
+from . import settings as app_settings
+from .cache import get_filter_choices, invalidate_filter_choices
+
 User = get_user_model()
 OrganizationUser = load_model('openwisp_users', 'OrganizationUser')
 
 
+def filter_in(queryset, user):
+    """
+    shared relations filter strategy:
+    ``organization IN (...) OR organization IS NULL``
+    """
+    organizations = user.get_organizations_lookup('organizations_managed')
+    return queryset.filter(Q(organization__in=organizations) | Q(organization=None))
+
+
+def filter_exists(queryset, user):
+    """
+    shared relations filter strategy:
+    ``EXISTS (<membership of the user>) OR organization IS NULL``
+    """
+    managed = OrganizationUser.objects.filter(
+        user=user,
+        is_admin=True,
+        organization__is_active=True,
+        organization=OuterRef('organization'),
+    )
+    return queryset.filter(Q(Exists(managed)) | Q(organization=None))
+
+
+def filter_union(queryset, user):
+    """
+    shared relations filter strategy:
+    ``pk IN (<organization IN (...)> UNION <organization IS NULL>)``,
+    each branch of the union can use the index on the organization
+    """
+    organizations = user.get_organizations_lookup('organizations_managed')
+    branches = queryset.model._default_manager.order_by().values('pk')
+    related = branches.filter(organization__in=organizations)
+    shared = branches.filter(organization=None)
+    return queryset.filter(pk__in=related.union(shared))
+
+
+FILTER_STRATEGIES = {'in': filter_in, 'exists': filter_exists, 'union': filter_union}
+
+
+def get_estimated_count(queryset):
+    """
+    returns the amount of rows of the table of ``queryset`` estimated
+    from the statistics of the database, or ``None`` if the database
+    backend does not provide them (eg: SQLite)
+    """
+    connection = connections[queryset.db]
+    table = queryset.model._meta.db_table
+    if connection.vendor == 'postgresql':
+        sql = 'SELECT reltuples FROM pg_class WHERE oid = to_regclass(%s)'
+        params = [connection.ops.quote_name(table)]
+    elif connection.vendor == 'mysql':
+        sql = (
+            'SELECT table_rows FROM information_schema.tables '
+            'WHERE table_schema = DATABASE() AND table_name = %s'
+        )
+        params = [table]
+    else:
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        row = cursor.fetchone()
+    # tables which have never been analyzed may report -1
+    if not row or row[0] is None or row[0] < 0:
+        return None
+    return int(row[0])
+
+
+def get_approximate_count(queryset, user):
+    """
+    returns the count of ``queryset``: if not filtered it's estimated
+    from the statistics of the database when they report at least
+    ``ADMIN_APPROXIMATE_COUNT_THRESHOLD`` rows, otherwise the exact
+    count is cached for each user for ``ADMIN_COUNT_CACHE_TIMEOUT`` seconds
+    """
+    queryset = queryset.order_by()
+    if not queryset.query.where and not queryset.query.distinct:
+        estimate = get_estimated_count(queryset)
+        threshold = app_settings.ADMIN_APPROXIMATE_COUNT_THRESHOLD
+        if estimate is not None and estimate >= threshold:
+            return estimate
+    timeout = app_settings.ADMIN_COUNT_CACHE_TIMEOUT
+    if not timeout:
+        return queryset.count()
+    try:
+        sql, params = queryset.query.sql_with_params()
+    except EmptyResultSet:
+        # eg: filtered by the organizations of an operator who manages none
+        return 0
+    digest = hashlib.md5(repr((queryset.db, sql, params)).encode()).hexdigest()
+    cache_key = 'user_{0}_count_{1}'.format(user.pk, digest)
+    count = cache.get(cache_key)
+    if count is None:
+        count = queryset.count()
+        cache.set(cache_key, count, timeout)
+    return count
+
+
+class ApproximateCountPaginator(Paginator):
+    """
+    paginator which counts the objects with ``get_approximate_count``
+    """
+
+    def __init__(self, *args, user=None, **kwargs):
+        self.user = user
+        super().__init__(*args, **kwargs)
+
+    @cached_property
+    def count(self):
+        return get_approximate_count(self.object_list, self.user)
+
+
+class ApproximateCountChangeList(ChangeList):
+    """
+    changelist which counts the objects with ``get_approximate_count``
+    and does not show the total amount of objects when it exceeds
+    ``ADMIN_APPROXIMATE_COUNT_THRESHOLD``
+    """
+
+    def get_results(self, request):
+        root_queryset = self.root_queryset
+        # the total count is computed by ChangeList.get_results
+        # with root_queryset.count(), which is replaced on a copy
+        self.root_queryset = root_queryset.all()
+        self.root_queryset.count = partial(
+            get_approximate_count, root_queryset, request.user
+        )
+        try:
+            super().get_results(request)
+        finally:
+            self.root_queryset = root_queryset
+        threshold = app_settings.ADMIN_APPROXIMATE_COUNT_THRESHOLD
+        if self.full_result_count is not None and self.full_result_count > threshold:
+            self.show_full_result_count = False
+            self.full_result_count = None
+            self.show_admin_actions = True
+
+
 class MultitenantAdminMixin(object):
     """
     Mixin that makes a ModelAdmin class multitenant:
@@ -17,6 +168,11 @@ class MultitenantAdminMixin(object):
 
     multitenant_shared_relations = None
     multitenant_parent = None
+    # maps the name of shared relations to a filter strategy,
+    # either one of the keys of FILTER_STRATEGIES or a callable
+    multitenant_filter_strategies = None
+    # counts the objects of the changelist with get_approximate_count
+    approximate_count = False
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -28,6 +184,24 @@ class MultitenantAdminMixin(object):
         if parent and parent not in shared_relations:
             shared_relations.append(parent)
         self.multitenant_shared_relations = shared_relations
+        self._connect_filter_choices_invalidation()
+
+    def _connect_filter_choices_invalidation(self):
+        """
+        connects the invalidation of the cached choices of the multitenant
+        filters in each process, also in those which never render them
+        """
+        for list_filter in getattr(self, 'list_filter', ()):
+            if not isinstance(list_filter, (tuple, list)):
+                continue
+            field_path, filter_class = list_filter
+            if not issubclass(filter_class, MultitenantOrgFilter):
+                continue
+            try:
+                field = get_fields_from_path(self.model, field_path)[-1]
+            except FieldDoesNotExist:
+                continue
+            connect_filter_choices_invalidation(field.related_model)
 
     def get_repr(self, obj):
         return str(obj)
@@ -45,15 +219,16 @@ class MultitenantAdminMixin(object):
             return self.multitenant_behaviour_for_user_admin(request)
         if user.is_superuser:
             return qs
+        organizations = user.get_organizations_lookup('organizations_managed')
         if hasattr(self.model, 'organization'):
-            return qs.filter(organization__in=user.organizations_managed)
+            return qs.filter(organization__in=organizations)
         if self.model.__name__ == 'Organization':
-            return qs.filter(pk__in=user.organizations_managed)
+            return qs.filter(pk__in=organizations)
         elif not self.multitenant_parent:
             return qs
         else:
             qsarg = '{0}__organization__in'.format(self.multitenant_parent)
-            return qs.filter(**{qsarg: user.organizations_managed})
+            return qs.filter(**{qsarg: organizations})
 
     def _edit_form(self, request, form):
         """
@@ -70,21 +245,55 @@ class MultitenantAdminMixin(object):
         if user.is_superuser and org_field and not org_field.required:
             org_field.empty_label = _('Shared systemwide (no organization)')
         elif not user.is_superuser:
-            orgs_pk = user.organizations_managed
+            orgs_pk = user.get_organizations_lookup('organizations_managed')
             # organizations relation;
             # may be readonly and not present in field list
             if org_field:
                 org_field.queryset = org_field.queryset.filter(pk__in=orgs_pk)
                 org_field.empty_label = None
             # other relations
-            q = Q(organization__in=orgs_pk) | Q(organization=None)
             for field_name in self.multitenant_shared_relations:
                 # each relation may be readonly
                 # and not present in field list
                 if field_name not in fields:
                     continue
                 field = fields[field_name]
-                field.queryset = field.queryset.filter(q)
+                strategy = self.get_multitenant_filter_strategy(request, field_name)
+                field.queryset = strategy(field.queryset, user)
+
+    def get_multitenant_filter_strategy(self, request, field_name):
+        """
+        returns the function used to filter the queryset of the shared
+        relation ``field_name``, defaults to the ``IN`` list strategy if
+        the user manages few organizations, to ``UNION`` otherwise
+        """
+        strategies = self.multitenant_filter_strategies or {}
+        strategy = strategies.get(field_name)
+        if strategy is None:
+            managed = request.user.organizations_managed
+            if len(managed) <= app_settings.ORGANIZATIONS_SUBQUERY_THRESHOLD:
+                strategy = 'in'
+            else:
+                strategy = 'union'
+        if callable(strategy):
+            return strategy
+        return FILTER_STRATEGIES[strategy]
+
+    def get_changelist(self, request, **kwargs):
+        if self.approximate_count:
+            return ApproximateCountChangeList
+        return super().get_changelist(request, **kwargs)
+
+    def get_paginator(
+        self, request, queryset, per_page, orphans=0, allow_empty_first_page=True
+    ):
+        if not self.approximate_count:
+            return super().get_paginator(
+                request, queryset, per_page, orphans, allow_empty_first_page
+            )
+        return ApproximateCountPaginator(
+            queryset, per_page, orphans, allow_empty_first_page, user=request.user
+        )
 
     def get_form(self, request, obj=None, **kwargs):
         form = super().get_form(request, obj, **kwargs)
@@ -103,22 +312,44 @@ class MultitenantAdminMixin(object):
         if superuser is logged in - show all users
         """
         user = request.user
+        qs = super().get_queryset(request)
         if not user.is_superuser:
-            org_users = OrganizationUser.objects.filter(user=user).select_related(
-                'organization'
+            managed = OrganizationUser.objects.filter(user=user, is_admin=True)
+            qs = qs.filter(
+                Exists(
+                    OrganizationUser.objects.filter(
+                        user=OuterRef('pk'),
+                        organization__in=managed.values('organization_id'),
+                    )
+                ),
+                # hide superusers from organization operators
+                # so they can't edit nor delete them
+                is_superuser=False,
             )
-            qs = User.objects.none()
-            for org_user in org_users:
-                if org_user.is_admin:
-                    qs = qs | org_user.organization.users.all().distinct()
-            # hide superusers from organization operators
-            # so they can't edit nor delete them
-            qs = qs.filter(is_superuser=False)
-        else:
-            qs = super().get_queryset(request)
         return qs
 
 
+# labels of the models whose changes invalidate the cached filter choices
+_filter_choices_models = set()
+
+
+def connect_filter_choices_invalidation(model):
+    """
+    invalidates the cached choices of the multitenant filters
+    which list ``model`` whenever any of its instances changes
+    """
+    label = model._meta.label_lower
+    if label in _filter_choices_models:
+        return
+    for signal, name in [(post_save, 'post_save'), (post_delete, 'post_delete')]:
+        signal.connect(
+            invalidate_filter_choices,
+            sender=model,
+            dispatch_uid='{0}_{1}_invalidate_filter_choices'.format(name, label),
+        )
+    _filter_choices_models.add(label)
+
+
 class MultitenantOrgFilter(admin.RelatedFieldListFilter):
     """
     Admin filter that shows only organizations the current
@@ -128,9 +359,21 @@ class MultitenantOrgFilter(admin.RelatedFieldListFilter):
     multitenant_lookup = 'pk__in'
 
     def field_choices(self, field, request, model_admin):
+        related_model = field.related_model
+        # usually connected already by MultitenantAdminMixin
+        connect_filter_choices_invalidation(related_model)
+        return get_filter_choices(
+            request.user,
+            model_admin.model,
+            self.field_path,
+            related_model,
+            partial(self._field_choices, field, request, model_admin),
+        )
+
+    def _field_choices(self, field, request, model_admin):
         if request.user.is_superuser:
             return super().field_choices(field, request, model_admin)
-        organizations = request.user.organizations_managed
+        organizations = request.user.get_organizations_lookup('organizations_managed')
         return field.get_choices(
             include_blank=False,
             limit_choices_to={self.multitenant_lookup: organizations},
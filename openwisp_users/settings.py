@@ -1,3 +1,5 @@
+import os
+
 from django.conf import settings
 from openwisp_utils.utils import default_or_test
 
@@ -12,3 +14,59 @@ USERS_AUTH_THROTTLE_RATE = getattr(
 AUTH_BACKEND_AUTO_PREFIXES = getattr(
     settings, 'OPENWISP_USERS_AUTH_BACKEND_AUTO_PREFIXES', tuple()
 )
+AUTH_BACKEND_PHONE_NUMBER_CACHE_SIZE = getattr(
+    settings, 'OPENWISP_USERS_AUTH_BACKEND_PHONE_NUMBER_CACHE_SIZE', 1024
+)
+AUTH_BACKEND_LOOKUP = getattr(settings, 'OPENWISP_USERS_AUTH_BACKEND_LOOKUP', 'or')
+AUTH_BACKEND_UNKNOWN_IDENTIFIER_CACHE_TIMEOUT = getattr(
+    settings, 'OPENWISP_USERS_AUTH_BACKEND_UNKNOWN_IDENTIFIER_CACHE_TIMEOUT', 30
+)
+AUTH_BACKEND_HASH_WORKERS = getattr(
+    settings, 'OPENWISP_USERS_AUTH_BACKEND_HASH_WORKERS', os.cpu_count()
+)
+AUTH_API_ASYNC = getattr(settings, 'OPENWISP_USERS_AUTH_API_ASYNC', False)
+ORGANIZATIONS_CACHE_REWARM = getattr(
+    settings, 'OPENWISP_USERS_ORGANIZATIONS_CACHE_REWARM', False
+)
+ORGANIZATIONS_LOCAL_CACHE_SIZE = getattr(
+    settings, 'OPENWISP_USERS_ORGANIZATIONS_LOCAL_CACHE_SIZE', 0
+)
+ORGANIZATIONS_LOCAL_CACHE_TTL = getattr(
+    settings, 'OPENWISP_USERS_ORGANIZATIONS_LOCAL_CACHE_TTL', 10
+)
+ORGANIZATIONS_LOCAL_CACHE_STATS = getattr(
+    settings, 'OPENWISP_USERS_ORGANIZATIONS_LOCAL_CACHE_STATS', False
+)
+ORGANIZATIONS_CACHE_LOCK_TIMEOUT = getattr(
+    settings, 'OPENWISP_USERS_ORGANIZATIONS_CACHE_LOCK_TIMEOUT', 5
+)
+ORGANIZATIONS_CACHE_LOCK_WAIT = getattr(
+    settings, 'OPENWISP_USERS_ORGANIZATIONS_CACHE_LOCK_WAIT', 1
+)
+ORGANIZATIONS_SUBQUERY_THRESHOLD = getattr(
+    settings, 'OPENWISP_USERS_ORGANIZATIONS_SUBQUERY_THRESHOLD', 100
+)
+ORGANIZATION_AUTOCOMPLETE_FILTER = getattr(
+    settings, 'OPENWISP_USERS_ORGANIZATION_AUTOCOMPLETE_FILTER', False
+)
+FILTER_CHOICES_CACHE_TIMEOUT = getattr(
+    settings, 'OPENWISP_USERS_FILTER_CHOICES_CACHE_TIMEOUT', 3600
+)
+ADMIN_APPROXIMATE_COUNT = getattr(
+    settings, 'OPENWISP_USERS_ADMIN_APPROXIMATE_COUNT', False
+)
+ADMIN_APPROXIMATE_COUNT_THRESHOLD = getattr(
+    settings, 'OPENWISP_USERS_ADMIN_APPROXIMATE_COUNT_THRESHOLD', 10000
+)
+ADMIN_COUNT_CACHE_TIMEOUT = getattr(
+    settings, 'OPENWISP_USERS_ADMIN_COUNT_CACHE_TIMEOUT', 60
+)
+BULK_ACTION_BATCH_SIZE = getattr(
+    settings, 'OPENWISP_USERS_BULK_ACTION_BATCH_SIZE', 1000
+)
+BULK_ACTION_RUNNER = getattr(
+    settings,
+    'OPENWISP_USERS_BULK_ACTION_RUNNER',
+    'openwisp_users.jobs.thread_pool_runner',
+)
+BULK_ACTION_WORKERS = getattr(settings, 'OPENWISP_USERS_BULK_ACTION_WORKERS', 2)
@@ -0,0 +1,15 @@
+'use strict';
+(function ($) {
+    $(function () {
+        // reloads the changelist when a value is selected or cleared
+        $('select.ow-autocomplete-filter').on('change', function () {
+            var url = $(this).data('query-string'),
+                value = $(this).val();
+            if (value) {
+                url += (url.length > 1 ? '&' : '') +
+                       $(this).data('parameter') + '=' + encodeURIComponent(value);
+            }
+            window.location.search = url;
+        });
+    });
+}(django.jQuery));
@@ -1,23 +1,38 @@
 import contextlib
+import csv
+import json
 import re
 import smtplib
 import uuid
-from unittest.mock import patch
+from time import sleep
+from unittest.mock import Mock, PropertyMock, patch
 
 from django.contrib import admin
+from django.contrib.admin.models import DELETION, LogEntry
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import Permission
 from django.core import mail
 from django.core.exceptions import ValidationError
-from django.db import DEFAULT_DB_ALIAS
-from django.test import TestCase
+from django.db import DEFAULT_DB_ALIAS, models
+from django.test import RequestFactory, TestCase, TransactionTestCase
 from django.urls import reverse
 from openwisp_utils.tests import capture_any_output
 from swapper import load_model
 
-from ..admin import OrganizationOwnerAdmin
+from .. import settings as app_settings
+from ..admin import (
+    OrganizationOwnerAdmin,
+    OrganizationUserAutocompleteFilter,
+    UserAdmin,
+    user_not_allowed_to_change_owner,
+)
 from ..apps import logger as apps_logger
-from ..multitenancy import MultitenantAdminMixin
+from ..jobs import JOB_ACTIONS, get_job, pop_user_jobs, run_job, start_job
+from ..multitenancy import (
+    ApproximateCountChangeList,
+    MultitenantAdminMixin,
+    get_approximate_count,
+)
 from .utils import (
     TestMultitenantAdminMixin,
     TestOrganizationMixin,
@@ -1030,6 +1045,45 @@ class TestUsersAdmin(TestOrganizationMixin, TestUserAdditionalFieldsMixin, TestC
         self.assertTrue(user.is_active)
         self.assertEqual(response.status_code, 200)
 
+    def test_action_confirmation_preview(self):
+        users = [
+            self._create_user(username=f'user{i}', email=f'user{i}@test.com')
+            for i in range(5)
+        ]
+        path = reverse(f'admin:{self.app_label}_user_changelist')
+        self.client.force_login(self._get_admin())
+        user_admin = admin.site._registry[User]
+
+        with self.subTest('selected users'), patch.object(
+            user_admin, 'action_confirmation_preview_size', 2
+        ):
+            post_data = {
+                '_selected_action': [user.pk for user in users],
+                'action': 'make_inactive',
+            }
+            response = self.client.post(path, post_data)
+            self.assertContains(response, '5 users selected')
+            self.assertContains(response, '<li>User: ', count=2)
+            self.assertContains(response, 'and 3 more users')
+            self.assertContains(response, 'name=\'_selected_action\'', count=5)
+            self.assertNotContains(response, 'name=\'select_across\'')
+
+        with self.subTest('all users matching the filters'):
+            # the superuser is excluded by the filter
+            path = f'{path}?is_staff__exact=0'
+            post_data = {
+                '_selected_action': [users[0].pk],
+                'select_across': '1',
+                'action': 'make_inactive',
+            }
+            response = self.client.post(path, post_data)
+            self.assertContains(response, '5 users selected')
+            self.assertContains(response, 'name=\'select_across\'', count=1)
+            self.assertContains(response, 'name=\'_selected_action\'', count=1)
+            post_data.update({'confirmation': 'Confirm'})
+            self.client.post(path, post_data)
+            self.assertEqual(User.objects.filter(is_active=False).count(), 5)
+
     def test_superuser_delete_operator(self):
         user = self._create_operator()
         org = self._create_org()
@@ -1297,6 +1351,7 @@ class TestUsersAdmin(TestOrganizationMixin, TestUserAdditionalFieldsMixin, TestC
         params = {
             'name': org.name,
             'slug': org.slug,
+            'is_active': True,
             'owner-TOTAL_FORMS': '1',
             'owner-INITIAL_FORMS': '1',
             'owner-MIN_NUM_FORMS': '0',
@@ -1445,7 +1500,7 @@ class TestUsersAdmin(TestOrganizationMixin, TestUserAdditionalFieldsMixin, TestC
             self.assertContains(r, msg)
             post_data.update({'post': 'yes'})
             # django-reversion adds ~4 queries
-            with self.assertNumQueries(21):
+            with self.assertNumQueries(19):
                 r = self.client.post(url, post_data, follow=True)
             qs = OrganizationUser.objects.filter(pk__in=[org_user.pk, org_user2.pk])
             self.assertEqual(r.status_code, 200)
@@ -1453,6 +1508,36 @@ class TestUsersAdmin(TestOrganizationMixin, TestUserAdditionalFieldsMixin, TestC
             self.assertEqual(qs.count(), 1)
             self.assertEqual(qs.first().organization, org1)
 
+    def test_delete_org_users_owners_single_query(self):
+        org_users = []
+        for i in range(5):
+            # as in is_owner, the owners of disabled organizations are ignored
+            org = self._create_org(name=f'org{i}', is_active=i < 4)
+            for j in range(3):
+                user = self._create_user(
+                    username=f'user{i}{j}', email=f'user{i}{j}@test.com'
+                )
+                org_users.append(
+                    self._create_org_user(user=user, organization=org, is_admin=j == 0)
+                )
+        org_user_admin = admin.site._registry[OrganizationUser]
+        request = RequestFactory().post('/')
+        request.user = self._get_admin()
+        queryset = OrganizationUser.objects.filter(pk__in=[o.pk for o in org_users])
+        with patch.object(org_user_admin, 'message_user') as message_user, patch(
+            'openwisp_users.admin.delete_selected'
+        ) as delete_selected:
+            with self.assertNumQueries(1):
+                org_user_admin.delete_selected_overridden(request, queryset)
+        self.assertIn("Can't delete 4 organization users", message_user.call_args[0][1])
+        self.assertCountEqual(
+            delete_selected.call_args[0][2],
+            [o for o in org_users if not o.is_admin or not o.organization.is_active],
+        )
+        self.assertTrue(
+            OrganizationOwner.objects.filter(organization__is_active=False).exists()
+        )
+
     @capture_any_output()
     def test_admin_add_user_with_invalid_email(self):
         admin = self._create_admin()
@@ -1496,6 +1581,161 @@ class TestUsersAdmin(TestOrganizationMixin, TestUserAdditionalFieldsMixin, TestC
                 html=True,
             )
 
+    def _create_bulk_action_users(self, count=5, **kwargs):
+        return [
+            self._create_user(username=f'bulk{i}', email=f'bulk{i}@test.com', **kwargs)
+            for i in range(count)
+        ]
+
+    @patch.object(app_settings, 'BULK_ACTION_BATCH_SIZE', 2)
+    @patch.object(app_settings, 'BULK_ACTION_RUNNER', 'openwisp_users.jobs.sync_runner')
+    def test_bulk_action_jobs(self):
+        users = self._create_bulk_action_users(is_active=False)
+        pks = [user.pk for user in users]
+        path = reverse(f'admin:{self.app_label}_user_changelist')
+        admin_user = self._get_admin()
+        self.client.force_login(admin_user)
+        post_data = {
+            '_selected_action': pks,
+            'action': 'make_active',
+            'confirmation': 'Confirm',
+        }
+
+        with self.subTest('make active'):
+            response = self.client.post(path, post_data, follow=True)
+            self.assertContains(response, 'being performed on 5 users in background')
+            self.assertContains(response, 'Successfully made 5 users active.')
+            self.assertEqual(User.objects.filter(pk__in=pks, is_active=True).count(), 5)
+            self.assertEqual(pop_user_jobs(admin_user), [])
+
+        with self.subTest('make inactive'):
+            post_data['action'] = 'make_inactive'
+            response = self.client.post(path, post_data, follow=True)
+            self.assertContains(response, 'Successfully made 5 users inactive.')
+            self.assertEqual(User.objects.filter(pk__in=pks, is_active=True).count(), 0)
+
+        with self.subTest('progress is reported'):
+            with patch('openwisp_users.jobs.sync_runner') as runner:
+                self.client.post(path, post_data)
+                response = self.client.get(path)
+                self.assertContains(response, 'in progress: 0 of 5 users processed')
+                run_job(runner.call_args[0][0])
+            response = self.client.get(path)
+            self.assertContains(response, 'Successfully made 5 users inactive.')
+            response = self.client.get(path)
+            self.assertNotContains(response, 'Successfully made')
+
+        with self.subTest('failure is reported'):
+            with patch.dict(
+                JOB_ACTIONS, {'make_inactive': Mock(side_effect=ValueError('error'))}
+            ), patch('openwisp_users.jobs.logger.exception') as logger:
+                response = self.client.post(path, post_data, follow=True)
+            logger.assert_called_once()
+            self.assertContains(
+                response, 'The action failed after processing 0 of 5 users: error'
+            )
+
+        with self.subTest('delete confirmation'):
+            post_data = {
+                '_selected_action': pks,
+                'action': 'delete_selected_overridden',
+            }
+            with patch.object(UserAdmin, 'action_confirmation_preview_size', 2):
+                response = self.client.post(path, post_data)
+            self.assertContains(response, '5 users selected')
+            self.assertContains(response, 'User: bulk', count=2)
+            self.assertContains(response, 'and 3 more users')
+            self.assertContains(response, 'delete the selected users?')
+            self.assertContains(response, "name='post' value='yes'")
+            self.assertEqual(User.objects.filter(pk__in=pks).count(), 5)
+
+        with self.subTest('delete'):
+            post_data['post'] = 'yes'
+            response = self.client.post(path, post_data, follow=True)
+            self.assertContains(response, 'Successfully deleted 5 users.')
+            self.assertEqual(User.objects.filter(pk__in=pks).count(), 0)
+            self.assertEqual(
+                LogEntry.objects.filter(
+                    action_flag=DELETION, object_id__in=[str(pk) for pk in pks]
+                ).count(),
+                5,
+            )
+
+    @patch.object(app_settings, 'BULK_ACTION_BATCH_SIZE', 2)
+    @patch.object(app_settings, 'BULK_ACTION_RUNNER', 'openwisp_users.jobs.sync_runner')
+    def test_bulk_delete_job_protected(self):
+        users = self._create_bulk_action_users()
+        org = self._create_org()
+        # only the last user, which is not in the first batch, is protected
+        self._create_org_user(user=users[-1], organization=org)
+        self.client.force_login(self._get_admin())
+        post_data = {
+            '_selected_action': [user.pk for user in users],
+            'action': 'delete_selected_overridden',
+            'post': 'yes',
+        }
+        path = reverse(f'admin:{self.app_label}_user_changelist')
+        field = OrganizationUser._meta.get_field('user')
+        with patch.object(field.remote_field, 'on_delete', models.PROTECT):
+            response = self.client.post(path, post_data)
+        self.assertContains(response, 'protected related objects')
+        self.assertContains(response, '1 organization user')
+        self.assertNotContains(response, "name='confirmation'")
+        self.assertEqual(
+            User.objects.filter(pk__in=post_data['_selected_action']).count(), 5
+        )
+
+    @patch.object(app_settings, 'BULK_ACTION_BATCH_SIZE', 2)
+    @patch.object(app_settings, 'BULK_ACTION_RUNNER', 'openwisp_users.jobs.sync_runner')
+    def test_bulk_delete_job_delete_queryset(self):
+        users = self._create_bulk_action_users()
+        admin_user = self._get_admin()
+        self.client.force_login(admin_user)
+        post_data = {
+            '_selected_action': [user.pk for user in users],
+            'action': 'delete_selected_overridden',
+            'post': 'yes',
+        }
+        path = reverse(f'admin:{self.app_label}_user_changelist')
+        with patch.object(
+            UserAdmin,
+            'delete_queryset',
+            autospec=True,
+            side_effect=lambda modeladmin, request, queryset: queryset.delete(),
+        ) as delete_queryset:
+            response = self.client.post(path, post_data, follow=True)
+        self.assertContains(response, 'Successfully deleted 5 users.')
+        self.assertEqual(delete_queryset.call_count, 3)
+        self.assertEqual(delete_queryset.call_args[0][1].user, admin_user)
+        self.assertEqual(
+            User.objects.filter(pk__in=post_data['_selected_action']).count(), 0
+        )
+
+    @patch.object(app_settings, 'BULK_ACTION_BATCH_SIZE', 2)
+    @patch.object(app_settings, 'BULK_ACTION_RUNNER', 'openwisp_users.jobs.sync_runner')
+    def test_bulk_delete_job_permissions(self):
+        users = self._create_bulk_action_users()
+        operator = self._create_operator()
+        org = self._create_org()
+        self._create_org_user(user=operator, organization=org, is_admin=True)
+        for user in users:
+            self._create_org_user(user=user, organization=org)
+        operator.user_permissions.remove(
+            *Permission.objects.filter(codename='delete_user')
+        )
+        self.client.force_login(operator)
+        post_data = {
+            '_selected_action': [user.pk for user in users],
+            'action': 'delete_selected_overridden',
+            'post': 'yes',
+        }
+        path = reverse(f'admin:{self.app_label}_user_changelist')
+        response = self.client.post(path, post_data)
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(
+            User.objects.filter(pk__in=post_data['_selected_action']).count(), 5
+        )
+
 
 class TestBasicUsersIntegration(
     TestOrganizationMixin, TestUserAdditionalFieldsMixin, TestCase
@@ -1700,6 +1940,31 @@ class TestMultitenantAdmin(TestMultitenantAdminMixin, TestOrganizationMixin, Tes
             hidden=[data['user2'], data['user22'], data['user1'], data['user12']],
         )
 
+    def test_useradmin_multitenancy_single_query(self):
+        org1 = self._create_org(name='org1')
+        org2 = self._create_org(name='org2')
+        org3 = self._create_org(name='org3', is_active=False)
+        operator = self._create_operator()
+        self._create_org_user(organization=org1, user=operator, is_admin=True)
+        self._create_org_user(organization=org2, user=operator, is_admin=False)
+        self._create_org_user(organization=org3, user=operator, is_admin=True)
+        user1 = self._create_user(username='user1', email='user1@test.com')
+        user2 = self._create_user(username='user2', email='user2@test.com')
+        user3 = self._create_user(username='user3', email='user3@test.com')
+        self._create_org_user(organization=org1, user=user1)
+        self._create_org_user(organization=org3, user=user1)
+        self._create_org_user(organization=org2, user=user2)
+        self._create_org_user(organization=org3, user=user3)
+        superuser = self._get_admin()
+        self._create_org_user(organization=org1, user=superuser)
+        request = RequestFactory().get('/')
+        request.user = operator
+        user_admin = admin.site._registry[User]
+        with self.assertNumQueries(1):
+            users = list(user_admin.get_queryset(request))
+        # users are listed once even if they share many organizations
+        self.assertCountEqual(users, [operator, user1, user3])
+
     def test_multitenant_admin_manager_only(self):
         staff = self._create_user(
             username='staff__user', email='staff@staff.org', is_staff=True
@@ -1763,3 +2028,256 @@ class TestMultitenantAdmin(TestMultitenantAdminMixin, TestOrganizationMixin, Tes
             response = self.client.get(url)
             for pk in user.organizations_managed:
                 self.assertNotContains(response, f'href="?organization={pk}">')
+
+    def test_organization_user_autocomplete_filter(self):
+        data = self._create_multitenancy_test_env()
+        self._make_org_manager(data['operator'], data['org1'])
+        user_admin = admin.site._registry[User]
+        list_filter = (OrganizationUserAutocompleteFilter,) + tuple(
+            user_admin.list_filter[1:]
+        )
+        url = reverse(f'admin:{self.app_label}_user_changelist')
+        autocomplete_url = reverse(f'admin:{self.app_label}_organization_autocomplete')
+        self._login(username='operator', password='tester')
+
+        with patch.object(type(user_admin), 'list_filter', list_filter):
+            with self.subTest('no organization selected'):
+                response = self.client.get(url)
+                self.assertContains(response, 'id="id_filter_organization"')
+                self.assertContains(response, f'data-ajax--url="{autocomplete_url}"')
+                self.assertContains(
+                    response, 'openwisp-users/js/autocomplete-filter.js'
+                )
+                self.assertNotContains(response, 'href="?organization=')
+                self.assertNotContains(response, f'>{data["org3"].name}</option>')
+
+            with self.subTest('organization selected'):
+                response = self.client.get(url, {'organization': str(data['org1'].pk)})
+                self.assertContains(
+                    response,
+                    f'<option value="{data["org1"].pk}" selected>'
+                    f'{data["org1"].name}</option>',
+                )
+                self.assertNotContains(response, f'>{data["org3"].name}</option>')
+                self.assertContains(response, data['user12'].username)
+                self.assertNotContains(response, data['user3'].username)
+
+            with self.subTest('organization not managed'):
+                response = self.client.get(url, {'organization': str(data['org2'].pk)})
+                self.assertNotContains(response, f'>{data["org2"].name}</option>')
+
+        with self.subTest('autocomplete view shows only organizations managed'):
+            response = self.client.get(autocomplete_url, {'term': 'organization'})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(
+                {result['id'] for result in response.json()['results']},
+                {str(data['org1'].pk), str(data['org3'].pk)},
+            )
+
+        with self.subTest('custom admin site'):
+            site = admin.AdminSite(name='custom_admin')
+            model_admin = type(user_admin)(User, site)
+            request = RequestFactory().get(url)
+            request.user = data['operator']
+            organization_filter = OrganizationUserAutocompleteFilter(
+                request, {}, User, model_admin
+            )
+            self.assertIs(organization_filter.admin_site, site)
+            widget = organization_filter.get_widget(organization_filter.admin_site)
+            self.assertIs(widget.admin_site, site)
+            with patch.object(type(model_admin), 'list_filter', list_filter):
+                self.assertIn(
+                    'openwisp-users/js/autocomplete-filter.js', str(model_admin.media)
+                )
+
+    def test_approximate_count(self):
+        data = self._create_multitenancy_test_env()
+        user_admin = admin.site._registry[User]
+        request = RequestFactory().get(
+            reverse(f'admin:{self.app_label}_user_changelist')
+        )
+        request.user = data['operator']
+
+        with patch.object(user_admin, 'approximate_count', True):
+            with self.subTest('filtered count is cached'):
+                cl = user_admin.get_changelist_instance(request)
+                self.assertIsInstance(cl, ApproximateCountChangeList)
+                self.assertEqual(cl.result_count, 2)
+                self.assertEqual(cl.full_result_count, 2)
+                self._create_org_user(
+                    organization=data['org3'],
+                    user=self._create_user(username='new', email='new@test.com'),
+                )
+                with self.assertNumQueries(0):
+                    self.assertEqual(
+                        get_approximate_count(cl.queryset, data['operator']), 2
+                    )
+                with patch.object(app_settings, 'ADMIN_COUNT_CACHE_TIMEOUT', 0):
+                    cl = user_admin.get_changelist_instance(request)
+                    self.assertEqual(cl.result_count, 3)
+
+            with self.subTest('full count hidden above threshold'):
+                with patch.object(app_settings, 'ADMIN_APPROXIMATE_COUNT_THRESHOLD', 1):
+                    cl = user_admin.get_changelist_instance(request)
+                self.assertFalse(cl.show_full_result_count)
+                self.assertIsNone(cl.full_result_count)
+                self.assertTrue(cl.show_admin_actions)
+
+            with self.subTest('unfiltered count is estimated'):
+                request.user = self._get_admin()
+                with patch(
+                    'openwisp_users.multitenancy.get_estimated_count',
+                    return_value=1000000,
+                ):
+                    cl = user_admin.get_changelist_instance(request)
+                    self.client.force_login(request.user)
+                    response = self.client.get(request.path)
+                self.assertEqual(cl.result_count, 1000000)
+                self.assertIsNone(cl.full_result_count)
+                self.assertTrue(cl.multi_page)
+                self.assertContains(response, '1000000 users')
+
+        with self.subTest('disabled'):
+            cl = user_admin.get_changelist_instance(request)
+            self.assertNotIsInstance(cl, ApproximateCountChangeList)
+
+    def test_approximate_count_no_organizations_managed(self):
+        self._create_multitenancy_test_env()
+        operator = self._create_user(
+            username='operator2', email='operator2@test.com', is_staff=True
+        )
+        for model in [Organization, OrganizationUser]:
+            model_admin = admin.site._registry[model]
+            request = RequestFactory().get(
+                reverse(f'admin:{self.app_label}_{model._meta.model_name}_changelist')
+            )
+            request.user = operator
+            with self.subTest(model=model._meta.model_name), patch.object(
+                model_admin, 'approximate_count', True
+            ):
+                cl = model_admin.get_changelist_instance(request)
+                self.assertIsInstance(cl, ApproximateCountChangeList)
+                self.assertEqual(cl.result_count, 0)
+                self.assertEqual(cl.full_result_count, 0)
+
+    def test_owner_flag_annotation(self):
+        data = self._create_multitenancy_test_env()
+        self._make_org_manager(data['operator'], data['org1'])
+        user_admin = admin.site._registry[User]
+        request = RequestFactory().get('/')
+        request.user = data['operator']
+        queryset = user_admin.get_queryset(request)
+        owner = queryset.get(pk=data['user1'].pk)
+        member = queryset.get(pk=data['user12'].pk)
+
+        with self.subTest('annotation is used'):
+            with patch.object(
+                User, 'organizations_dict', new_callable=PropertyMock
+            ) as organizations_dict:
+                self.assertTrue(owner.is_owner_of_any_organization)
+                self.assertTrue(
+                    user_not_allowed_to_change_owner(data['operator'], owner)
+                )
+                self.assertFalse(
+                    user_not_allowed_to_change_owner(data['operator'], member)
+                )
+                organizations_dict.assert_not_called()
+
+        with self.subTest('fallback to cache'):
+            owner = User.objects.get(pk=data['user1'].pk)
+            self.assertNotIn('is_owner_of_any_organization', owner.__dict__)
+            self.assertTrue(user_not_allowed_to_change_owner(data['operator'], owner))
+
+        with self.subTest('inactive organizations are ignored'):
+            data['org1'].is_active = False
+            data['org1'].save()
+            self._create_org_user(
+                organization=data['org2'], user=data['operator'], is_admin=True
+            )
+            self.assertFalse(
+                queryset.get(pk=data['user1'].pk).is_owner_of_any_organization
+            )
+            self.assertTrue(
+                queryset.get(pk=data['user2'].pk).is_owner_of_any_organization
+            )
+
+        with self.subTest('not annotated for superusers'):
+            request.user = self._get_admin()
+            owner = user_admin.get_queryset(request).get(pk=data['user1'].pk)
+            self.assertNotIn('is_owner_of_any_organization', owner.__dict__)
+
+    def test_export_users_action(self):
+        data = self._create_multitenancy_test_env()
+        path = reverse(f'admin:{self.app_label}_user_changelist')
+        post_data = {
+            '_selected_action': [data['user1'].pk],
+            'select_across': '1',
+            'action': 'export_csv',
+        }
+
+        with self.subTest('operator only gets the organizations managed'):
+            self._login(username='operator', password='tester')
+            response = self.client.post(path, post_data)
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.streaming)
+            self.assertEqual(response['Content-Type'], 'text/csv')
+            rows = list(
+                csv.DictReader(
+                    b''.join(response.streaming_content).decode().splitlines()
+                )
+            )
+            self.assertEqual(
+                sorted((row['username'], row['organization']) for row in rows),
+                [('operator', 'organization3'), ('user3', 'organization3')],
+            )
+            operator_row = rows[[row['username'] for row in rows].index('operator')]
+            self.assertEqual(operator_row['is_admin'], 'True')
+            self.assertEqual(operator_row['is_owner'], 'True')
+            self._logout()
+
+        with self.subTest('superuser gets all the organizations'):
+            self._login()
+            post_data.update({'action': 'export_ndjson'})
+            response = self.client.post(path, post_data)
+            self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+            rows = [
+                json.loads(line)
+                for line in b''.join(response.streaming_content).decode().splitlines()
+            ]
+            non_members = User.objects.exclude(
+                pk__in=OrganizationUser.objects.values('user_id')
+            )
+            self.assertEqual(
+                len(rows), OrganizationUser.objects.count() + non_members.count()
+            )
+            admin_row = rows[[row['username'] for row in rows].index('admin')]
+            self.assertIsNone(admin_row['organization_id'])
+            self.assertIsNone(admin_row['is_admin'])
+            self.assertIsNone(admin_row['is_owner'])
+            user1_row = rows[[row['username'] for row in rows].index('user1')]
+            self.assertEqual(user1_row['organization_id'], str(data['org1'].pk))
+            self.assertTrue(user1_row['is_admin'])
+            self.assertTrue(user1_row['is_owner'])
+            user12_row = rows[[row['username'] for row in rows].index('user12')]
+            self.assertFalse(user12_row['is_admin'])
+            self.assertFalse(user12_row['is_owner'])
+
+
+class TestBulkActionJobs(TestOrganizationMixin, TransactionTestCase):
+    @patch.object(app_settings, 'BULK_ACTION_BATCH_SIZE', 2)
+    def test_thread_pool_runner(self):
+        users = [
+            self._create_user(username=f'user{i}', email=f'user{i}@test.com')
+            for i in range(5)
+        ]
+        queryset = User.objects.filter(pk__in=[user.pk for user in users])
+        job = start_job('make_inactive', queryset, self._create_admin())
+        for i in range(100):
+            job = get_job(job['id'])
+            if job['status'] == 'completed':
+                break
+            sleep(0.05)
+        self.assertEqual(job['status'], 'completed')
+        self.assertEqual(job['processed'], 5)
+        self.assertEqual(job['affected'], 5)
+        self.assertEqual(queryset.filter(is_active=True).count(), 0)
@@ -1,7 +1,19 @@
+import json
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import AnonymousUser
 from django.core.cache import cache
-from django.test import TestCase
+from django.test import RequestFactory, TestCase
 from django.urls import reverse
+from drf_yasg import openapi
+from drf_yasg.generators import OpenAPISchemaGenerator
+from rest_framework.authtoken.models import Token
 
+from openwisp_users import settings as app_settings
+from openwisp_users.api.throttling import AuthRateThrottle
+from openwisp_users.api.urls import get_api_urls
+from openwisp_users.api.views import async_obtain_auth_token
 from openwisp_users.tests.utils import TestOrganizationMixin
 
 
@@ -15,3 +27,85 @@ class TestRestFrameworkViews(TestOrganizationMixin, TestCase):
         url = reverse('users:user_auth_token')
         r = self.client.post(url, params)
         self.assertIn('token', r.data)
+
+    def _async_obtain_auth_token(self, data=None, **kwargs):
+        if data is not None:
+            kwargs.update(
+                {'data': json.dumps(data), 'content_type': 'application/json'}
+            )
+        request = RequestFactory().post('/', **kwargs)
+        request.user = AnonymousUser()
+        return async_to_sync(async_obtain_auth_token)(request)
+
+    @mock.patch.object(AuthRateThrottle, 'rate', None)
+    def test_async_obtain_auth_token(self):
+        user = self._create_user(username='tester', password='tester')
+
+        with self.subTest('valid credentials'):
+            r = self._async_obtain_auth_token(
+                {'username': 'tester', 'password': 'tester'}
+            )
+            self.assertEqual(r.status_code, 200)
+            self.assertEqual(
+                json.loads(r.content),
+                {'token': Token.objects.get(user=user).key},
+            )
+
+        with self.subTest('wrong password'):
+            r = self._async_obtain_auth_token(
+                {'username': 'tester', 'password': 'wrong'}
+            )
+            self.assertEqual(r.status_code, 400)
+            self.assertIn('non_field_errors', json.loads(r.content))
+
+        with self.subTest('missing fields'):
+            r = self._async_obtain_auth_token({'username': 'tester'})
+            self.assertEqual(r.status_code, 400)
+            self.assertEqual(list(json.loads(r.content).keys()), ['password'])
+
+        with self.subTest('invalid JSON'):
+            r = self._async_obtain_auth_token(data='[]')
+            self.assertEqual(r.status_code, 400)
+
+        with self.subTest('form data'):
+            request = RequestFactory().post(
+                '/', {'username': 'tester', 'password': 'tester'}
+            )
+            request.user = AnonymousUser()
+            r = async_to_sync(async_obtain_auth_token)(request)
+            self.assertEqual(r.status_code, 200)
+
+        with self.subTest('method not allowed'):
+            request = RequestFactory().get('/')
+            r = async_to_sync(async_obtain_auth_token)(request)
+            self.assertEqual(r.status_code, 405)
+
+        with self.subTest('throttling'), mock.patch.object(
+            AuthRateThrottle, 'rate', '1/day'
+        ):
+            data = {'username': 'tester', 'password': 'tester'}
+            r = self._async_obtain_auth_token(data)
+            self.assertEqual(r.status_code, 200)
+            r = self._async_obtain_auth_token(data)
+            self.assertEqual(r.status_code, 429)
+
+    def test_async_obtain_auth_token_url(self):
+        with mock.patch.object(app_settings, 'AUTH_API_ASYNC', True):
+            urlpatterns = get_api_urls()
+        self.assertIs(urlpatterns[0].callback, async_obtain_auth_token)
+
+    def test_async_obtain_auth_token_schema(self):
+        with mock.patch.object(app_settings, 'AUTH_API_ASYNC', True):
+            urlpatterns = get_api_urls()
+        generator = OpenAPISchemaGenerator(
+            openapi.Info(title='test', default_version='v1'), patterns=urlpatterns
+        )
+        schema = generator.get_schema(public=True)
+        self.assertEqual(
+            set(schema['definitions']), {'ObtainTokenRequest', 'ObtainTokenResponse'}
+        )
+        (path,) = schema['paths'].values()
+        self.assertEqual(
+            path['post']['responses']['200']['schema']['$ref'],
+            '#/definitions/ObtainTokenResponse',
+        )
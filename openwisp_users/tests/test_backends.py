@@ -1,15 +1,34 @@
 from unittest import mock
 from uuid import UUID
 
+import phonenumbers
+from asgiref.sync import async_to_sync
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.signals import user_login_failed
+from django.core.cache import cache
 from django.test import TestCase
 from django.test.utils import override_settings
+from django.utils.timezone import now
 
 from openwisp_users import settings as users_settings
-from openwisp_users.backends import UsersAuthenticationBackend
+from openwisp_users.backends import (
+    UsersAuthenticationBackend,
+    aauthenticate,
+    get_hash_executor,
+    may_be_phone_number,
+    parse_phone_number,
+    verify_password,
+)
+from openwisp_users.cache import (
+    get_unknown_identifier,
+    get_unknown_identifier_cache_key,
+)
 
 from .utils import TestOrganizationMixin
 
 auth_backend = UsersAuthenticationBackend()
+User = get_user_model()
 
 
 class TestBackends(TestOrganizationMixin, TestCase):
@@ -148,3 +167,174 @@ class TestBackends(TestOrganizationMixin, TestCase):
                 password='tester2',
             )
             self.assertEqual(auth_backend.get_users('911524370').count(), 0)
+
+    def test_phone_number_pre_classifier(self):
+        for identifier in ['tester', 'tester@test.com', 'tester1', '+39 abc', '+-. ']:
+            with self.subTest(identifier):
+                self.assertFalse(may_be_phone_number(identifier))
+        for identifier in ['+393665243702', '3665243702', '+39 (366) 52.43-702']:
+            with self.subTest(identifier):
+                self.assertTrue(may_be_phone_number(identifier))
+
+        with mock.patch('phonenumbers.parse') as parse:
+            auth_backend.get_users('tester@test.com')
+            auth_backend.get_users('')
+            parse.assert_not_called()
+
+    @mock.patch.object(users_settings, 'AUTH_BACKEND_AUTO_PREFIXES', ('+39',))
+    def test_phone_number_parse_cache(self):
+        parse_phone_number.cache_clear()
+        with mock.patch('phonenumbers.parse', wraps=phonenumbers.parse) as parse:
+            for _ in range(3):
+                self.assertEqual(
+                    auth_backend._get_phone_number('3665243702'), '+393665243702'
+                )
+            # without prefix and with the first prefix
+            self.assertEqual(parse.call_count, 2)
+
+        with self.subTest('prefixes are part of the key'):
+            with mock.patch.object(users_settings, 'AUTH_BACKEND_AUTO_PREFIXES', ()):
+                self.assertFalse(auth_backend._get_phone_number('3665243702'))
+
+    def test_get_users_precedence(self):
+        # the same value is used for all the fields to verify the precedence
+        identifier = '+393665243702'
+        username_user = self._create_user(
+            username=identifier, email='tester1@test.com', password='tester1'
+        )
+        email_user = self._create_user(
+            username='tester2', email='tester2@test.com', password='tester2'
+        )
+        # bypasses the validation of the email
+        User.objects.filter(pk=email_user.pk).update(email=identifier)
+        phone_user = self._create_user(
+            username='tester3',
+            email='tester3@test.com',
+            phone_number=identifier,
+            password='tester3',
+        )
+
+        with self.subTest('or lookup'):
+            queryset = auth_backend.get_users(identifier)
+            self.assertNotIn('UNION', str(queryset.query))
+            self.assertEqual(set(queryset), {phone_user, email_user, username_user})
+            with self.assertNumQueries(1):
+                self.assertEqual(auth_backend.lookup_user(identifier), phone_user)
+            User.objects.filter(pk=phone_user.pk).update(phone_number=None)
+            self.assertEqual(auth_backend.lookup_user(identifier), email_user)
+            self.assertEqual(auth_backend.lookup_user('tester2'), email_user)
+            self.assertIsNone(auth_backend.lookup_user('unknown'))
+            User.objects.filter(pk=phone_user.pk).update(phone_number=identifier)
+
+        with self.subTest('union lookup'), mock.patch.object(
+            users_settings, 'AUTH_BACKEND_LOOKUP', 'union'
+        ):
+            queryset = auth_backend.get_users(identifier)
+            self.assertIn('UNION ALL', str(queryset.query))
+            with self.assertNumQueries(1):
+                self.assertEqual(
+                    list(queryset), [phone_user, email_user, username_user]
+                )
+            with self.assertNumQueries(1):
+                self.assertEqual(auth_backend.lookup_user(identifier), phone_user)
+            self.assertEqual(auth_backend.get_users('tester2')[0], email_user)
+
+    def test_unknown_identifier_cache(self):
+        cache.clear()
+        with self.subTest('unknown identifiers are cached'):
+            with self.assertNumQueries(1):
+                self.assertIsNone(auth_backend.authenticate(None, 'tester', 'tester'))
+            with self.assertNumQueries(0), mock.patch.object(
+                User, 'set_password'
+            ) as set_password:
+                self.assertIsNone(auth_backend.authenticate(None, 'tester', 'tester'))
+            # the password is hashed anyway
+            set_password.assert_called_once_with('tester')
+
+        with self.subTest('identifiers are hashed'):
+            cache_key = get_unknown_identifier_cache_key('tester')
+            self.assertNotIn('tester', cache_key)
+            self.assertTrue(get_unknown_identifier('tester')[0])
+
+        with self.subTest('cache invalidated when users are created'):
+            user = self._create_user(username='tester', password='tester')
+            self.assertFalse(get_unknown_identifier('tester')[0])
+            self.assertEqual(auth_backend.authenticate(None, 'tester', 'tester'), user)
+
+        with self.subTest('cache not invalidated by other fields'):
+            self.assertIsNone(auth_backend.authenticate(None, '+393665243702', 'x'))
+            user.last_login = now()
+            user.save(update_fields=['last_login'])
+            self.assertTrue(get_unknown_identifier('+393665243702')[0])
+            user.phone_number = '+393665243702'
+            user.save()
+            self.assertFalse(get_unknown_identifier('+393665243702')[0])
+            self.assertEqual(
+                auth_backend.authenticate(None, '+393665243702', 'tester'), user
+            )
+
+        with self.subTest('cache disabled'), mock.patch.object(
+            users_settings, 'AUTH_BACKEND_UNKNOWN_IDENTIFIER_CACHE_TIMEOUT', 0
+        ):
+            for _ in range(2):
+                with self.assertNumQueries(1):
+                    auth_backend.authenticate(None, 'unknown', 'tester')
+
+    def test_aauthenticate(self):
+        cache.clear()
+        user = self._create_user(username='tester', password='tester')
+        aauthenticate = async_to_sync(auth_backend.aauthenticate)
+
+        with self.subTest('valid credentials'):
+            self.assertEqual(aauthenticate(None, 'tester', 'tester'), user)
+
+        with self.subTest('password verified in the pool'):
+            with mock.patch.object(
+                get_hash_executor(), 'submit', wraps=get_hash_executor().submit
+            ) as submit:
+                self.assertIsNone(aauthenticate(None, 'tester', 'wrong'))
+                self.assertIsNone(aauthenticate(None, 'unknown', 'tester'))
+            self.assertEqual(submit.call_count, 2)
+            self.assertEqual(submit.call_args_list[0][0][0], verify_password)
+            self.assertEqual(submit.call_args_list[1][0][0], make_password)
+            self.assertIsNone(aauthenticate(None, None, 'tester'))
+
+        with self.subTest('inactive user'):
+            user.is_active = False
+            user.save()
+            self.assertIsNone(aauthenticate(None, 'tester', 'tester'))
+            user.is_active = True
+            user.save()
+
+        with self.subTest('hash upgraded to the preferred hasher'), override_settings(
+            PASSWORD_HASHERS=[
+                'django.contrib.auth.hashers.PBKDF2PasswordHasher',
+                'django.contrib.auth.hashers.MD5PasswordHasher',
+            ]
+        ):
+            User.objects.filter(pk=user.pk).update(
+                password=make_password('tester', hasher='md5')
+            )
+            self.assertEqual(aauthenticate(None, 'tester', 'tester'), user)
+            user.refresh_from_db()
+            self.assertFalse(user.password.startswith('md5$'))
+            self.assertTrue(user.check_password('tester'))
+
+    @override_settings(
+        AUTHENTICATION_BACKENDS=('openwisp_users.backends.UsersAuthenticationBackend',)
+    )
+    def test_aauthenticate_function(self):
+        user = self._create_user(username='tester', password='tester')
+        authenticated = async_to_sync(aauthenticate)(
+            username='tester', password='tester'
+        )
+        self.assertEqual(authenticated, user)
+        self.assertEqual(
+            authenticated.backend, 'openwisp_users.backends.UsersAuthenticationBackend'
+        )
+        with mock.patch.object(user_login_failed, 'send') as send:
+            self.assertIsNone(
+                async_to_sync(aauthenticate)(username='tester', password='wrong')
+            )
+        send.assert_called_once()
+        self.assertEqual(send.call_args[1]['credentials']['password'], '********')
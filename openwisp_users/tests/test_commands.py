@@ -0,0 +1,250 @@
+import csv
+import json
+import os
+from io import StringIO
+from tempfile import TemporaryDirectory
+from unittest.mock import patch
+
+from allauth.account.models import EmailAddress
+from django.contrib.auth import get_user_model
+from django.core.management import CommandError, call_command
+from django.test import TestCase
+from swapper import load_model
+
+from ..importer import import_users
+from .utils import TestOrganizationMixin
+
+OrganizationUser = load_model('openwisp_users', 'OrganizationUser')
+User = get_user_model()
+
+
+class TestExportUsersCommand(TestOrganizationMixin, TestCase):
+    def _create_export_env(self):
+        org1 = self._create_org(name='org1')
+        org2 = self._create_org(name='org2')
+        user1 = self._create_user(username='user1', email='user1@test.com')
+        user2 = self._create_user(username='user2', email='user2@test.com')
+        self._create_org_user(organization=org1, user=user1, is_admin=True)
+        self._create_org_user(organization=org2, user=user1)
+        self._create_org_user(organization=org2, user=user2)
+        # not member of any organization
+        self._create_user(username='user3', email='user3@test.com')
+        return org1, org2
+
+    def test_export_csv(self):
+        self._create_export_env()
+        stdout = StringIO()
+        call_command('export_users', '--chunk-size', '1', stdout=stdout)
+        rows = list(csv.DictReader(stdout.getvalue().splitlines()))
+        self.assertEqual(len(rows), 5)
+        self.assertEqual(
+            sorted(
+                (row['username'], row['organization'], row['is_admin'], row['is_owner'])
+                for row in rows
+            ),
+            [
+                ('tester', '', '', ''),
+                ('user1', 'org1', 'True', 'True'),
+                ('user1', 'org2', 'False', 'False'),
+                ('user2', 'org2', 'False', 'False'),
+                ('user3', '', '', ''),
+            ],
+        )
+
+    def test_export_csv_injection(self):
+        self._create_user(
+            username='injection',
+            email='injection@test.com',
+            first_name='=HYPERLINK("http://example.com")',
+            last_name='-2+3',
+        )
+        stdout = StringIO()
+        call_command('export_users', stdout=stdout)
+        rows = list(csv.DictReader(stdout.getvalue().splitlines()))
+        row = next(row for row in rows if row['username'] == 'injection')
+        self.assertEqual(row['first_name'], '\'=HYPERLINK("http://example.com")')
+        self.assertEqual(row['last_name'], "'-2+3")
+
+        with self.subTest('ndjson is not escaped'):
+            stdout = StringIO()
+            call_command('export_users', '--format', 'ndjson', stdout=stdout)
+            rows = [json.loads(line) for line in stdout.getvalue().splitlines()]
+            row = next(row for row in rows if row['username'] == 'injection')
+            self.assertEqual(row['last_name'], '-2+3')
+
+    def test_export_ndjson_organization(self):
+        org1, org2 = self._create_export_env()
+        stdout = StringIO()
+        call_command(
+            'export_users',
+            '--format',
+            'ndjson',
+            '--organization',
+            'org2',
+            stdout=stdout,
+        )
+        rows = [json.loads(line) for line in stdout.getvalue().splitlines()]
+        self.assertEqual(len(rows), 2)
+        self.assertEqual({row['organization_id'] for row in rows}, {str(org2.pk)})
+        self.assertEqual({row['username'] for row in rows}, {'user1', 'user2'})
+
+        with self.assertRaises(CommandError):
+            call_command('export_users', '--organization', 'missing')
+
+    def test_export_output(self):
+        self._create_export_env()
+        with TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'users.csv')
+            call_command('export_users', '--output', path, stdout=StringIO())
+            with open(path) as output:
+                lines = output.read().splitlines()
+        # one row for each organization user, one for each
+        # user which is not member of any organization and the header
+        non_members = User.objects.exclude(
+            pk__in=OrganizationUser.objects.values('user_id')
+        )
+        self.assertEqual(
+            len(lines), OrganizationUser.objects.count() + non_members.count() + 1
+        )
+        self.assertTrue(lines[0].startswith('user_id,username,email'))
+
+
+class TestBulkImportUsers(TestOrganizationMixin, TestCase):
+    def _write_csv(self, directory, lines):
+        path = os.path.join(directory, 'users.csv')
+        with open(path, 'w') as csv_file:
+            csv_file.write('\n'.join(lines))
+        return path
+
+    def test_import_users(self):
+        org = self._create_org(name='org1', slug='org1')
+        taken = self._create_user(username='taken', email='taken@test.com')
+        EmailAddress.objects.create(user=taken, email='secondary@test.com')
+        rows = [
+            {
+                'username': 'user1',
+                'email': 'user1@test.com',
+                'password': 'secret',
+                'phone_number': '+393664255801',
+                'is_admin': 'true',
+            },
+            {'username': 'user2', 'email': 'USER2@test.com', 'organization': ''},
+            {'username': 'taken', 'email': 'new@test.com'},
+            {'username': 'user3', 'email': 'Taken@test.com'},
+            {'username': 'user4', 'email': 'user2@TEST.com'},
+            {'username': 'user5', 'phone_number': '+393664255801'},
+            {'username': 'user6', 'organization': 'missing'},
+            {'username': '', 'email': 'user7@test.com'},
+            {'username': 'user8', 'email': 'Secondary@test.com'},
+        ]
+        progress = []
+        with self.assertNumQueries(12):
+            result = import_users(
+                rows,
+                organization='org1',
+                batch_size=3,
+                hash_workers=0,
+                callback=lambda result: progress.append(result['created']),
+            )
+        self.assertEqual(result['created'], 2)
+        self.assertEqual(progress, [2, 2, 2])
+        self.assertEqual(
+            [(number, list(errors.keys())) for number, errors in result['errors']],
+            [
+                (3, ['username']),
+                (4, ['email']),
+                (5, ['email']),
+                (6, ['phone_number']),
+                (7, ['organization']),
+                (8, ['username']),
+                (9, ['email']),
+            ],
+        )
+        user1 = User.objects.get(username='user1')
+        self.assertTrue(user1.check_password('secret'))
+        self.assertEqual(str(user1.phone_number), '+393664255801')
+        self.assertTrue(user1.is_owner(org))
+        email = EmailAddress.objects.get(user=user1)
+        self.assertTrue(email.primary)
+        self.assertTrue(email.verified)
+        user2 = User.objects.get(username='user2')
+        self.assertFalse(user2.has_usable_password())
+        self.assertEqual(user2.email, 'USER2@test.com')
+        self.assertTrue(user2.is_member(org))
+        self.assertFalse(user2.is_manager(org))
+        self.assertEqual(org.get_member_pks(), {str(user1.pk), str(user2.pk)})
+
+    def test_import_typed_values(self):
+        org = self._create_org(name='org1', slug='org1')
+        rows = [
+            {
+                'username': 'user1',
+                'password': 1234,
+                'organization': 'org1',
+                'is_admin': True,
+            },
+            {'username': 2, 'organization': 'org1', 'is_admin': False},
+            {'username': 'user3', 'email': None, 'is_admin': None},
+        ]
+        result = import_users(rows, hash_workers=0)
+        self.assertEqual(result['errors'], [])
+        self.assertEqual(result['created'], 3)
+        user1 = User.objects.get(username='user1')
+        self.assertTrue(user1.check_password('1234'))
+        self.assertTrue(user1.is_manager(org))
+        user2 = User.objects.get(username='2')
+        self.assertTrue(user2.is_member(org))
+        self.assertFalse(user2.is_manager(org))
+        self.assertIsNone(User.objects.get(username='user3').email)
+
+    def test_hash_workers(self):
+        rows = [{'username': f'user{i}', 'password': f'pass{i}'} for i in range(3)]
+        with self.subTest('small imports do not start the pool'):
+            with patch('openwisp_users.importer.ProcessPoolExecutor') as executor:
+                result = import_users(rows[:1], hash_workers=2)
+            executor.assert_not_called()
+            self.assertEqual(result['created'], 1)
+
+        with patch('openwisp_users.importer.HASH_POOL_THRESHOLD', 1):
+            result = import_users(rows[1:], hash_workers=2)
+        self.assertEqual(result['created'], 2)
+        for i in range(3):
+            user = User.objects.get(username=f'user{i}')
+            self.assertTrue(user.check_password(f'pass{i}'))
+
+    def test_command(self):
+        org = self._create_org(name='org1', slug='org1')
+        with TemporaryDirectory() as directory:
+            path = self._write_csv(
+                directory,
+                [
+                    'username,email,password,organization',
+                    'user1,user1@test.com,secret,org1',
+                    'user2,user1@test.com,secret,',
+                ],
+            )
+            stdout = StringIO()
+            stderr = StringIO()
+            call_command(
+                'bulk_import_users',
+                path,
+                '--admin',
+                '--hash-workers',
+                '0',
+                '--verbosity',
+                '2',
+                stdout=stdout,
+                stderr=stderr,
+            )
+            self.assertIn('Imported 1 users (', stdout.getvalue())
+            self.assertIn('Imported 1 users in ', stdout.getvalue())
+            self.assertIn('1 rows skipped', stdout.getvalue())
+            self.assertIn('Row 2: email: already taken', stderr.getvalue())
+            self.assertTrue(User.objects.get(username='user1').is_manager(org))
+
+            path = self._write_csv(directory, ['email', 'user3@test.com'])
+            with self.assertRaises(CommandError):
+                call_command('bulk_import_users', path)
+
+        with self.assertRaises(CommandError):
+            call_command('bulk_import_users', '/nonexistent/users.csv')
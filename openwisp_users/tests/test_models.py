@@ -1,9 +1,20 @@
+import uuid
+from time import monotonic
+from unittest import mock
+
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
 from django.core.exceptions import ValidationError
-from django.test import TestCase, override_settings
+from django.core.signals import request_finished, request_started
+from django.db import IntegrityError, transaction
+from django.db.models import Subquery
+from django.test import TestCase, TransactionTestCase, override_settings
 from django.urls import reverse
 from swapper import load_model
 
+from .. import cache as cache_module
+from .. import settings as app_settings
+from ..utils import bulk_membership_changes
 from .utils import TestOrganizationMixin
 
 Organization = load_model('openwisp_users', 'Organization')
@@ -78,9 +89,9 @@ class TestUsers(TestOrganizationMixin, TestCase):
 
         OrganizationUser.objects.create(user=user, organization=org1)
 
-        # cache is automatically updated
-        with self.assertNumQueries(0):
-            list(user.organizations_dict)
+        # the shared cache is bypassed until the transaction is committed
+        with self.assertNumQueries(1):
+            self.assertIn(str(org1.pk), user.organizations_dict)
 
     def test_is_member(self):
         user = self._create_user(username='organizations_pk')
@@ -136,25 +147,80 @@ class TestUsers(TestOrganizationMixin, TestCase):
 
     def test_organizations_managed(self):
         user = self._create_user(username='organizations_pk')
-        self.assertEqual(user.organizations_managed, [])
+        self.assertEqual(user.organizations_managed, frozenset())
         org1 = self._create_org(name='org1')
         org2 = self._create_org(name='org2')
         org3 = self._create_org(name='org3')
         OrganizationUser.objects.create(user=user, organization=org1, is_admin=True)
         OrganizationUser.objects.create(user=user, organization=org2, is_admin=True)
         OrganizationUser.objects.create(user=user, organization=org3, is_admin=False)
-        self.assertEqual(user.organizations_managed, [str(org1.pk), str(org2.pk)])
+        self.assertEqual(user.organizations_managed, {str(org1.pk), str(org2.pk)})
 
     def test_organizations_owned(self):
         user = self._create_user(username='organizations_pk')
-        self.assertEqual(user.organizations_managed, [])
+        self.assertEqual(user.organizations_managed, frozenset())
         org1 = self._create_org(name='org1')
         org2 = self._create_org(name='org2')
         org3 = self._create_org(name='org3')
         OrganizationUser.objects.create(user=user, organization=org1, is_admin=True)
         OrganizationUser.objects.create(user=user, organization=org2, is_admin=True)
         OrganizationUser.objects.create(user=user, organization=org3, is_admin=False)
-        self.assertEqual(user.organizations_owned, [str(org1.pk), str(org2.pk)])
+        self.assertEqual(user.organizations_owned, {str(org1.pk), str(org2.pk)})
+
+    def test_organizations_subquery(self):
+        user = self._create_user()
+        org1 = self._create_org(name='org1')
+        org2 = self._create_org(name='org2')
+        org3 = self._create_org(name='org3')
+        org4 = self._create_org(name='org4', is_active=False)
+        self._create_org(name='org5')
+        OrganizationUser.objects.create(user=user, organization=org1, is_admin=True)
+        OrganizationUser.objects.create(user=user, organization=org2, is_admin=True)
+        OrganizationUser.objects.create(user=user, organization=org3)
+        OrganizationUser.objects.create(user=user, organization=org4, is_admin=True)
+        for attribute, subquery in [
+            ('organizations_dict', 'organizations_subquery'),
+            ('organizations_managed', 'organizations_managed_subquery'),
+            ('organizations_owned', 'organizations_owned_subquery'),
+        ]:
+            with self.subTest(attribute):
+                expected = set(
+                    Organization.objects.filter(pk__in=getattr(user, attribute))
+                )
+                organizations = Organization.objects.filter(
+                    pk__in=getattr(user, subquery)
+                )
+                with self.assertNumQueries(1):
+                    self.assertEqual(set(organizations), expected)
+
+    def test_get_organizations_lookup(self):
+        user = self._create_user()
+        org1 = self._create_org(name='org1')
+        org2 = self._create_org(name='org2')
+        OrganizationUser.objects.create(user=user, organization=org1, is_admin=True)
+        OrganizationUser.objects.create(user=user, organization=org2)
+        with self.subTest('below threshold'):
+            self.assertEqual(
+                user.get_organizations_lookup('organizations_managed'),
+                {str(org1.pk)},
+            )
+            self.assertEqual(user.get_organizations_lookup(), {str(org1.pk)})
+            self.assertEqual(
+                user.get_organizations_lookup('organizations_dict'),
+                user.organizations_dict,
+            )
+        with self.subTest('above threshold'):
+            with mock.patch.object(app_settings, 'ORGANIZATIONS_SUBQUERY_THRESHOLD', 1):
+                lookup = user.get_organizations_lookup('organizations_dict')
+                self.assertIsInstance(lookup, Subquery)
+                self.assertEqual(
+                    set(Organization.objects.filter(pk__in=lookup)), {org1, org2}
+                )
+                # one organization managed only
+                self.assertEqual(
+                    user.get_organizations_lookup('organizations_managed'),
+                    {str(org1.pk)},
+                )
 
     def test_organization_repr(self):
         org = self._create_org(name='org1', is_active=False)
@@ -268,3 +334,589 @@ class TestUsers(TestOrganizationMixin, TestCase):
         response = self.client.post(reverse('account_logout'), follow=True)
         self.assertContains(response, 'Logout successful.')
         self.assertContains(response, 'This web page can be closed.')
+
+    def test_bulk_membership_changes(self):
+        org1 = self._create_org(name='org1')
+        org2 = self._create_org(name='org2')
+        user1 = self._create_user(username='user1', email='user1@test.com')
+        user2 = self._create_user(username='user2', email='user2@test.com')
+        user3 = self._create_user(username='user3', email='user3@test.com')
+        OrganizationUser.objects.create(user=user2, organization=org2, is_admin=True)
+        self.assertFalse(user1.is_member(org1))
+
+        with bulk_membership_changes():
+            with self.assertNumQueries(1):
+                OrganizationUser.objects.create(
+                    user=user1, organization=org1, is_admin=True
+                )
+            OrganizationUser.objects.create(
+                user=user3, organization=org1, is_admin=True
+            )
+            OrganizationUser.objects.create(
+                user=user1, organization=org2, is_admin=True
+            )
+            OrganizationUser.objects.create(user=user3, organization=org2)
+            self.assertFalse(
+                OrganizationOwner.objects.filter(organization=org1).exists()
+            )
+
+        with self.subTest('first manager is designated as owner'):
+            owner = OrganizationOwner.objects.get(organization=org1)
+            self.assertEqual(owner.organization_user.user, user1)
+            self.assertTrue(user1.is_owner(org1))
+            self.assertFalse(user3.is_owner(org1))
+
+        with self.subTest('existing owners are not changed'):
+            owner = OrganizationOwner.objects.get(organization=org2)
+            self.assertEqual(owner.organization_user.user, user2)
+            self.assertTrue(user1.is_manager(org2))
+            self.assertFalse(user1.is_owner(org2))
+            self.assertTrue(user3.is_member(org2))
+
+    def test_prefetch_organizations(self):
+        org1 = self._create_org(name='org1')
+        org2 = self._create_org(name='org2')
+        users = [
+            self._create_user(username=f'user{i}', email=f'user{i}@test.com')
+            for i in range(3)
+        ]
+        OrganizationUser.objects.create(user=users[0], organization=org1)
+        OrganizationUser.objects.create(user=users[1], organization=org2, is_admin=True)
+        users = User.objects.filter(pk__in=[user.pk for user in users])
+
+        with self.assertNumQueries(2):
+            users = User.objects.prefetch_organizations(users)
+        with self.assertNumQueries(0):
+            organizations = {user.username: user.organizations_dict for user in users}
+        self.assertEqual(
+            organizations,
+            {
+                'user0': {str(org1.pk): {'is_admin': False, 'is_owner': False}},
+                'user1': {str(org2.pk): {'is_admin': True, 'is_owner': True}},
+                'user2': {},
+            },
+        )
+
+        with self.subTest('prefetched data is discarded on membership changes'):
+            user = [user for user in users if user.username == 'user2'][0]
+            OrganizationUser.objects.create(user=user, organization=org1)
+            self.assertTrue(user.is_member(org1))
+
+    def test_bulk_membership_changes_rollback(self):
+        org = self._create_org()
+        user = self._create_user()
+        with self.assertRaises(ValueError):
+            with bulk_membership_changes():
+                OrganizationUser.objects.create(
+                    user=user, organization=org, is_admin=True
+                )
+                raise ValueError()
+        self.assertFalse(OrganizationUser.objects.exists())
+        self.assertFalse(OrganizationOwner.objects.exists())
+        self.assertFalse(user.is_member(org))
+
+
+class TestOrganizationsDictCache(TestOrganizationMixin, TransactionTestCase):
+    def test_invalidation_deferred_until_commit(self):
+        user = self._create_user()
+        org1 = self._create_org(name='org1')
+        org2 = self._create_org(name='org2')
+        cache_key = f'user_{user.pk}_organizations'
+        user.organizations_dict  # force caching
+
+        with mock.patch.object(cache, 'delete_many', wraps=cache.delete_many) as mocked:
+            with transaction.atomic():
+                ou = OrganizationUser.objects.create(user=user, organization=org1)
+                OrganizationUser.objects.create(user=user, organization=org2)
+                ou.is_admin = True
+                ou.save()
+                mocked.assert_not_called()
+                self.assertEqual(cache.get(cache_key), {})
+                # changes are visible inside the transaction
+                self.assertTrue(user.is_manager(org1))
+                self.assertTrue(user.is_member(org2))
+                # uncommitted data is not written to the shared cache
+                self.assertEqual(cache.get(cache_key), {})
+            mocked.assert_called_once()
+        self.assertCountEqual(
+            mocked.call_args[0][0],
+            [
+                cache_key,
+                cache_module.get_organization_cache_key(org1.pk),
+                cache_module.get_organization_cache_key(org2.pk),
+            ],
+        )
+
+        self.assertIsNone(cache.get(cache_key))
+        with self.assertNumQueries(1):
+            self.assertEqual(len(user.organizations_dict), 2)
+        self.assertEqual(len(cache.get(cache_key)), 2)
+
+    def test_invalidation_rollback(self):
+        user = self._create_user()
+        org = self._create_org()
+        cache_key = f'user_{user.pk}_organizations'
+        user.organizations_dict  # force caching
+
+        with self.assertRaises(IntegrityError):
+            with transaction.atomic():
+                OrganizationUser.objects.create(user=user, organization=org)
+                self.assertTrue(user.is_member(org))
+                OrganizationUser.objects.create(user=user, organization=org)
+
+        self.assertEqual(cache.get(cache_key), {})
+        with self.assertNumQueries(0):
+            self.assertFalse(user.is_member(org))
+
+        with self.subTest('pending invalidations are discarded on rollback'):
+            with self.assertRaises(IntegrityError):
+                with transaction.atomic():
+                    OrganizationUser.objects.create(user=user, organization=org)
+                    OrganizationUser.objects.create(user=user, organization=org)
+            # checked from another transaction, as with ATOMIC_REQUESTS
+            with transaction.atomic():
+                self.assertFalse(cache_module.is_invalidation_pending(user.pk))
+                with self.assertNumQueries(0):
+                    self.assertFalse(user.is_member(org))
+
+        with self.subTest('savepoint rollback'):
+            org2 = self._create_org(name='org2')
+            with transaction.atomic():
+                OrganizationUser.objects.create(user=user, organization=org2)
+                with self.assertRaises(IntegrityError):
+                    with transaction.atomic():
+                        OrganizationUser.objects.create(user=user, organization=org)
+                        OrganizationUser.objects.create(user=user, organization=org)
+                # the invalidation made before the savepoint is still pending
+                self.assertTrue(cache_module.is_invalidation_pending(user.pk))
+            self.assertTrue(user.is_member(org2))
+            self.assertFalse(user.is_member(org))
+
+    def test_invalidation_single_flush(self):
+        org = self._create_org()
+        users = [
+            self._create_user(username=f'user{i}', email=f'user{i}@test.com')
+            for i in range(3)
+        ]
+        connection = transaction.get_connection()
+
+        def get_flushes():
+            return [
+                callback
+                for _, callback in connection.run_on_commit
+                if getattr(callback, 'func', None) is cache_module._flush_invalidations
+            ]
+
+        with mock.patch.object(cache, 'delete_many', wraps=cache.delete_many) as mocked:
+            with transaction.atomic():
+                for user in users:
+                    OrganizationUser.objects.create(user=user, organization=org)
+                self.assertEqual(len(get_flushes()), 1)
+                with transaction.atomic():
+                    OrganizationUser.objects.filter(user=users[0]).update(is_admin=True)
+                    cache_module.invalidate_organizations_dict(users[0].pk)
+                self.assertEqual(len(get_flushes()), 1)
+            mocked.assert_called_once()
+        self.assertEqual(len(mocked.call_args[0][0]), 4)
+        self.assertTrue(users[0].is_manager(org))
+
+        with self.subTest('flush is registered again after a rollback'):
+            with transaction.atomic():
+                with transaction.atomic():
+                    cache_module.invalidate_organizations_dict(users[1].pk)
+                    transaction.set_rollback(True)
+                self.assertEqual(get_flushes(), [])
+                cache_module.invalidate_organizations_dict(users[2].pk)
+                self.assertEqual(len(get_flushes()), 1)
+
+    def test_rewarm(self):
+        user = self._create_user()
+        org = self._create_org()
+        user.organizations_dict  # force caching
+
+        with mock.patch.object(app_settings, 'ORGANIZATIONS_CACHE_REWARM', True):
+            OrganizationUser.objects.create(user=user, organization=org)
+        with self.assertNumQueries(0):
+            self.assertTrue(user.is_member(org))
+
+        with mock.patch.object(app_settings, 'ORGANIZATIONS_CACHE_REWARM', False):
+            OrganizationUser.objects.filter(user=user).delete()
+        with self.assertNumQueries(1):
+            self.assertFalse(user.is_member(org))
+
+    def test_organizations_dict_request_memo(self):
+        user = self._create_user(username='organizations_pk')
+        org1 = self._create_org(name='org1')
+        org2 = self._create_org(name='org2')
+        OrganizationUser.objects.create(user=user, organization=org1)
+        user.organizations_dict  # force caching
+
+        with mock.patch('openwisp_users.base.models.cache', wraps=cache) as mocked:
+            with self.subTest('shared cache is hit every time outside requests'):
+                user.is_member(org1)
+                user.is_manager(org1)
+                self.assertEqual(mocked.get.call_count, 2)
+
+            mocked.reset_mock()
+            request_started.send(sender=self.__class__)
+            try:
+                with self.subTest('shared cache is hit once per request'):
+                    user.is_member(org1)
+                    user.is_manager(org1)
+                    user.is_owner(org1)
+                    self.assertEqual(mocked.get.call_count, 1)
+
+                with self.subTest('memo is cleared on membership changes'):
+                    OrganizationUser.objects.create(user=user, organization=org2)
+                    self.assertTrue(user.is_member(org2))
+            finally:
+                request_finished.send(sender=self.__class__)
+
+            mocked.reset_mock()
+            with self.subTest('memo is cleared at the end of the request'):
+                user.is_member(org1)
+                self.assertEqual(mocked.get.call_count, 1)
+
+    def test_bulk_membership_changes_invalidation(self):
+        org1 = self._create_org(name='org1')
+        org2 = self._create_org(name='org2')
+        users = [
+            self._create_user(username=f'user{i}', email=f'user{i}@test.com')
+            for i in range(3)
+        ]
+        with mock.patch.object(cache, 'delete_many', wraps=cache.delete_many) as mocked:
+            with bulk_membership_changes():
+                for user in users:
+                    for org in [org1, org2]:
+                        OrganizationUser.objects.create(
+                            user=user, organization=org, is_admin=True
+                        )
+                OrganizationOwner.objects.filter(organization=org2).delete()
+            mocked.assert_called_once()
+        for user in users:
+            self.assertIn(f'user_{user.pk}_organizations', mocked.call_args[0][0])
+        self.assertEqual(OrganizationOwner.objects.count(), 2)
+        self.assertTrue(users[0].is_owner(org1))
+        self.assertTrue(users[0].is_owner(org2))
+
+    def test_prefetch_organizations_cache(self):
+        org = self._create_org()
+        users = [
+            self._create_user(username=f'user{i}', email=f'user{i}@test.com')
+            for i in range(3)
+        ]
+        for user in users:
+            OrganizationUser.objects.create(user=user, organization=org)
+        users[0].organizations_dict  # force caching
+        users = list(User.objects.all())
+
+        with mock.patch('openwisp_users.cache.cache', wraps=cache) as mocked:
+            with self.assertNumQueries(1):
+                User.objects.prefetch_organizations(users)
+            mocked.get_many.assert_called_once()
+            mocked.set_many.assert_called_once()
+            self.assertEqual(len(mocked.set_many.call_args[0][0]), 2)
+
+            mocked.reset_mock()
+            users = list(User.objects.all())
+            with self.assertNumQueries(0):
+                User.objects.prefetch_organizations(users)
+            mocked.get_many.assert_called_once()
+            mocked.set_many.assert_not_called()
+
+    def _create_members(self, organization, count=3):
+        users = []
+        for i in range(count):
+            user = self._create_user(username=f'user{i}', email=f'user{i}@test.com')
+            OrganizationUser.objects.create(user=user, organization=organization)
+            user.organizations_dict  # force caching
+            users.append(user)
+        return users
+
+    def test_organization_is_active_change(self):
+        org = self._create_org()
+        users = self._create_members(org)
+        org = Organization.objects.get(pk=org.pk)
+
+        with mock.patch.object(cache_module, 'INVALIDATION_CHUNK_SIZE', 2):
+            with mock.patch.object(
+                cache, 'delete_many', wraps=cache.delete_many
+            ) as mocked:
+                org.is_active = False
+                org.save()
+            self.assertEqual(mocked.call_count, 2)
+        for user in users:
+            self.assertFalse(user.is_member(org))
+
+        with self.subTest('other changes do not invalidate the cache'):
+            with mock.patch.object(cache, 'delete_many') as mocked:
+                org.name = 'changed'
+                org.save()
+            mocked.assert_not_called()
+
+        with self.subTest('reactivation'):
+            org.is_active = True
+            org.save()
+            for user in users:
+                self.assertTrue(user.is_member(org))
+
+    def test_organization_delete(self):
+        org = self._create_org()
+        users = self._create_members(org)
+        org.delete()
+        for user in users:
+            self.assertIsNone(cache.get(f'user_{user.pk}_organizations'))
+            self.assertFalse(user.is_member(org))
+
+    @mock.patch.object(app_settings, 'ORGANIZATIONS_LOCAL_CACHE_SIZE', 2)
+    @mock.patch.object(app_settings, 'ORGANIZATIONS_LOCAL_CACHE_STATS', True)
+    def test_local_cache(self):
+        local_cache = cache_module.local_cache
+        local_cache.clear()
+        self.addCleanup(local_cache.clear)
+        org = self._create_org()
+        users = self._create_members(org)
+        local_cache.clear()
+
+        with mock.patch('openwisp_users.base.models.cache', wraps=cache) as mocked:
+            with self.subTest('shared cache is hit only on local cache misses'):
+                self.assertTrue(users[0].is_member(org))
+                self.assertTrue(users[0].is_member(org))
+                self.assertEqual(mocked.get.call_count, 1)
+                self.assertEqual((local_cache.hits, local_cache.misses), (1, 1))
+
+            with self.subTest('least recently used entries are evicted'):
+                users[1].organizations_dict
+                users[2].organizations_dict
+                mocked.reset_mock()
+                users[0].organizations_dict
+                self.assertEqual(mocked.get.call_count, 1)
+
+            with self.subTest('entries expire'):
+                mocked.reset_mock()
+                with mock.patch(
+                    'openwisp_users.cache.monotonic', return_value=monotonic() + 3600
+                ):
+                    users[0].organizations_dict
+                self.assertEqual(mocked.get.call_count, 1)
+
+            with self.subTest('invalidation from other nodes'):
+                users[0].organizations_dict
+                mocked.reset_mock()
+                cache.incr(cache_module.GENERATION_CACHE_KEY)
+                users[0].organizations_dict
+                self.assertEqual(mocked.get.call_count, 1)
+
+            with self.subTest('local invalidation'):
+                OrganizationUser.objects.filter(user=users[0]).delete()
+                self.assertFalse(users[0].is_member(org))
+
+        with self.subTest('generation incremented after deleting shared entries'):
+            calls = mock.Mock()
+            with mock.patch.object(
+                cache, 'delete_many', wraps=cache.delete_many
+            ) as delete_many, mock.patch.object(
+                cache_module,
+                '_increment_generation',
+                wraps=cache_module._increment_generation,
+            ) as increment_generation:
+                calls.attach_mock(delete_many, 'delete_many')
+                calls.attach_mock(increment_generation, 'increment_generation')
+                with transaction.atomic():
+                    OrganizationUser.objects.create(user=users[0], organization=org)
+            self.assertEqual(
+                [call[0] for call in calls.mock_calls],
+                ['delete_many', 'increment_generation'],
+            )
+
+    @mock.patch.object(app_settings, 'ORGANIZATIONS_LOCAL_CACHE_SIZE', 10)
+    def test_local_cache_generation_once_per_request(self):
+        org = self._create_org()
+        users = self._create_members(org)
+        cache_module.local_cache.clear()
+        self.addCleanup(cache_module.local_cache.clear)
+
+        with mock.patch('openwisp_users.cache.cache', wraps=cache) as mocked:
+            request_started.send(sender=self.__class__)
+            try:
+                for user in users:
+                    user.organizations_dict
+                self.assertEqual(mocked.get.call_count, 1)
+            finally:
+                request_finished.send(sender=self.__class__)
+
+    def test_organizations_map(self):
+        org1 = self._create_org(name='org1')
+        org2 = self._create_org(name='org2')
+        org3 = self._create_org(name='org3')
+        user = self._create_user()
+        OrganizationUser.objects.create(user=user, organization=org1, is_admin=True)
+        OrganizationUser.objects.create(user=user, organization=org2)
+        expected = {
+            str(org1.pk): {'is_admin': True, 'is_owner': True},
+            str(org2.pk): {'is_admin': False, 'is_owner': False},
+        }
+        organizations = user.organizations_dict
+        self.assertIsInstance(organizations, cache_module.OrganizationsMap)
+        self.assertIsInstance(
+            cache.get(cache_module.get_cache_key(user.pk)),
+            cache_module.OrganizationsMap,
+        )
+        self.assertEqual(organizations, expected)
+        self.assertEqual(len(organizations), 2)
+        self.assertEqual(sorted(organizations), sorted(expected))
+        self.assertIn(str(org1.pk), organizations)
+        self.assertNotIn(str(org3.pk), organizations)
+        self.assertNotIn('wrong', organizations)
+        self.assertIsNone(organizations.get(str(org3.pk)))
+        self.assertEqual(organizations[str(org2.pk)], expected[str(org2.pk)])
+        self.assertEqual(cache_module.OrganizationsMap(), {})
+        self.assertEqual(cache_module.OrganizationsMap.from_dict(expected), expected)
+
+        with self.subTest('decoded once'):
+            organizations = cache.get(cache_module.get_cache_key(user.pk))
+            self.assertEqual(organizations[org1.pk], expected[str(org1.pk)])
+            self.assertIsNone(organizations._decoded)
+            self.assertEqual(dict(organizations.items()), expected)
+            decoded = organizations._decoded
+            self.assertEqual(organizations.get_pks('is_admin'), {str(org1.pk)})
+            self.assertEqual(organizations.get_pks('is_owner'), {str(org1.pk)})
+            self.assertIs(organizations._decoded, decoded)
+            # lookups keep working on the decoded data
+            self.assertEqual(organizations[org2.pk], expected[str(org2.pk)])
+            self.assertNotIn(str(org3.pk), organizations)
+            self.assertNotIn('wrong', organizations)
+            # the decoded data is not stored in the cache
+            self.assertIsNone(cache.get(cache_module.get_cache_key(user.pk))._decoded)
+
+        with self.subTest('roles spanning many bytes of the bitfield'):
+            organizations = {
+                str(uuid.uuid4()): {'is_admin': i % 2 == 0, 'is_owner': i % 3 == 0}
+                for i in range(11)
+            }
+            for attribute in ['is_admin', 'is_owner']:
+                expected_pks = {
+                    org_pk
+                    for org_pk, roles in organizations.items()
+                    if roles[attribute]
+                }
+                compact = cache_module.OrganizationsMap.from_dict(organizations)
+                self.assertEqual(compact.get_pks(attribute), expected_pks)
+                # computed also after the keys have been decoded
+                compact = cache_module.OrganizationsMap.from_dict(organizations)
+                self.assertEqual(set(compact), set(organizations))
+                self.assertEqual(compact.get_pks(attribute), expected_pks)
+                self.assertEqual(dict(compact.items()), organizations)
+
+        with self.subTest('organizations_managed uses the decoded sets'):
+            user = User.objects.get(pk=user.pk)
+            with mock.patch.object(
+                cache_module.OrganizationsMap,
+                'get_pks',
+                autospec=True,
+                side_effect=cache_module.OrganizationsMap.get_pks,
+            ) as get_pks:
+                self.assertEqual(user.organizations_managed, {str(org1.pk)})
+                self.assertEqual(user.organizations_owned, {str(org1.pk)})
+            self.assertEqual(get_pks.call_count, 2)
+
+    def test_legacy_cache_format(self):
+        org = self._create_org()
+        user = self._create_user()
+        legacy = {str(org.pk): {'is_admin': True, 'is_owner': False}}
+        cache.set(cache_module.get_cache_key(user.pk), legacy)
+        with self.assertNumQueries(0):
+            self.assertTrue(user.is_member(org))
+            self.assertTrue(user.is_manager(org))
+            self.assertFalse(user.is_owner(org))
+
+    def test_rebuild_lock(self):
+        org = self._create_org()
+        user = self._create_user()
+        OrganizationUser.objects.create(user=user, organization=org)
+        cache_key = cache_module.get_cache_key(user.pk)
+        lock_key = cache_module.get_lock_key(user.pk)
+
+        with self.subTest('lock acquired'):
+            cache.delete(cache_key)
+            with mock.patch('openwisp_users.cache.cache', wraps=cache) as mocked:
+                with self.assertNumQueries(1):
+                    self.assertTrue(user.is_member(org))
+            mocked.add.assert_called_once_with(lock_key, True, 5)
+            mocked.delete.assert_called_once_with(lock_key)
+            self.assertIsNone(cache.get(lock_key))
+            self.assertIsNotNone(cache.get(cache_key))
+
+        cache.delete(cache_key)
+        cache.add(lock_key, True, 5)
+        self.addCleanup(cache.delete, lock_key)
+
+        with self.subTest('entry rebuilt by another process while waiting'):
+
+            def rebuild(interval):
+                cache.set(
+                    cache_key, cache_module.load_organizations([user.pk])[str(user.pk)]
+                )
+
+            with mock.patch('openwisp_users.cache.sleep', side_effect=rebuild):
+                # the query is performed by the mocked "other process"
+                with self.assertNumQueries(1):
+                    self.assertTrue(user.is_member(org))
+
+        cache.delete(cache_key)
+
+        with self.subTest('lock not released in time'):
+            with mock.patch.object(app_settings, 'ORGANIZATIONS_CACHE_LOCK_WAIT', 0):
+                with self.assertNumQueries(1):
+                    self.assertTrue(user.is_member(org))
+            # the cache entry is left to the process holding the lock
+            self.assertIsNone(cache.get(cache_key))
+
+        with self.subTest('lock disabled'):
+            with mock.patch.object(app_settings, 'ORGANIZATIONS_CACHE_LOCK_TIMEOUT', 0):
+                with self.assertNumQueries(1):
+                    self.assertTrue(user.is_member(org))
+            self.assertIsNotNone(cache.get(cache_key))
+
+    def test_organization_users(self):
+        org = self._create_org()
+        user1 = self._create_user(username='user1', email='user1@test.com')
+        user2 = self._create_user(username='user2', email='user2@test.com')
+        user3 = self._create_user(username='user3', email='user3@test.com')
+        OrganizationUser.objects.create(user=user1, organization=org, is_admin=True)
+        org_user2 = OrganizationUser.objects.create(user=user2, organization=org)
+        with self.assertNumQueries(1):
+            self.assertEqual(org.get_member_pks(), {str(user1.pk), str(user2.pk)})
+        with self.assertNumQueries(0):
+            self.assertEqual(org.get_manager_pks(), {str(user1.pk)})
+            self.assertEqual(org.get_owner_pks(), {str(user1.pk)})
+
+        with self.subTest('membership added'):
+            OrganizationUser.objects.create(user=user3, organization=org)
+            self.assertIn(str(user3.pk), org.get_member_pks())
+
+        with self.subTest('membership changed'):
+            org_user2.is_admin = True
+            org_user2.save()
+            self.assertEqual(org.get_manager_pks(), {str(user1.pk), str(user2.pk)})
+
+        with self.subTest('changes not committed yet'):
+            with transaction.atomic():
+                OrganizationOwner.objects.filter(organization=org).delete()
+                with self.assertNumQueries(1):
+                    self.assertEqual(org.get_owner_pks(), set())
+                # the shared cache is not updated before the commit
+                cache_key = cache_module.get_organization_cache_key(org.pk)
+                self.assertEqual(cache.get(cache_key)['owners'], {str(user1.pk)})
+            self.assertIsNone(cache.get(cache_key))
+            self.assertEqual(org.get_owner_pks(), set())
+
+        with self.subTest('bulk membership changes'):
+            org2 = self._create_org(name='org2')
+            self.assertEqual(org2.get_member_pks(), set())
+            with bulk_membership_changes():
+                OrganizationUser.objects.create(
+                    user=user2, organization=org2, is_admin=True
+                )
+            self.assertEqual(org2.get_member_pks(), {str(user2.pk)})
+            self.assertEqual(org2.get_owner_pks(), {str(user2.pk)})
@@ -1,4 +1,14 @@
+from contextlib import contextmanager
+
 from django.conf import settings
+from django.db import transaction
+from swapper import load_model
+
+from .cache import (
+    _bulk_changes,
+    invalidate_organization_users,
+    invalidate_organizations_dict,
+)
 
 if 'reversion' in settings.INSTALLED_APPS:  # pragma: no cover
     from reversion.admin import VersionAdmin as BaseModelAdmin
@@ -57,3 +67,75 @@ def usermodel_list_and_search(model, additional_fields):
         displays = model.list_display[:]
         model.list_display = displays[: field[0]] + [field[1]] + displays[field[0] :]
         model.search_fields += (field[1],)
+
+
+@contextmanager
+def bulk_membership_changes(using=None):
+    """
+    Read:
+    https://github.com/openwisp/openwisp-users/blob/master/README.rst#bulk_membership_changes
+    """
+    # nested usage: the outermost block applies the changes
+    if _bulk_changes.get() is not None:
+        yield
+        return
+    changes = {
+        'users': set(),
+        'organization_users': set(),
+        'organizations': set(),
+        'member_organizations': set(),
+    }
+    token = _bulk_changes.set(changes)
+    try:
+        with transaction.atomic(using=using):
+            yield
+            _create_missing_owners(changes, using)
+            _invalidate_bulk_changes(changes, using)
+    finally:
+        _bulk_changes.reset(token)
+
+
+def _create_missing_owners(changes, using):
+    """
+    designates the first manager of each organization
+    which does not have an owner yet as its owner
+    """
+    if not changes['organizations']:
+        return
+    OrganizationUser = load_model('openwisp_users', 'OrganizationUser')
+    OrganizationOwner = load_model('openwisp_users', 'OrganizationOwner')
+    org_users = (
+        OrganizationUser.objects.using(using)
+        .filter(
+            organization__in=changes['organizations'],
+            organization__owner__isnull=True,
+            is_admin=True,
+        )
+        .order_by('organization_id', 'created')
+        .values_list('pk', 'organization_id', 'user_id')
+    )
+    owners = {}
+    for org_user_id, org_id, user_id in org_users:
+        if org_id in owners:
+            continue
+        owners[org_id] = OrganizationOwner(
+            organization_user_id=org_user_id, organization_id=org_id
+        )
+        changes['users'].add(user_id)
+        changes['member_organizations'].add(org_id)
+    OrganizationOwner.objects.using(using).bulk_create(owners.values())
+
+
+def _invalidate_bulk_changes(changes, using):
+    user_pks = changes['users']
+    if changes['organization_users']:
+        OrganizationUser = load_model('openwisp_users', 'OrganizationUser')
+        user_pks.update(
+            OrganizationUser.objects.using(using)
+            .filter(pk__in=changes['organization_users'])
+            .values_list('user_id', flat=True)
+        )
+    if user_pks:
+        invalidate_organizations_dict(*user_pks, using=using)
+    if changes['member_organizations']:
+        invalidate_organization_users(*changes['member_organizations'], using=using)
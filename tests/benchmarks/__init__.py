@@ -0,0 +1,17 @@
+"""
+benchmarks are not part of the test suite, run them with:
+
+    cd tests/
+    ./manage.py test benchmarks --parallel 1
+"""
+from timeit import Timer
+
+
+def timeit(statement, number=None):
+    """
+    returns the average duration of ``statement`` in microseconds
+    """
+    timer = Timer(statement)
+    if number is None:
+        number, _ = timer.autorange()
+    return min(timer.repeat(repeat=3, number=number)) / number * 1000000
@@ -0,0 +1,75 @@
+import asyncio
+from time import monotonic
+
+from asgiref.sync import async_to_sync, sync_to_async
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+
+from openwisp_users.backends import UsersAuthenticationBackend
+
+User = get_user_model()
+
+
+class TestAsyncAuthentication(TestCase):
+    """
+    compares the logins per second and the responsiveness of the event loop
+    when the password is verified inline (as done by the synchronous views
+    under ASGI) and in the pool of threads used by ``aauthenticate``
+    """
+
+    concurrency = (1, 4, 16)
+
+    @classmethod
+    def setUpTestData(cls):
+        User.objects.create_user(username='tester', password='tester')
+
+    async def _run(self, login, concurrency):
+        """
+        runs ``concurrency`` logins at the same time while a ticker measures
+        the maximum delay of the event loop, returns the logins per second
+        and the maximum delay in milliseconds
+        """
+        done = False
+        max_delay = 0
+
+        async def ticker():
+            nonlocal max_delay
+            while not done:
+                start = monotonic()
+                await asyncio.sleep(0.001)
+                max_delay = max(max_delay, monotonic() - start - 0.001)
+
+        ticker_task = asyncio.ensure_future(ticker())
+        start = monotonic()
+        users = await asyncio.gather(*[login() for _ in range(concurrency)])
+        duration = monotonic() - start
+        done = True
+        await ticker_task
+        self.assertTrue(all(users))
+        return concurrency / duration, max_delay * 1000
+
+    def test_async_authentication(self):
+        backend = UsersAuthenticationBackend()
+
+        async def inline_login():
+            # the lookup is offloaded like in aauthenticate,
+            # the password is verified in the event loop
+            user = await sync_to_async(backend.lookup_user)('tester')
+            return user.check_password('tester')
+
+        async def pool_login():
+            return await backend.aauthenticate(None, 'tester', 'tester')
+
+        print(
+            '\n{:>11} | {:>10} {:>10} | {:>12} {:>12}'.format(
+                'concurrency', 'inline/s', 'pool/s', 'inline delay', 'pool delay'
+            )
+        )
+        for concurrency in self.concurrency:
+            inline = async_to_sync(self._run)(inline_login, concurrency)
+            pool = async_to_sync(self._run)(pool_login, concurrency)
+            print(
+                '{:>11} | {:>10.1f} {:>10.1f} | {:>10.1f}ms {:>10.1f}ms'.format(
+                    concurrency, inline[0], pool[0], inline[1], pool[1]
+                )
+            )
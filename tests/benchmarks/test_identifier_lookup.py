@@ -0,0 +1,67 @@
+import os
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+
+from openwisp_users import settings as app_settings
+from openwisp_users.backends import UsersAuthenticationBackend
+
+from . import timeit
+
+User = get_user_model()
+# the default amount of users needs a few minutes and gigabytes of memory
+SIZE = int(os.environ.get('BENCHMARK_USERS', 2000000))
+BATCH_SIZE = 10000
+# only some users have a phone number, parsing millions of them is slow
+PHONE_NUMBER_EVERY = 1000
+
+
+class TestIdentifierLookup(TestCase):
+    """
+    compares the lookup modes of ``UsersAuthenticationBackend``
+    (single query with OR conditions and UNION ALL of one query
+    per condition) used to find the user who is logging in,
+    in a table with many users
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        for offset in range(0, SIZE, BATCH_SIZE):
+            User.objects.bulk_create(
+                [
+                    User(
+                        username=f'user{i}',
+                        email=f'user{i}@test.com',
+                        phone_number=(
+                            f'+39366{i:07d}' if i % PHONE_NUMBER_EVERY == 0 else None
+                        ),
+                    )
+                    for i in range(offset, min(offset + BATCH_SIZE, SIZE))
+                ],
+                batch_size=BATCH_SIZE,
+            )
+
+    def test_identifier_lookup(self):
+        backend = UsersAuthenticationBackend()
+        middle = SIZE // 2 // PHONE_NUMBER_EVERY * PHONE_NUMBER_EVERY
+        identifiers = {
+            'phone number': f'+39366{middle:07d}',
+            'email': f'user{middle}@test.com',
+            'username': f'user{middle}',
+            'unknown': 'unknown',
+        }
+        print(f'\n{SIZE} users')
+        for mode in ['or', 'union']:
+            with mock.patch.object(app_settings, 'AUTH_BACKEND_LOOKUP', mode):
+                plan = backend.get_users(identifiers['phone number'])[:3].explain()
+                print(f'\nquery plan ({mode}):\n{plan}')
+        print('\n{:>14} | {:>12} {:>12}'.format('identifier', 'or', 'union'))
+        for name, identifier in identifiers.items():
+            durations = []
+            for mode in ['or', 'union']:
+                with mock.patch.object(app_settings, 'AUTH_BACKEND_LOOKUP', mode):
+                    user = backend.lookup_user(identifier)
+                    self.assertEqual(user is None, name == 'unknown')
+                    durations.append(timeit(lambda: backend.lookup_user(identifier)))
+            print('{:>14} | {:>10.2f}us {:>10.2f}us'.format(name, *durations))
@@ -0,0 +1,82 @@
+import pickle
+import uuid
+
+from django.contrib.auth import get_user_model
+from django.test import SimpleTestCase
+
+from openwisp_users.cache import OrganizationsMap
+
+from . import timeit
+
+User = get_user_model()
+
+
+class TestOrganizationsEncoding(SimpleTestCase):
+    """
+    compares the size and decoding time of the values stored in the cache
+    by ``organizations_dict`` when using a plain dictionary (old format)
+    and when using ``OrganizationsMap`` (compact format)
+    """
+
+    sizes = (1, 10, 100, 1000, 5000)
+
+    def _get_organizations(self, size):
+        return {
+            str(uuid.uuid4()): {'is_admin': i % 2 == 0, 'is_owner': i % 10 == 0}
+            for i in range(size)
+        }
+
+    def _get_organizations_managed(self, value):
+        # path executed on each request of operators: the value is loaded
+        # from the cache, then ``organizations_managed`` iterates over it
+        user = User()
+        user._prefetched_organizations = pickle.loads(value)
+        return user.organizations_managed
+
+    def test_encoding(self):
+        print(
+            '\n{:>6} | {:>10} {:>10} | {:>12} {:>12} | {:>12} {:>12} | '
+            '{:>12} {:>12}'.format(
+                'orgs',
+                'dict (B)',
+                'map (B)',
+                'dict load',
+                'map load',
+                'dict lookup',
+                'map lookup',
+                'dict managed',
+                'map managed',
+            )
+        )
+        for size in self.sizes:
+            organizations = self._get_organizations(size)
+            compact = OrganizationsMap.from_dict(organizations)
+            old_value = pickle.dumps(organizations, pickle.HIGHEST_PROTOCOL)
+            new_value = pickle.dumps(compact, pickle.HIGHEST_PROTOCOL)
+            self.assertEqual(pickle.loads(new_value), organizations)
+            self.assertEqual(
+                self._get_organizations_managed(new_value),
+                self._get_organizations_managed(old_value),
+            )
+            org_pk = list(organizations)[size // 2]
+            old_load = timeit(lambda: pickle.loads(old_value))
+            new_load = timeit(lambda: pickle.loads(new_value))
+            # decoding plus one membership check, eg: ``user.is_manager(org)``
+            old_lookup = timeit(lambda: pickle.loads(old_value)[org_pk]['is_admin'])
+            new_lookup = timeit(lambda: pickle.loads(new_value)[org_pk]['is_admin'])
+            old_managed = timeit(lambda: self._get_organizations_managed(old_value))
+            new_managed = timeit(lambda: self._get_organizations_managed(new_value))
+            print(
+                '{:>6} | {:>10} {:>10} | {:>10.2f}us {:>10.2f}us | '
+                '{:>10.2f}us {:>10.2f}us | {:>10.2f}us {:>10.2f}us'.format(
+                    size,
+                    len(old_value),
+                    len(new_value),
+                    old_load,
+                    new_load,
+                    old_lookup,
+                    new_lookup,
+                    old_managed,
+                    new_managed,
+                )
+            )
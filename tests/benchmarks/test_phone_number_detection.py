@@ -0,0 +1,133 @@
+from unittest import mock
+
+import phonenumbers
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from phonenumbers.phonenumberutil import NumberParseException
+
+from openwisp_users import settings as app_settings
+from openwisp_users.backends import UsersAuthenticationBackend, parse_phone_number
+
+from . import timeit
+
+User = get_user_model()
+PREFIXES = (
+    '+1',
+    '+7',
+    '+20',
+    '+27',
+    '+30',
+    '+31',
+    '+32',
+    '+33',
+    '+34',
+    '+36',
+    '+40',
+    '+41',
+    '+43',
+    '+44',
+    '+45',
+    '+46',
+    '+47',
+    '+48',
+    '+49',
+    '+39',
+)
+
+
+def legacy_get_phone_number(self, identifier):
+    """
+    implementation of ``_get_phone_number`` which parsed
+    the identifier with each prefix on every login
+    """
+    prefixes = [''] + list(app_settings.AUTH_BACKEND_AUTO_PREFIXES)
+    for prefix in prefixes:
+        value = f'{prefix}{identifier}'
+        try:
+            phonenumbers.parse(value)
+            return value
+        except NumberParseException:
+            pass
+    return False
+
+
+# hashing the password would hide the cost of the lookup
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class TestPhoneNumberDetection(TestCase):
+    """
+    compares the logins per second of the authentication backend when
+    detecting phone numbers with and without the pre-classifier and cache,
+    depending on the amount of prefixes configured
+    """
+
+    prefix_counts = (0, 5, 20)
+    identifiers = {
+        'username': 'tester',
+        'email': 'tester@test.com',
+        'national phone': '3665243702',
+    }
+
+    def setUp(self):
+        User.objects.create_user(
+            username='tester',
+            email='tester@test.com',
+            phone_number='+393665243702',
+            password='tester',
+        )
+
+    def _measure(self, identifier, get_phone_number=None, clear_cache=False):
+        """
+        returns the duration of the phone number detection (microseconds)
+        and the logins per second
+        """
+        backend = UsersAuthenticationBackend()
+        if get_phone_number is not None:
+            backend._get_phone_number = get_phone_number.__get__(backend)
+
+        def detect():
+            if clear_cache:
+                parse_phone_number.cache_clear()
+            return backend._get_phone_number(identifier)
+
+        def login():
+            if clear_cache:
+                parse_phone_number.cache_clear()
+            return backend.authenticate(None, identifier, 'tester')
+
+        return timeit(detect), 1000000 / timeit(login)
+
+    def test_phone_number_detection(self):
+        print(
+            '\n{:>8} | {:>14} | {:>10} {:>10} {:>10} | {:>10} {:>10} {:>10}'.format(
+                'prefixes',
+                'identifier',
+                'legacy',
+                'no cache',
+                'cached',
+                'legacy/s',
+                'no cache/s',
+                'cached/s',
+            )
+        )
+        for count in self.prefix_counts:
+            prefixes = PREFIXES[-count:] if count else tuple()
+            with mock.patch.object(
+                app_settings, 'AUTH_BACKEND_AUTO_PREFIXES', prefixes
+            ):
+                for name, identifier in self.identifiers.items():
+                    legacy = self._measure(identifier, legacy_get_phone_number)
+                    no_cache = self._measure(identifier, clear_cache=True)
+                    cached = self._measure(identifier)
+                    print(
+                        '{:>8} | {:>14} | {:>8.2f}us {:>8.2f}us {:>8.2f}us | '
+                        '{:>10.0f} {:>10.0f} {:>10.0f}'.format(
+                            count,
+                            name,
+                            legacy[0],
+                            no_cache[0],
+                            cached[0],
+                            legacy[1],
+                            no_cache[1],
+                            cached[1],
+                        )
+                    )
@@ -0,0 +1,108 @@
+from django.contrib import admin
+from django.contrib.auth import get_user_model
+from django.db import DatabaseError, connection
+from django.test import RequestFactory, TestCase
+from django.test.utils import CaptureQueriesContext
+from swapper import load_model
+
+from . import timeit
+
+User = get_user_model()
+Organization = load_model('openwisp_users', 'Organization')
+OrganizationUser = load_model('openwisp_users', 'OrganizationUser')
+
+
+def legacy_queryset(user):
+    """
+    implementation of ``multitenant_behaviour_for_user_admin``
+    which chained one queryset per managed organization
+    """
+    org_users = OrganizationUser.objects.filter(user=user).select_related(
+        'organization'
+    )
+    qs = User.objects.none()
+    for org_user in org_users:
+        if org_user.is_admin:
+            qs = qs | org_user.organization.users.all().distinct()
+    return qs.filter(is_superuser=False)
+
+
+class TestUserAdminScoping(TestCase):
+    """
+    compares the queries generated to list the users visible to an
+    operator in the user admin, depending on the organizations managed
+    """
+
+    sizes = (10, 100, 1000)
+
+    @classmethod
+    def setUpTestData(cls):
+        size = max(cls.sizes)
+        organizations = Organization.objects.bulk_create(
+            Organization(name=f'org{i}', slug=f'org{i}') for i in range(size)
+        )
+        users = User.objects.bulk_create(
+            User(username=f'user{i}', email=f'user{i}@test.com') for i in range(size)
+        )
+        org_users = [
+            OrganizationUser(user=user, organization=org)
+            for user, org in zip(users, organizations)
+        ]
+        cls.operators = {}
+        for size in cls.sizes:
+            operator = User.objects.create(
+                username=f'operator{size}', email=f'operator{size}@test.com'
+            )
+            org_users += [
+                OrganizationUser(user=operator, organization=org, is_admin=True)
+                for org in organizations[:size]
+            ]
+            cls.operators[size] = operator
+        OrganizationUser.objects.bulk_create(org_users)
+
+    def _measure(self, get_queryset):
+        def run():
+            qs = get_queryset()
+            # what the changelist does: count and first page
+            return qs.count(), list(qs[:100])
+
+        try:
+            with CaptureQueriesContext(connection) as context:
+                count, _ = run()
+            duration = timeit(run, number=3)
+        except DatabaseError as e:
+            # eg: SQLite refuses expression trees deeper than 1000
+            print(f'query failed: {e}')
+            return '-', '-', 'error', '-'
+        sql_length = sum(len(query['sql']) for query in context.captured_queries)
+        queries = len(context.captured_queries)
+        return count, queries, f'{duration / 1000:.2f}ms', sql_length
+
+    def test_user_admin_scoping(self):
+        user_admin = admin.site._registry[User]
+        print(
+            '\n{:>5} | {:>6} {:>7} {:>10} {:>9} | {:>6} {:>7} {:>10} {:>9}'.format(
+                'orgs',
+                'users',
+                'queries',
+                'OR chain',
+                'SQL size',
+                'users',
+                'queries',
+                'EXISTS',
+                'SQL size',
+            )
+        )
+        for size in self.sizes:
+            operator = self.operators[size]
+            request = RequestFactory().get('/')
+            request.user = operator
+            legacy = self._measure(lambda: legacy_queryset(operator))
+            current = self._measure(lambda: user_admin.get_queryset(request))
+            if legacy[0] != '-':
+                self.assertEqual(legacy[0], current[0])
+            print(
+                '{:>5} | {:>6} {:>7} {:>10} {:>9} | {:>6} {:>7} {:>10} {:>9}'.format(
+                    size, *legacy, *current
+                )
+            )
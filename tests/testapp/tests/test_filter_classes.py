@@ -1,9 +1,12 @@
+from unittest import mock
+
 from django.contrib.auth import get_user_model
 from django.test import TestCase
 from django.urls import reverse
 from openwisp_utils.tests import AssertNumQueriesSubTestMixin
 from swapper import load_model
 
+from openwisp_users import settings as app_settings
 from openwisp_users.api.throttling import AuthRateThrottle
 
 from ..models import Book, Library, Shelf
@@ -141,6 +144,34 @@ class TestFilterClasses(AssertNumQueriesSubTestMixin, TestMultitenancyMixin, Tes
         self.assertEqual(response.data[0]['id'], str(self.shelf_a.id))
         self.assertNotContains(response, str(self.shelf_b.id))
 
+    @mock.patch.object(app_settings, 'ORGANIZATIONS_SUBQUERY_THRESHOLD', 0)
+    def test_filter_by_org_managed_subquery(self):
+        operator = self._get_operator()
+        self._create_org_user(
+            user=operator, is_admin=True, organization=self._get_org('org_a')
+        )
+        token = self._obtain_auth_token(operator)
+        with self.subTest('FilterByOrganization'):
+            url = reverse('test_shelf_list_manager_view')
+            response = self.client.get(url, HTTP_AUTHORIZATION=f'Bearer {token}')
+            self.assertEqual(len(response.data), 1)
+            self.assertEqual(response.data[0]['id'], str(self.shelf_a.id))
+        with self.subTest('FilterByParent'):
+            url = reverse('test_books_list_manager_view', args=(self.shelf_a.id,))
+            response = self.client.get(url, HTTP_AUTHORIZATION=f'Bearer {token}')
+            self.assertEqual(response.data[0]['id'], str(self.book1.id))
+            url = reverse('test_books_list_manager_view', args=(self.shelf_b.id,))
+            response = self.client.get(url, HTTP_AUTHORIZATION=f'Bearer {token}')
+            self.assertEqual(response.status_code, 404)
+        with self.subTest('FilterSerializerByOrganization'):
+            url = reverse('test_books_list_manager_view', args=(self.shelf_a.id,))
+            response = self.client.get(
+                url, {'format': 'api'}, HTTP_AUTHORIZATION=f'Bearer {token}'
+            )
+            self.assertContains(response, 'org_a</option>')
+            self.assertNotContains(response, 'org_b</option>')
+            self.assertNotContains(response, 'test-shelf-b</option>')
+
     def test_filter_by_org_managed_shared_objects(self):
         self._create_shelf(name='shared_shelf', organization=None)
         operator = self._get_operator()
@@ -238,7 +269,9 @@ class TestFilterClasses(AssertNumQueriesSubTestMixin, TestMultitenancyMixin, Tes
         )
         token = self._obtain_auth_token(operator)
         url = reverse('test_book_nested_shelf')
-        with self.assertNumQueries(6):
+        # the membership of the operator is not committed during the test,
+        # therefore its organizations are loaded from the database
+        with self.assertNumQueries(7):
             response = self.client.get(url, HTTP_AUTHORIZATION=f'Bearer {token}')
         self.assertEqual(response.status_code, 200)
 
@@ -256,7 +289,9 @@ class TestFilterClasses(AssertNumQueriesSubTestMixin, TestMultitenancyMixin, Tes
             'author': 'test-auther',
             'organization': org1.pk,
         }
-        with self.assertNumQueries(12):
+        # the membership of the operator is not committed during the test,
+        # therefore its organizations are loaded from the database
+        with self.assertNumQueries(13):
             response = self.client.post(
                 url,
                 data,
@@ -274,7 +309,9 @@ class TestFilterClasses(AssertNumQueriesSubTestMixin, TestMultitenancyMixin, Tes
         self.client.force_login(operator)
         self._create_shelf(name='test-shelf-a', organization=org1)
         path = reverse('test_shelf_list_with_read_only_org')
-        with self.assertNumQueries(4):
+        # the membership of the operator is not committed during the test,
+        # therefore its organizations are loaded from the database
+        with self.assertNumQueries(5):
             response = self.client.get(path, {'format': 'api'})
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.data[0]['organization'], org1.pk)
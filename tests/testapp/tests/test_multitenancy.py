@@ -1,6 +1,12 @@
-from django.test import TestCase
+from unittest import mock
+
+from django.contrib import admin
+from django.test import RequestFactory, TestCase
 from django.urls import reverse
 
+from openwisp_users import settings as app_settings
+from openwisp_users.multitenancy import MultitenantOrgFilter, filter_in, filter_union
+
 from ..models import Book, Shelf
 from .mixins import TestMultitenancyMixin
 
@@ -89,3 +95,119 @@ class TestMultitenancy(TestMultitenancyMixin, TestCase):
             hidden=[data['s2'].name, data['s3_inactive'].name],
             select_widget=True,
         )
+
+    @mock.patch.object(app_settings, 'ORGANIZATIONS_SUBQUERY_THRESHOLD', 0)
+    def test_subquery_lookups(self):
+        data = self._create_multitenancy_test_env()
+        with self.subTest('changelist'):
+            self._test_multitenant_admin(
+                url=reverse('admin:testapp_book_changelist'),
+                visible=[data['b1'].name, data['s1'].name, data['org1'].name],
+                hidden=[data['b2'].name, data['org2'].name, data['b3_inactive'].name],
+            )
+        with self.subTest('form'):
+            self._test_multitenant_admin(
+                url=reverse('admin:testapp_book_add'),
+                visible=[data['s1'].name, data['org1'].name],
+                hidden=[data['s2'].name, data['org2'].name, data['inactive']],
+                select_widget=True,
+            )
+
+    def test_shared_relations_filter_strategies(self):
+        data = self._create_multitenancy_test_env()
+        shared = self._create_shelf(name='shared-shelf', organization=None)
+        book_admin = admin.site._registry[Book]
+
+        def _test_strategy():
+            self._test_multitenant_admin(
+                url=reverse('admin:testapp_book_add'),
+                visible=[data['s1'].name, shared.name],
+                hidden=[data['s2'].name, data['s3_inactive'].name],
+                select_widget=True,
+            )
+
+        for strategy in ['in', 'exists', 'union']:
+            with self.subTest(strategy):
+                with mock.patch.object(
+                    book_admin, 'multitenant_filter_strategies', {'shelf': strategy}
+                ):
+                    _test_strategy()
+
+        request = RequestFactory().get('/')
+        request.user = data['operator']
+        with self.subTest('default strategy'):
+            self.assertIs(
+                book_admin.get_multitenant_filter_strategy(request, 'shelf'), filter_in
+            )
+            with mock.patch.object(app_settings, 'ORGANIZATIONS_SUBQUERY_THRESHOLD', 0):
+                self.assertIs(
+                    book_admin.get_multitenant_filter_strategy(request, 'shelf'),
+                    filter_union,
+                )
+                _test_strategy()
+
+        with self.subTest('custom strategy'):
+
+            def shared_only(queryset, user):
+                return queryset.filter(organization=None)
+
+            with mock.patch.object(
+                book_admin, 'multitenant_filter_strategies', {'shelf': shared_only}
+            ):
+                self._test_multitenant_admin(
+                    url=reverse('admin:testapp_book_add'),
+                    visible=[shared.name],
+                    hidden=[data['s1'].name, data['s2'].name],
+                    select_widget=True,
+                )
+
+    def test_filter_choices_cache(self):
+        data = self._create_multitenancy_test_env()
+        url = reverse('admin:testapp_book_changelist')
+        self.client.force_login(data['operator'])
+
+        with mock.patch.object(
+            MultitenantOrgFilter,
+            '_field_choices',
+            autospec=True,
+            side_effect=MultitenantOrgFilter._field_choices,
+        ) as field_choices:
+            with self.subTest('choices are cached'):
+                response = self.client.get(url)
+                self.assertContains(response, data['s1'].name)
+                self.assertEqual(field_choices.call_count, 2)
+                field_choices.reset_mock()
+                response = self.client.get(url)
+                self.assertContains(response, data['s1'].name)
+                self.assertEqual(field_choices.call_count, 0)
+
+            with self.subTest('organization renamed'):
+                data['org1'].name = 'renamed-org'
+                data['org1'].save()
+                response = self.client.get(url)
+                self.assertContains(response, 'renamed-org')
+                self.assertEqual(field_choices.call_count, 1)
+                field_choices.reset_mock()
+
+            with self.subTest('related object created'):
+                shelf = self._create_shelf(name='new-shelf', organization=data['org1'])
+                response = self.client.get(url)
+                self.assertContains(response, shelf.name)
+                self.assertEqual(field_choices.call_count, 1)
+                field_choices.reset_mock()
+
+            with self.subTest('organizations managed changed'):
+                self.assertNotContains(response, data['s2'].name)
+                self._create_org_user(
+                    user=data['operator'], organization=data['org2'], is_admin=True
+                )
+                response = self.client.get(url)
+                self.assertContains(response, data['s2'].name)
+                self.assertEqual(field_choices.call_count, 2)
+                field_choices.reset_mock()
+
+            with mock.patch.object(app_settings, 'FILTER_CHOICES_CACHE_TIMEOUT', 0):
+                with self.subTest('cache disabled'):
+                    self.client.get(url)
+                    self.client.get(url)
+                    self.assertEqual(field_choices.call_count, 4)